@@ -1,9 +1,63 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import os
 import requests
 import json
+import asyncio
 import base64
+import binascii
+import collections
+import contextlib
+import contextvars
+import csv
+import functools
+import hashlib
+import heapq
+import html.parser
+import io
+import itertools
+import math
+import mimetypes
+import mmap
+import queue
+import random
+import re
+import signal
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import unquote_to_bytes, urlparse
+
+from prompts import (
+    CSV_INSTRUCTIONS, HTML_PROMPT, PROMPT_TOKEN_BUDGET, README_PROMPT, REVISION_PROMPT,
+    bullet_lines, estimate_tokens, fit_prompt, truncate_attachments, truncate_items, truncate_text
+)
+
+try:
+    import fcntl  # Unix only; without it jobs of dead processes are not detected
+except ImportError:
+    fcntl = None
+
+try:
+    import httpx  # Only needed for BUILD_EXECUTOR=async
+except ImportError:
+    httpx = None
+
+try:
+    import lxml.html  # Optional faster parser for page validation
+except ImportError:
+    lxml = None
+
+try:
+    import zstandard  # Optional, artifacts fall back to zlib
+except ImportError:
+    zstandard = None
 
 app = Flask(__name__)
 
@@ -14,687 +68,5275 @@ GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
 GITHUB_USERNAME = os.environ.get('GITHUB_USERNAME')
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY') 
 
+# Build worker pool settings. With the threads executor a build holds its
+# worker through the LLM and GitHub stages, so there is one worker per LLM
+# call allowed in flight by default: the per-stage limits, not the pool,
+# decide how far builds overlap.
+LLM_MAX_IN_FLIGHT = int(os.environ.get('LLM_MAX_IN_FLIGHT', '32'))  # LLM calls across all builds (0 = no cap)
+BUILD_WORKERS = int(os.environ.get('BUILD_WORKERS', str(LLM_MAX_IN_FLIGHT or 4)))
+BUILD_QUEUE_SIZE = int(os.environ.get('BUILD_QUEUE_SIZE', '100'))
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'memory')  # "memory" or "sqlite"
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+BUILD_DRAIN_TIMEOUT = float(os.environ.get('BUILD_DRAIN_TIMEOUT', '120'))  # seconds to finish builds on shutdown
+BUILD_EXECUTOR = os.environ.get('BUILD_EXECUTOR', 'threads')  # "threads" or "async" (requires httpx)
+ASYNC_MAX_BUILDS = int(os.environ.get('ASYNC_MAX_BUILDS', '200'))  # concurrent builds on the event loop
+BATCH_MAX_BUILDS = int(os.environ.get('BATCH_MAX_BUILDS', '100'))  # builds per POST /build-batch
+
+# Admission control for new builds
+ADMISSION_MAX_BUILDS = int(os.environ.get('ADMISSION_MAX_BUILDS', str(BUILD_QUEUE_SIZE)))  # queued, running or deploying
+ADMISSION_ROUND2_RESERVE = int(os.environ.get('ADMISSION_ROUND2_RESERVE', '10'))  # slots only Round 2 of a deployed task may use
+ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', '0'))  # seconds /build-app may wait for capacity before 429 (0 = answer at once)
+ADMISSION_GITHUB_CALLS_PER_BUILD = int(os.environ.get('ADMISSION_GITHUB_CALLS_PER_BUILD', '15'))  # GitHub quota kept per build
+
+# GitHub Pages deployment polling (seconds)
+PAGES_DEPLOY_TIMEOUT = float(os.environ.get('PAGES_DEPLOY_TIMEOUT', '300'))
+PAGES_POLL_INITIAL = float(os.environ.get('PAGES_POLL_INITIAL', '3'))
+PAGES_POLL_MAX = float(os.environ.get('PAGES_POLL_MAX', '20'))
+
+# Pool of pre-created, Pages-enabled repos claimed by Round 1 builds (0 disables)
+REPO_POOL_SIZE = int(os.environ.get('REPO_POOL_SIZE', '0'))
+REPO_POOL_REFILL_INTERVAL = float(os.environ.get('REPO_POOL_REFILL_INTERVAL', '5'))  # seconds between creations
+REPO_POOL_PREFIX = os.environ.get('REPO_POOL_PREFIX', 'pool-')
+SPECULATIVE_REPOS = os.environ.get('SPECULATIVE_REPOS', 'true').lower() == 'true'  # create the Round 1 repo during generation
+
+
+# Optional JSON-lines trace log (one line per pipeline stage)
+TRACE_LOG_PATH = os.environ.get('TRACE_LOG_PATH')
+
+# Evaluator notification outbox
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', '2'))
+OUTBOX_HOST_CONCURRENCY = int(os.environ.get('OUTBOX_HOST_CONCURRENCY', '2'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', '2'))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', '300'))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', '1'))
+
+# Upstream APIs and shared HTTP client settings
+GITHUB_API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+GEMINI_API_URL = os.environ.get('GEMINI_API_URL', 'https://generativelanguage.googleapis.com/v1beta')
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+GITHUB_WEB_URL = os.environ.get('GITHUB_WEB_URL', 'https://github.com')
+PAGES_SITE_URL = os.environ.get('PAGES_SITE_URL', 'https://{owner}.github.io/{repo}/')  # template
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '20'))
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', '30'))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '3'))
+HTTP_MAX_RETRY_WAIT = float(os.environ.get('HTTP_MAX_RETRY_WAIT', '60'))
+HTTP_RATE_PER_HOST = float(os.environ.get('HTTP_RATE_PER_HOST', '10'))
+HTTP_BURST_PER_HOST = int(os.environ.get('HTTP_BURST_PER_HOST', '20'))
+GITHUB_WRITES_IN_FLIGHT = int(os.environ.get('GITHUB_WRITES_IN_FLIGHT', '8'))  # POST/PATCH/DELETE across all builds (0 = no cap)
+
+# LLM generation settings
+LLM_HTML_TIMEOUT = float(os.environ.get('LLM_HTML_TIMEOUT', '120'))
+LLM_README_TIMEOUT = float(os.environ.get('LLM_README_TIMEOUT', '60'))
+LLM_THREADS = int(os.environ.get('LLM_THREADS', str(LLM_MAX_IN_FLIGHT or 8)))  # HTML and README calls of threaded builds
+LLM_REVISION_MAX_TOKENS = int(os.environ.get('LLM_REVISION_MAX_TOKENS', '4000'))
+LLM_STREAMING = os.environ.get('LLM_STREAMING', 'true').lower() == 'true'
+PAGE_VALIDATION = os.environ.get('PAGE_VALIDATION', 'true').lower() == 'true'  # check pages against checks before pushing
+LLM_PROVIDERS = os.environ.get('LLM_PROVIDERS', 'gemini,openrouter')  # preference order; keyless ones are skipped
+OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL', 'openai/gpt-4o-mini')
+LLM_HEDGING = os.environ.get('LLM_HEDGING', 'false').lower() == 'true'  # off: a hedge can double a slow call's tokens
+LLM_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', '0.95'))  # of time to first token
+LLM_HEDGE_DELAY = float(os.environ.get('LLM_HEDGE_DELAY', '10'))  # seconds, until there are enough samples
+LLM_HEDGE_MIN_DELAY = float(os.environ.get('LLM_HEDGE_MIN_DELAY', '1'))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_COOLDOWN = float(os.environ.get('LLM_BREAKER_COOLDOWN', '30'))
+LLM_EWMA_ALPHA = float(os.environ.get('LLM_EWMA_ALPHA', '0.2'))
+GENERATION_CACHE_ENABLED = os.environ.get('GENERATION_CACHE_ENABLED', 'true').lower() == 'true'
+GENERATION_CACHE_TTL = float(os.environ.get('GENERATION_CACHE_TTL', '86400'))
+GENERATION_CACHE_MAX_ENTRIES = int(os.environ.get('GENERATION_CACHE_MAX_ENTRIES', '500'))
+GENERATION_CACHE_MAX_BYTES = int(os.environ.get('GENERATION_CACHE_MAX_BYTES', str(50 * 1024 * 1024)))
+ARTIFACT_STORE_MAX_BYTES = int(os.environ.get('ARTIFACT_STORE_MAX_BYTES', str(200 * 1024 * 1024)))
+MAX_ATTACHMENT_BYTES = int(os.environ.get('MAX_ATTACHMENT_BYTES', str(10 * 1024 * 1024)))
+ATTACHMENT_SAMPLE_ROWS = int(os.environ.get('ATTACHMENT_SAMPLE_ROWS', '5'))
+ATTACHMENT_SAMPLE_BYTES = int(os.environ.get('ATTACHMENT_SAMPLE_BYTES', '65536'))
+REPO_STATE_MAX_CONTENT_BYTES = int(os.environ.get('REPO_STATE_MAX_CONTENT_BYTES', str(512 * 1024)))
+HTML_START_LIMIT = int(os.environ.get('HTML_START_LIMIT', '2000'))  # chars allowed before <html must appear
 
 # OpenRouter API endpoint
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
-print(f"🔑 Secret: {'✅' if MY_SECRET else '❌'}")
-print(f"🔑 OpenRouter: {'✅' if OPENROUTER_API_KEY else '❌'}")
-print(f"🔑 GitHub Token: {'✅' if GITHUB_TOKEN else '❌'}")
-print(f"🔑 GitHub User: {GITHUB_USERNAME}")
-print(f"🔑 Gemini: {'✅' if GEMINI_API_KEY else '❌'}")  # ← Add this
+OPENROUTER_URL = os.environ.get('OPENROUTER_URL', 'https://openrouter.ai/api/v1/chat/completions')
 
-@app.route('/', methods=['GET'])
-def home():
-    """Health check endpoint"""
-    return jsonify({
-        "status": "running",
-        "message": "LLM App Builder API is live!",
-        "endpoints": ["/build-app"]
-    })
 
-# Add this test endpoint to your Flask app temporarily
-@app.route('/test-gemini', methods=['GET'])
-def test_gemini():
+def log_startup_config():
+    """Prints which credentials are configured. Called once per server start, not on every import."""
+    print(f"🔑 Secret: {'✅' if MY_SECRET else '❌'}")
+    print(f"🔑 OpenRouter: {'✅' if OPENROUTER_API_KEY else '❌'}")
+    print(f"🔑 GitHub Token: {'✅' if GITHUB_TOKEN else '❌'}")
+    print(f"🔑 GitHub User: {GITHUB_USERNAME}")
+    print(f"🔑 Gemini: {'✅' if GEMINI_API_KEY else '❌'}")
+    
+    # Check if required environment variables are set
+    if not OPENROUTER_API_KEY:
+        print("⚠️ WARNING: OPENROUTER_API_KEY not set!")
+    if not GITHUB_TOKEN:
+        print("⚠️ WARNING: GITHUB_TOKEN not set!")
+    if BUILD_EXECUTOR == "async" and httpx is None:
+        print("⚠️ WARNING: BUILD_EXECUTOR=async needs httpx (pip install httpx)")
+
+
+# ===== METRICS AND TRACING =====
+
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry (counters, gauges, histograms)
+    rendered in the Prometheus text format by GET /metrics.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge_add(self, name, labels=None, delta=1):
+        key = self._key(name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def gauge_set(self, name, labels=None, value=0):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, labels=None, value=0.0, buckets=HISTOGRAM_BUCKETS):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.setdefault(key, {
+                "bounds": buckets, "buckets": [0] * len(buckets), "sum": 0.0, "count": 0
+            })
+            for i, bound in enumerate(histogram['bounds']):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+            return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+        
+        lines = []
+        with self.lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (series_name, labels), value in series.items():
+                        if series_name == name:
+                            lines.append(f"{name}{label_text(labels)} {value}")
+            
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (series_name, labels), histogram in self.histograms.items():
+                    if series_name != name:
+                        continue
+                    for bound, count in zip(histogram['bounds'], histogram['buckets']):
+                        lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {histogram['count']}")
+                    lines.append(f"{name}_sum{label_text(labels)} {histogram['sum']}")
+                    lines.append(f"{name}_count{label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+trace_id = contextvars.ContextVar('trace_id', default=None)
+trace_lock = threading.Lock()
+
+
+def trace_event(event, **fields):
+    """Appends one JSON line to TRACE_LOG_PATH (if set), tagged with the current trace id"""
+    if not TRACE_LOG_PATH:
+        return
+    record = {"ts": time.time(), "trace_id": trace_id.get(), "event": event, **fields}
+    with trace_lock:
+        with open(TRACE_LOG_PATH, "a") as trace_file:
+            trace_file.write(json.dumps(record, default=str) + "\n")
+
+
+def traced(stage):
+    """
+    Decorator that times a pipeline stage. Records duration, in-flight and
+    failure metrics; an exception, None, False or (None, None) counts as a failure.
+    """
+    labels = {"stage": stage}
+
+    def record(started, status):
+        duration = time.monotonic() - started
+        metrics.gauge_add("build_stage_in_flight", labels, -1)
+        metrics.observe("build_stage_duration_seconds", labels, duration)
+        if status != "ok":
+            metrics.inc("build_stage_failures_total", labels)
+        trace_event("stage", stage=stage, status=status, duration=round(duration, 4))
+
+    def result_status(result):
+        return "failed" if result is None or result is False or result == (None, None) else "ok"
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                metrics.gauge_add("build_stage_in_flight", labels, 1)
+                started = time.monotonic()
+                status = "error"
+                try:
+                    result = await func(*args, **kwargs)
+                    status = result_status(result)
+                    return result
+                finally:
+                    record(started, status)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics.gauge_add("build_stage_in_flight", labels, 1)
+            started = time.monotonic()
+            status = "error"
+            try:
+                result = func(*args, **kwargs)
+                status = result_status(result)
+                return result
+            finally:
+                record(started, status)
+        return wrapper
+    return decorator
+
+
+def submit_with_context(executor, func, *args):
+    """Submits to a thread pool while keeping the caller's trace id"""
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+
+# ===== SHARED HTTP CLIENT =====
+
+GITHUB_HEADERS = {
+    "Authorization": f"token {GITHUB_TOKEN}",
+    "Accept": "application/vnd.github.v3+json"
+}
+
+
+class RateLimiter:
+    """
+    Token bucket for one upstream host.
+    
+    Runs at `rate` requests/second with bursts up to `burst`. GitHub's
+    X-RateLimit-* headers slow the bucket down when the remaining quota gets
+    low, and Retry-After (or an exhausted quota) blocks it until the reset.
+    """
+
+    def __init__(self, rate, burst, low_water=200):
+        self.default_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.low_water = low_water
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.remaining = None
+        self.reset_at = None  # epoch seconds of the quota reset, from X-RateLimit-Reset
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Takes a token if one is available. Returns 0, or the seconds to wait before trying again."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if now >= self.blocked_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate if self.rate else 1.0)
+        return min(wait, HTTP_MAX_RETRY_WAIT)
+
+    def acquire(self):
+        """Blocks until a request may be sent"""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Like acquire(), but waits on the event loop instead of blocking the thread"""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def block_for(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def blocked_for(self):
+        """Seconds left of a Retry-After or exhausted-quota block (0 if none)"""
+        with self.lock:
+            return max(self.blocked_until - time.monotonic(), 0)
+
+    def reset_in(self):
+        """Seconds until the quota resets (0 if unknown or past)"""
+        with self.lock:
+            return max(self.reset_at - time.time(), 0) if self.reset_at else 0
+
+    def update(self, response):
+        """Feeds rate-limit response headers back into the bucket"""
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        retry_after = response.headers.get('Retry-After')
+        
+        if retry_after and retry_after.isdigit():
+            self.block_for(int(retry_after))
+        
+        if remaining is None or reset is None:
+            return
+        
+        remaining = int(remaining)
+        seconds_to_reset = max(int(reset) - time.time(), 1)
+        with self.lock:
+            self.remaining = remaining
+            self.reset_at = int(reset)
+            if remaining <= self.low_water:
+                # Spread what is left of the quota over the rest of the window
+                self.rate = max(remaining, 1) / seconds_to_reset
+            else:
+                self.rate = self.default_rate
+        if remaining == 0:
+            self.block_for(seconds_to_reset)
+
+
+class EndpointStats:
+    """Per-endpoint request counts, latency and retries"""
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status, retries):
+        with self.lock:
+            entry = self.stats.setdefault(endpoint, {
+                "requests": 0, "errors": 0, "retries": 0,
+                "total_seconds": 0.0, "max_seconds": 0.0
+            })
+            entry['requests'] += 1
+            entry['retries'] += retries
+            entry['total_seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            if status is None or status >= 400:
+                entry['errors'] += 1
+        
+        labels = {"endpoint": endpoint}
+        metrics.observe("http_request_duration_seconds", labels, seconds)
+        metrics.inc("http_requests_total", dict(labels, status=str(status)))
+        if retries:
+            metrics.inc("http_retries_total", labels, retries)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                endpoint: dict(entry, avg_seconds=entry['total_seconds'] / entry['requests'])
+                for endpoint, entry in self.stats.items()
+            }
+
+
+class StageLimit:
+    """
+    Caps how many calls of one pipeline stage are in flight across all
+    builds. Worker threads wait in slot(), coroutines in aslot(); both share
+    one FIFO of waiters, so the cap holds whichever executor (or background
+    task) makes the call. A limit of 0 means unlimited.
+    """
+
+    def __init__(self, stage, limit):
+        self.stage = stage
+        self.limit = limit
+        self.in_flight = 0
+        self.waiters = collections.deque()  # threading.Event or asyncio future
+        self.lock = threading.Lock()
+
+    def _try_acquire(self):
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    def release(self):
+        """Hands the slot to the oldest waiter, or frees it"""
+        with self.lock:
+            if self.waiters:
+                waiter = self.waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                else:
+                    waiter.get_loop().call_soon_threadsafe(self._wake, waiter)
+                return
+            self.in_flight -= 1
+
+    def _wake(self, future):
+        if future.done():
+            self.release()  # cancelled while the slot was on its way
+        else:
+            future.set_result(None)
+
+    def _record(self, waited):
+        labels = {"stage": self.stage}
+        metrics.observe("stage_slot_wait_seconds", labels, waited)
+        metrics.gauge_set("stage_in_flight", labels, self.in_flight)
+
+    @contextlib.contextmanager
+    def slot(self):
+        if self.limit <= 0:
+            yield
+            return
+        started = time.monotonic()
+        with self.lock:
+            event = None if self._try_acquire() else threading.Event()
+            if event:
+                self.waiters.append(event)
+        if event:
+            event.wait()
+        self._record(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def aslot(self):
+        if self.limit <= 0:
+            yield
+            return
+        started = time.monotonic()
+        with self.lock:
+            future = None if self._try_acquire() else asyncio.get_running_loop().create_future()
+            if future:
+                self.waiters.append(future)
+        if future:
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self.lock:
+                    if future in self.waiters:
+                        self.waiters.remove(future)
+                        raise
+                if not future.cancelled():
+                    self.release()  # the slot arrived just before the cancel
+                raise
+        self._record(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+http_sessions = {}
+rate_limiters = {}
+http_stats = EndpointStats()
+http_lock = threading.Lock()
+llm_calls = StageLimit("llm", LLM_MAX_IN_FLIGHT)
+github_writes = StageLimit("github_write", GITHUB_WRITES_IN_FLIGHT)
+
+
+def get_session(host):
+    """Returns the pooled keep-alive session for a host"""
+    with http_lock:
+        if host not in http_sessions:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            http_sessions[host] = session
+            rate_limiters[host] = RateLimiter(HTTP_RATE_PER_HOST, HTTP_BURST_PER_HOST)
+        return http_sessions[host], rate_limiters[host]
+
+
+def endpoint_key(method, url):
+    """Groups URLs into endpoints for stats, e.g. 'GET api.github.com/repos/{owner}/{repo}/pages'"""
+    parsed = urlparse(url)
+    if parsed.netloc not in (urlparse(GITHUB_API_URL).netloc, urlparse(GEMINI_API_URL).netloc):
+        # Evaluator and Pages site URLs: one endpoint per host
+        return f"{method.upper()} {parsed.netloc}"
+    path = re.sub(r"^/repos/[^/]+/[^/]+", "/repos/{owner}/{repo}", parsed.path)
+    path = re.sub(r"/contents/.+$", "/contents/{path}", path)
+    path = re.sub(r"/[0-9a-f]{40}$", "/{sha}", path)
+    return f"{method.upper()} {parsed.netloc}{path}"
+
+
+def is_retryable(response):
+    if response.status_code in (429, 500, 502, 503, 504):
+        return True
+    if response.status_code == 403:
+        # Primary (quota exhausted) or secondary rate limit
+        return (response.headers.get('X-RateLimit-Remaining') == '0'
+                or 'rate limit' in response.text.lower())
+    return False
+
+
+def retry_wait(response, attempt):
+    """Seconds to wait before retrying: Retry-After if given, else jittered exponential backoff"""
+    retry_after = response.headers.get('Retry-After')
+    wait = int(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt + random.random()
+    return min(wait, HTTP_MAX_RETRY_WAIT)
+
+
+def http_request(method, url, max_retries=None, **kwargs):
+    """
+    Sends a request through the pooled session for the URL's host.
+    
+    Waits on the host's rate limiter, retries rate-limited and 5xx
+    responses (honouring Retry-After) and records latency per endpoint.
+    Non-retryable error responses are returned to the caller as-is.
+    """
+    if max_retries is None:
+        max_retries = HTTP_MAX_RETRIES
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    
+    host = urlparse(url).netloc
+    session, limiter = get_session(host)
+    endpoint = endpoint_key(method, url)
+    started = time.monotonic()
+    
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException:
+            if attempt == max_retries:
+                http_stats.record(endpoint, time.monotonic() - started, None, attempt)
+                raise
+            time.sleep(min(2 ** attempt, HTTP_MAX_RETRY_WAIT))
+            continue
+        
+        limiter.update(response)
+        if attempt == max_retries or not is_retryable(response):
+            http_stats.record(endpoint, time.monotonic() - started, response.status_code, attempt)
+            return response
+        
+        wait = retry_wait(response, attempt)
+        print(f"⚠️ {endpoint} returned {response.status_code}, retrying in {wait:.1f}s...")
+        time.sleep(wait)
+
+
+def github_request(method, path, **kwargs):
+    """
+    Calls the GitHub REST API (path like '/user/repos') with the shared auth
+    headers. Writes wait for one of GITHUB_WRITES_IN_FLIGHT slots.
+    """
+    if method in ("GET", "HEAD"):
+        return http_request(method, f"{GITHUB_API_URL}{path}", headers=GITHUB_HEADERS, **kwargs)
+    with github_writes.slot():
+        return http_request(method, f"{GITHUB_API_URL}{path}", headers=GITHUB_HEADERS, **kwargs)
+
+
+def gemini_url(action):
+    return f"{GEMINI_API_URL}/models/{GEMINI_MODEL}:{action}"
+
+
+def gemini_request(payload, timeout, action="generateContent", **kwargs):
+    """Calls a Gemini model action. The API key goes in a header, not the URL."""
+    headers = {"x-goog-api-key": GEMINI_API_KEY or ""}
+    return http_request("POST", gemini_url(action), headers=headers, json=payload, timeout=timeout, **kwargs)
+
+
+class AsyncRuntime:
+    """
+    Event loop thread for BUILD_EXECUTOR=async.
+    
+    Builds run as coroutines on one loop and share one httpx.AsyncClient, so
+    a build waiting on Gemini, GitHub or a Pages deployment holds no thread.
+    The loop is started on first use, i.e. after a gunicorn fork.
+    """
+
+    def __init__(self, max_builds):
+        self.max_builds = max_builds
+        self.slots = threading.BoundedSemaphore(max_builds)
+        self.loop = None
+        self.client = None
+        self.interrupted = None
+        self.deploy_waits = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.loop:
+                return
+            if httpx is None:
+                raise RuntimeError("BUILD_EXECUTOR=async requires httpx")
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            threading.Thread(target=self._run, args=(ready,), name="build-loop", daemon=True).start()
+            ready.wait()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        # LLM calls hold a connection for the whole generation: HTML and
+        # README per build, each possibly hedged to a second provider
+        limits = httpx.Limits(max_connections=self.max_builds * 4, max_keepalive_connections=HTTP_POOL_SIZE)
+        self.client = httpx.AsyncClient(limits=limits, timeout=HTTP_TIMEOUT)
+        self.interrupted = asyncio.Event()
+        ready.set()
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedules a coroutine on the loop. Returns a concurrent.futures.Future."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def interrupt(self):
+        """Ends every Pages deploy wait on the loop with "interrupted". Returns how many there were."""
+        if not self.loop:
+            return 0
+        self.loop.call_soon_threadsafe(self.interrupted.set)
+        return self.deploy_waits
+
+
+async_runtime = AsyncRuntime(ASYNC_MAX_BUILDS)
+
+
+async def ahttp_request(method, url, max_retries=None, **kwargs):
+    """
+    Coroutine version of http_request on the shared httpx.AsyncClient: the
+    same per-host rate limiters, retries and endpoint stats, with the waits
+    done on the event loop.
+    """
+    if max_retries is None:
+        max_retries = HTTP_MAX_RETRIES
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    
+    _, limiter = get_session(urlparse(url).netloc)
+    endpoint = endpoint_key(method, url)
+    started = time.monotonic()
+    
+    for attempt in range(max_retries + 1):
+        await limiter.acquire_async()
+        try:
+            response = await async_runtime.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            if attempt == max_retries:
+                http_stats.record(endpoint, time.monotonic() - started, None, attempt)
+                raise
+            await asyncio.sleep(min(2 ** attempt, HTTP_MAX_RETRY_WAIT))
+            continue
+        
+        limiter.update(response)
+        if attempt == max_retries or not is_retryable(response):
+            http_stats.record(endpoint, time.monotonic() - started, response.status_code, attempt)
+            return response
+        
+        wait = retry_wait(response, attempt)
+        print(f"⚠️ {endpoint} returned {response.status_code}, retrying in {wait:.1f}s...")
+        await asyncio.sleep(wait)
+
+
+async def agithub_request(method, path, **kwargs):
+    if method in ("GET", "HEAD"):
+        return await ahttp_request(method, f"{GITHUB_API_URL}{path}", headers=GITHUB_HEADERS, **kwargs)
+    async with github_writes.aslot():
+        return await ahttp_request(method, f"{GITHUB_API_URL}{path}", headers=GITHUB_HEADERS, **kwargs)
+
+
+async def agemini_request(payload, timeout, action="generateContent", **kwargs):
+    headers = {"x-goog-api-key": GEMINI_API_KEY or ""}
+    return await ahttp_request("POST", gemini_url(action), headers=headers, json=payload, timeout=timeout, **kwargs)
+
+
+# ===== SHARED STEPS FOR BOTH EXECUTORS =====
+# Build steps that do I/O are written once, as generators that yield the
+# calls they need. run_steps performs those on the calling thread (threads
+# executor); arun_steps awaits them on the event loop (async executor).
+
+class Call:
+    """
+    One call yielded by a step generator; the result is sent back into it.
+    run_steps calls `func`. arun_steps awaits `afunc`, or runs `func` in a
+    worker thread if there is no coroutine version (SQLite, files), so
+    blocking work never stalls the event loop.
+    """
+
+    def __init__(self, func, *args, afunc=None, **kwargs):
+        self.func = func
+        self.afunc = afunc
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Parallel:
+    """Runs several Calls concurrently; the step receives their results as a list"""
+
+    def __init__(self, calls):
+        self.calls = list(calls)
+
+
+class Background:
+    """Starts a Call without waiting for it; the step receives a handle to Join later"""
+
+    def __init__(self, call):
+        self.call = call
+
+
+class Join:
+    """Waits for a Background call; the step receives its result"""
+
+    def __init__(self, handle):
+        self.handle = handle
+
+
+def github_call(method, path, **kwargs):
+    return Call(github_request, method, path, afunc=agithub_request, **kwargs)
+
+
+def stage_call(job_id, stage, status, **info):
+    return Call(build_queue.set_stage, job_id, stage, status, **info)
+
+
+background_executor = ThreadPoolExecutor(max_workers=BUILD_WORKERS, thread_name_prefix="background-step")
+
+
+def perform_step(step):
+    if isinstance(step, Call):
+        return step.func(*step.args, **step.kwargs)
+    if isinstance(step, Parallel):
+        if not step.calls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(step.calls), 8)) as executor:
+            futures = [submit_with_context(executor, perform_step, call) for call in step.calls]
+            return [future.result() for future in futures]
+    if isinstance(step, Background):
+        return submit_with_context(background_executor, perform_step, step.call)
+    if isinstance(step, Join):
+        return step.handle.result()
+    raise TypeError(f"Unknown step: {step!r}")
+
+
+async def aperform_step(step):
+    if isinstance(step, Call):
+        if step.afunc:
+            return await step.afunc(*step.args, **step.kwargs)
+        return await asyncio.to_thread(step.func, *step.args, **step.kwargs)
+    if isinstance(step, Parallel):
+        return list(await asyncio.gather(*(aperform_step(call) for call in step.calls)))
+    if isinstance(step, Background):
+        return asyncio.ensure_future(aperform_step(step.call))
+    if isinstance(step, Join):
+        return await step.handle
+    raise TypeError(f"Unknown step: {step!r}")
+
+
+def run_steps(steps):
+    """
+    Runs a step generator on the calling thread. Exceptions raised by a
+    call are thrown into the generator at its yield.
+    
+    Returns:
+        The generator's return value
+    """
+    reply, error = None, None
+    while True:
+        try:
+            step = steps.throw(error) if error else steps.send(reply)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            reply, error = perform_step(step), None
+        except Exception as e:
+            reply, error = None, e
+
+
+async def arun_steps(steps):
+    """Coroutine version of run_steps"""
+    reply, error = None, None
+    while True:
+        try:
+            step = steps.throw(error) if error else steps.send(reply)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            reply, error = await aperform_step(step), None
+        except Exception as e:
+            reply, error = None, e
+
+
+# ===== LLM PROVIDERS AND ROUTER =====
+# Every LLM call goes through llm_router. Payloads are built in Gemini's
+# generateContent format and converted for the other providers.
+
+def stream_sse_text(url, headers, payload, timeout, parse_line, label, max_retries=None, params=None):
+    """
+    POSTs a streaming request and yields the text that `parse_line` pulls
+    out of each server-sent event line. Closing the generator early closes
+    the connection, so callers can stop reading once they have enough.
+    """
+    response = http_request("POST", url, headers=headers, json=payload, timeout=timeout,
+                            params=params, stream=True, max_retries=max_retries)
     try:
-        GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={GEMINI_API_KEY}"
+        if response.status_code != 200:
+            raise RuntimeError(f"{label} Error: {response.text}")
+        
+        for line in response.iter_lines(decode_unicode=True):
+            yield from parse_line(line)
+    finally:
+        response.close()
+
+
+async def astream_sse_text(url, headers, payload, timeout, parse_line, label, max_retries=None, params=None):
+    """Coroutine version of stream_sse_text on the shared async client (an async generator)"""
+    if max_retries is None:
+        max_retries = HTTP_MAX_RETRIES
+    _, limiter = get_session(urlparse(url).netloc)
+    endpoint = endpoint_key("POST", url)
+    started = time.monotonic()
+    
+    for attempt in range(max_retries + 1):
+        await limiter.acquire_async()
+        async with async_runtime.client.stream("POST", url, params=params, headers=headers,
+                                               json=payload, timeout=timeout) as response:
+            limiter.update(response)
+            if response.status_code != 200:
+                await response.aread()
+                if attempt < max_retries and is_retryable(response):
+                    wait = retry_wait(response, attempt)
+                    print(f"⚠️ {endpoint} returned {response.status_code}, retrying in {wait:.1f}s...")
+                    await asyncio.sleep(wait)
+                    continue
+                http_stats.record(endpoint, time.monotonic() - started, response.status_code, attempt)
+                raise RuntimeError(f"{label} Error: {response.text}")
+            
+            http_stats.record(endpoint, time.monotonic() - started, response.status_code, attempt)
+            async for line in response.aiter_lines():
+                for text in parse_line(line):
+                    yield text
+            return
+
+
+class GeminiProvider:
+    name = "gemini"
+    url = GEMINI_API_URL
+    model = GEMINI_MODEL
+
+    def configured(self):
+        return bool(GEMINI_API_KEY)
+
+    def text(self, response):
+        if response.status_code != 200:
+            raise RuntimeError(f"Gemini Error: {response.text}")
+        text = candidate_text(response.json())
+        if text is None:
+            raise RuntimeError("No candidates in Gemini response")
+        return text
+
+    def headers(self):
+        return {"x-goog-api-key": GEMINI_API_KEY or ""}
+
+    def complete(self, payload, timeout, max_retries=None):
+        return self.text(gemini_request(payload, timeout=timeout, max_retries=max_retries))
+
+    def stream(self, payload, timeout, max_retries=None):
+        return stream_sse_text(gemini_url("streamGenerateContent"), self.headers(), payload, timeout,
+                               sse_text_parts, "Gemini", max_retries=max_retries, params={"alt": "sse"})
+
+    async def acomplete(self, payload, timeout, max_retries=None):
+        return self.text(await agemini_request(payload, timeout=timeout, max_retries=max_retries))
+
+    def astream(self, payload, timeout, max_retries=None):
+        return astream_sse_text(gemini_url("streamGenerateContent"), self.headers(), payload, timeout,
+                                sse_text_parts, "Gemini", max_retries=max_retries, params={"alt": "sse"})
+
+
+def openrouter_sse_text(line):
+    """Content deltas in one `data:` line of an OpenRouter (OpenAI-style) stream"""
+    if not line or not line.startswith("data:"):
+        return []
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return []
+    event = json.loads(data)
+    return [
+        choice['delta']['content']
+        for choice in event.get('choices', [])[:1]
+        if choice.get('delta', {}).get('content')
+    ]
+
+
+class OpenRouterProvider:
+    name = "openrouter"
+    url = OPENROUTER_URL
+    model = OPENROUTER_MODEL
+
+    def configured(self):
+        return bool(OPENROUTER_API_KEY)
+
+    def headers(self):
+        return {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
+
+    def payload(self, payload, stream=False):
+        """Converts a Gemini generateContent payload to a chat completion request"""
+        config = payload.get('generationConfig', {})
+        prompt = "".join(part.get('text', '') for part in payload['contents'][0]['parts'])
+        return {
+            "model": OPENROUTER_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": config.get('temperature', 0.2),
+            "max_tokens": config.get('maxOutputTokens', 4000),
+            "stream": stream
+        }
+
+    def text(self, response):
+        if response.status_code != 200:
+            raise RuntimeError(f"OpenRouter Error: {response.text}")
+        choices = response.json().get('choices')
+        if not choices or not choices[0]['message'].get('content'):
+            raise RuntimeError("No choices in OpenRouter response")
+        return choices[0]['message']['content']
+
+    def complete(self, payload, timeout, max_retries=None):
+        return self.text(http_request("POST", OPENROUTER_URL, headers=self.headers(), json=self.payload(payload),
+                                      timeout=timeout, max_retries=max_retries))
+
+    def stream(self, payload, timeout, max_retries=None):
+        return stream_sse_text(OPENROUTER_URL, self.headers(), self.payload(payload, stream=True), timeout,
+                               openrouter_sse_text, "OpenRouter", max_retries=max_retries)
+
+    async def acomplete(self, payload, timeout, max_retries=None):
+        return self.text(await ahttp_request("POST", OPENROUTER_URL, headers=self.headers(),
+                                             json=self.payload(payload), timeout=timeout, max_retries=max_retries))
+
+    def astream(self, payload, timeout, max_retries=None):
+        return astream_sse_text(OPENROUTER_URL, self.headers(), self.payload(payload, stream=True), timeout,
+                                openrouter_sse_text, "OpenRouter", max_retries=max_retries)
+
+
+LLM_PROVIDER_TYPES = {
+    "gemini": GeminiProvider,
+    "openrouter": OpenRouterProvider
+}
+
+
+# provider:model of every LLM answer, collected per generation (see build_steps)
+llm_answers = contextvars.ContextVar('llm_answers', default=None)
+
+
+class CircuitBreaker:
+    """
+    Stops routing to a provider after `threshold` consecutive failures.
+    After `cooldown` seconds a single trial request is let through; its
+    success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def available(self):
+        with self.lock:
+            return self.state == "closed" or (self.state == "half_open" and not self.trial_in_flight)
+
+    def cooldown_left(self):
+        """Seconds until the breaker lets a request through (0 if it does now)"""
+        with self.lock:
+            if self.state == "closed" or (self.state == "half_open" and not self.trial_in_flight):
+                return 0
+            return max(self.cooldown - (time.monotonic() - self.opened_at), 1)
+
+    def allow(self):
+        """Claims the right to send a request (the trial request when half-open)"""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record(self, ok):
+        """Records an outcome: True, False, or None for a cancelled request"""
+        with self.lock:
+            self.trial_in_flight = False
+            if ok is None:
+                return
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """EWMA plus a window of recent samples of one provider's time to first token"""
+
+    def __init__(self, alpha, window=200):
+        self.alpha = alpha
+        self.ewma = None
+        self.samples = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.ewma = seconds if self.ewma is None else self.alpha * seconds + (1 - self.alpha) * self.ewma
+            self.samples.append(seconds)
+
+    def percentile(self, fraction):
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class LLMAttempt:
+    """
+    One provider's try at a routed request.
+    
+    Cancelling an async attempt cancels its task (closing the connection)
+    right away. A thread attempt cannot be interrupted mid-read; it stops and
+    closes its stream at the next chunk, or when a non-streamed call returns.
+    """
+
+    def __init__(self, provider, mode):
+        self.provider = provider
+        self.mode = mode
+        self.started_at = time.monotonic()
+        self.cancelled = threading.Event()
+        self.task = None
+        self.outcome = None
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.task is not None:
+            self.task.cancel()
+
+
+class LLMRouter:
+    """
+    Routes LLM calls across providers.
+    
+    Providers are tried in order of EWMA time to first token (configured
+    order for those without samples), skipping any whose circuit breaker is
+    open; a failed provider hands over to the next. When hedging is on
+    (LLM_HEDGING) and a provider has not produced its first token within its
+    LLM_HEDGE_PERCENTILE latency, the request also goes to the next
+    provider. The first to produce a token wins; the other is cancelled.
+    
+    "stream" and "complete" calls are tracked separately, as the first
+    token of a non-streamed call is the whole response.
+    """
+
+    def __init__(self, providers):
+        self.providers = providers
+        self.breakers = {provider.name: CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+                         for provider in providers}
+        self.trackers = {}
+        # A cancelled attempt keeps its thread until its next chunk, response or timeout
+        self.executor = ThreadPoolExecutor(max_workers=LLM_THREADS * 4, thread_name_prefix="llm-attempt")
+        self.lock = threading.Lock()
+
+    def tracker(self, name, mode):
+        with self.lock:
+            if (name, mode) not in self.trackers:
+                self.trackers[(name, mode)] = LatencyTracker(LLM_EWMA_ALPHA)
+            return self.trackers[(name, mode)]
+
+    def retry_after(self):
+        """
+        Seconds until some configured provider can take a call: its circuit
+        lets requests through and its host is not blocked by a Retry-After.
+        0 if one can now (or none is configured).
+        """
+        waits = []
+        for provider in self.providers:
+            if not provider.configured():
+                continue
+            wait = self.breakers[provider.name].cooldown_left()
+            limiter = rate_limiters.get(urlparse(provider.url).netloc)
+            if limiter:
+                wait = max(wait, limiter.blocked_for())
+            waits.append(wait)
+        return min(waits) if waits else 0
+
+    def preferred_model(self, mode):
+        """provider:model the next `mode` call would go to first, or None"""
+        candidates = self.candidates(mode)
+        return f"{candidates[0].name}:{candidates[0].model}" if candidates else None
+
+    def candidates(self, mode):
+        """Configured providers with a usable circuit, fastest first"""
+        usable = [p for p in self.providers if p.configured() and self.breakers[p.name].available()]
+        
+        def rank(provider):
+            ewma = self.tracker(provider.name, mode).ewma
+            return (ewma is None, ewma or 0)
+        return sorted(usable, key=rank)
+
+    def hedge_delay(self, attempt):
+        """Seconds to wait for the first token before hedging to the next provider"""
+        tracker = self.tracker(attempt.provider.name, attempt.mode)
+        delay = LLM_HEDGE_DELAY
+        if len(tracker.samples) >= LLM_HEDGE_MIN_SAMPLES:
+            delay = tracker.percentile(LLM_HEDGE_PERCENTILE)
+        return max(delay, LLM_HEDGE_MIN_DELAY)
+
+    def first_token(self, attempt):
+        seconds = time.monotonic() - attempt.started_at
+        self.tracker(attempt.provider.name, attempt.mode).observe(seconds)
+        metrics.observe("llm_first_token_seconds", {"provider": attempt.provider.name, "mode": attempt.mode}, seconds)
+
+    def finish(self, attempt, ok, error=None):
+        """Records the outcome of an attempt once: True, False or None (cancelled)"""
+        if attempt.outcome is not None:
+            return
+        attempt.outcome = {True: "ok", False: "error", None: "cancelled"}[ok]
+        self.breakers[attempt.provider.name].record(ok)
+        metrics.inc("llm_requests_total", {"provider": attempt.provider.name, "status": attempt.outcome})
+        if error is not None:
+            print(f"⚠️ LLM provider {attempt.provider.name} failed: {str(error)}")
+
+    def record_answer(self, attempt):
+        answers = llm_answers.get()
+        if answers is not None:
+            answers.add(f"{attempt.provider.name}:{attempt.provider.model}")
+
+    def launch_next(self, candidates, mode):
+        """Pops candidates until one's circuit admits a request. Returns its attempt, or None."""
+        while candidates:
+            provider = candidates.pop(0)
+            if self.breakers[provider.name].allow():
+                return LLMAttempt(provider, mode)
+        return None
+
+    # --- threads ---
+
+    def stream(self, payload, timeout):
+        """Yields the text of a streamed generation from whichever provider answers first"""
+        with llm_calls.slot():
+            yield from self.race(payload, timeout, "stream")
+
+    def complete(self, payload, timeout):
+        """Returns the full text of a (non-streamed) generation"""
+        with llm_calls.slot():
+            return "".join(self.race(payload, timeout, "complete"))
+
+    def run_attempt(self, attempt, payload, timeout, max_retries, events):
+        first = True
+        chunks = None
+        try:
+            if attempt.mode == "stream":
+                chunks = attempt.provider.stream(payload, timeout, max_retries=max_retries)
+            else:
+                chunks = iter([attempt.provider.complete(payload, timeout, max_retries=max_retries)])
+            for chunk in chunks:
+                if attempt.cancelled.is_set():
+                    return
+                if first:
+                    self.first_token(attempt)
+                    first = False
+                events.put((attempt, "chunk", chunk))
+            if first:
+                raise RuntimeError("Empty response")
+            events.put((attempt, "end", None))
+        except Exception as e:
+            events.put((attempt, "error", e))
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def race(self, payload, timeout, mode):
+        candidates = self.candidates(mode)
+        if not candidates:
+            raise RuntimeError("No LLM provider available (no API key, or all circuits open)")
+        # With somewhere to fail over to, a failure moves on instead of retrying
+        max_retries = 0 if len(candidates) > 1 else None
+        deadline = time.monotonic() + timeout
+        events = queue.Queue()
+        running = []
+        winner = None
+        hedge_at = None
+        
+        def launch():
+            nonlocal hedge_at
+            attempt = self.launch_next(candidates, mode)
+            if attempt is None:
+                return None
+            running.append(attempt)
+            submit_with_context(self.executor, self.run_attempt, attempt, payload, timeout, max_retries, events)
+            hedge_at = time.monotonic() + self.hedge_delay(attempt) if LLM_HEDGING and candidates else None
+            return attempt
+        
+        if not launch():
+            raise RuntimeError("No LLM provider available (all circuits open)")
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    # Attempts still running (even one already streaming) timed out
+                    timed_out = RuntimeError(f"LLM request timed out after {timeout:.0f}s")
+                    for attempt in running:
+                        if attempt.outcome is None:
+                            attempt.cancel()
+                            self.finish(attempt, False, timed_out)
+                    raise timed_out
+                wait = deadline - now
+                if winner is None and hedge_at is not None:
+                    wait = min(wait, max(hedge_at - now, 0))
+                try:
+                    attempt, kind, value = events.get(timeout=wait)
+                except queue.Empty:
+                    if winner is None and hedge_at is not None and time.monotonic() >= hedge_at:
+                        slow = running[-1].provider.name
+                        hedge_at = None
+                        hedge = launch()
+                        if hedge:
+                            print(f"⏱️ {slow} slow to first token, hedging to {hedge.provider.name}")
+                            metrics.inc("llm_hedges_total", {"provider": hedge.provider.name})
+                    continue
+                
+                if attempt.cancelled.is_set() or (winner is not None and attempt is not winner):
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = attempt
+                        self.record_answer(winner)
+                        for other in running:
+                            if other is not winner:
+                                other.cancel()
+                                self.finish(other, None)
+                    yield value
+                elif kind == "end":
+                    self.finish(attempt, True)
+                    return
+                else:
+                    self.finish(attempt, False, value)
+                    if winner is not None:
+                        raise value
+                    running.remove(attempt)
+                    if not running and not launch():
+                        raise RuntimeError(f"All LLM providers failed, last error: {str(value)}")
+        finally:
+            # Also reached when the caller stops reading early
+            for attempt in running:
+                if attempt.outcome is None:
+                    attempt.cancel()
+                    self.finish(attempt, True if attempt is winner else None)
+
+    # --- asyncio ---
+
+    async def acomplete(self, payload, timeout):
+        async with llm_calls.aslot():
+            return "".join([chunk async for chunk in self.arace(payload, timeout, "complete")])
+
+    async def astream(self, payload, timeout):
+        async with llm_calls.aslot():
+            chunks = self.arace(payload, timeout, "stream")
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                await chunks.aclose()
+
+    async def arun_attempt(self, attempt, payload, timeout, max_retries, events):
+        first = True
+        try:
+            if attempt.mode == "stream":
+                chunks = attempt.provider.astream(payload, timeout, max_retries=max_retries)
+                try:
+                    async for chunk in chunks:
+                        if first:
+                            self.first_token(attempt)
+                            first = False
+                        events.put_nowait((attempt, "chunk", chunk))
+                finally:
+                    await chunks.aclose()
+            else:
+                chunk = await attempt.provider.acomplete(payload, timeout, max_retries=max_retries)
+                self.first_token(attempt)
+                first = False
+                events.put_nowait((attempt, "chunk", chunk))
+            if first:
+                raise RuntimeError("Empty response")
+            events.put_nowait((attempt, "end", None))
+        except Exception as e:
+            events.put_nowait((attempt, "error", e))
+
+    async def arace(self, payload, timeout, mode):
+        """Coroutine version of race (an async generator), attempts run as tasks"""
+        candidates = self.candidates(mode)
+        if not candidates:
+            raise RuntimeError("No LLM provider available (no API key, or all circuits open)")
+        max_retries = 0 if len(candidates) > 1 else None
+        deadline = time.monotonic() + timeout
+        events = asyncio.Queue()
+        running = []
+        winner = None
+        hedge_at = None
+        
+        def launch():
+            nonlocal hedge_at
+            attempt = self.launch_next(candidates, mode)
+            if attempt is None:
+                return None
+            running.append(attempt)
+            attempt.task = asyncio.ensure_future(self.arun_attempt(attempt, payload, timeout, max_retries, events))
+            hedge_at = time.monotonic() + self.hedge_delay(attempt) if LLM_HEDGING and candidates else None
+            return attempt
+        
+        if not launch():
+            raise RuntimeError("No LLM provider available (all circuits open)")
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    # Attempts still running (even one already streaming) timed out
+                    timed_out = RuntimeError(f"LLM request timed out after {timeout:.0f}s")
+                    for attempt in running:
+                        if attempt.outcome is None:
+                            attempt.cancel()
+                            self.finish(attempt, False, timed_out)
+                    raise timed_out
+                wait = deadline - now
+                if winner is None and hedge_at is not None:
+                    wait = min(wait, max(hedge_at - now, 0))
+                try:
+                    attempt, kind, value = await asyncio.wait_for(events.get(), wait)
+                except asyncio.TimeoutError:
+                    if winner is None and hedge_at is not None and time.monotonic() >= hedge_at:
+                        slow = running[-1].provider.name
+                        hedge_at = None
+                        hedge = launch()
+                        if hedge:
+                            print(f"⏱️ {slow} slow to first token, hedging to {hedge.provider.name}")
+                            metrics.inc("llm_hedges_total", {"provider": hedge.provider.name})
+                    continue
+                
+                if attempt.cancelled.is_set() or (winner is not None and attempt is not winner):
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = attempt
+                        self.record_answer(winner)
+                        for other in running:
+                            if other is not winner:
+                                other.cancel()
+                                self.finish(other, None)
+                    yield value
+                elif kind == "end":
+                    self.finish(attempt, True)
+                    return
+                else:
+                    self.finish(attempt, False, value)
+                    if winner is not None:
+                        raise value
+                    running.remove(attempt)
+                    if not running and not launch():
+                        raise RuntimeError(f"All LLM providers failed, last error: {str(value)}")
+        finally:
+            for attempt in running:
+                if attempt.outcome is None:
+                    attempt.cancel()
+                    self.finish(attempt, True if attempt is winner else None)
+
+    def snapshot(self):
+        """Circuit state and first-token latency per provider, for /health"""
+        snapshot = {}
+        for provider in self.providers:
+            entry = {"configured": provider.configured(), "circuit": self.breakers[provider.name].state}
+            for mode in ("stream", "complete"):
+                tracker = self.tracker(provider.name, mode)
+                if tracker.samples:
+                    p95 = tracker.percentile(0.95)
+                    entry[mode] = {"ewma_seconds": round(tracker.ewma, 3), "p95_seconds": round(p95, 3),
+                                   "samples": len(tracker.samples)}
+            snapshot[provider.name] = entry
+        return snapshot
+
+
+llm_router = LLMRouter([LLM_PROVIDER_TYPES[name.strip()]() for name in LLM_PROVIDERS.split(',') if name.strip()])
+
+
+# ===== ADMISSION CONTROL =====
+
+class AdmissionRejected(Exception):
+    """Raised by BuildQueue.submit when a build cannot be admitted; carries the Retry-After seconds"""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionControl:
+    """
+    Decides whether another build may start, so a spike is queued or turned
+    away instead of sending a wave of requests that the upstreams answer
+    with 429s.
+    
+    A build is admitted while fewer than `capacity` builds are in flight
+    (queued, building or waiting on Pages) and the upstreams have headroom:
+    some LLM provider has a closed circuit and no Retry-After block, and
+    GitHub's remaining quota covers `github_calls_per_build` for every build
+    in flight. The last `reserve` slots (at most half) are kept for Round 2
+    requests whose Round 1 succeeded, and those are admitted before waiting
+    Round 1 requests. A request without capacity is refused at once with a
+    Retry-After estimate, or after waiting up to `max_wait` seconds if set.
+    """
+
+    def __init__(self, capacity, reserve, max_wait, github_calls_per_build):
+        self.capacity = capacity
+        self.reserve = min(reserve, capacity // 2)
+        self.max_wait = max_wait
+        self.github_calls_per_build = github_calls_per_build
+        self.in_flight = {}  # job id -> admitted at (monotonic)
+        self.priority_waiting = 0
+        self.durations = LatencyTracker(0.1)
+        self.condition = threading.Condition()
+
+    def headroom_wait(self, builds):
+        """Seconds until the upstreams can take `builds` builds in flight (0 = now)"""
+        wait = llm_router.retry_after()
+        github = rate_limiters.get(urlparse(GITHUB_API_URL).netloc)
+        if github:
+            wait = max(wait, github.blocked_for())
+            if github.remaining is not None and github.remaining < builds * self.github_calls_per_build:
+                wait = max(wait, github.reset_in())
+        return wait
+
+    def slot_wait(self):
+        """Rough seconds until a build slot frees up, from recent build durations"""
+        build_seconds = self.durations.ewma or 30.0
+        return build_seconds / max(len(self.in_flight), 1)
+
+    def admit(self, job_id, priority=False, max_wait=None):
+        """
+        Claims a build slot for `job_id`, waiting up to `max_wait` seconds
+        (default: the configured max_wait).
+        
+        Returns:
+            0 once admitted
+        Raises:
+            AdmissionRejected if there is no capacity within the wait
+        """
+        deadline = time.monotonic() + (self.max_wait if max_wait is None else max_wait)
+        limit = self.capacity if priority else self.capacity - self.reserve
+        with self.condition:
+            if priority:
+                self.priority_waiting += 1
+            try:
+                while True:
+                    reason = None
+                    wait = self.headroom_wait(len(self.in_flight) + 1)
+                    if wait:
+                        reason = "Upstream rate limits exhausted"
+                    elif len(self.in_flight) >= limit or (not priority and self.priority_waiting):
+                        reason = "Too many builds in flight"
+                        wait = self.slot_wait()
+                    else:
+                        self.in_flight[job_id] = time.monotonic()
+                        metrics.gauge_set("admission_in_flight", None, len(self.in_flight))
+                        metrics.inc("admission_decisions_total", {"result": "admitted", "priority": str(priority).lower()})
+                        return 0
+                    
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.inc("admission_decisions_total", {"result": "rejected", "priority": str(priority).lower()})
+                        raise AdmissionRejected(max(1, math.ceil(wait)), reason)
+                    # Woken early by release(); upstream waits are re-checked on the timeout
+                    self.condition.wait(min(wait, remaining))
+            finally:
+                if priority:
+                    self.priority_waiting -= 1
+
+    def release(self, job_id, finished=True):
+        """
+        Frees the slot of a build (no-op for builds that were never admitted).
+        finished=False for a slot given back unused, which is not counted as a build duration.
+        """
+        with self.condition:
+            admitted_at = self.in_flight.pop(job_id, None)
+            if admitted_at is None:
+                return
+            if finished:
+                self.durations.observe(time.monotonic() - admitted_at)
+            metrics.gauge_set("admission_in_flight", None, len(self.in_flight))
+            self.condition.notify_all()
+
+    def snapshot(self):
+        with self.condition:
+            in_flight = len(self.in_flight)
+        return {
+            "in_flight": in_flight,
+            "capacity": self.capacity,
+            "reserve": self.reserve,
+            "headroom_wait": round(self.headroom_wait(in_flight + 1), 1)
+        }
+
+
+admission = AdmissionControl(ADMISSION_MAX_BUILDS, ADMISSION_ROUND2_RESERVE, ADMISSION_MAX_WAIT,
+                             ADMISSION_GITHUB_CALLS_PER_BUILD)
+
+
+# ===== BUILD JOB QUEUE =====
+
+def open_sqlite(filename):
+    """Opens a SQLite database under DATA_DIR that can be shared across worker threads"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(DATA_DIR, filename), check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def idempotency_key(data):
+    """Identifies a build request by (email, task, round, nonce). None without a nonce."""
+    if not data.get('nonce'):
+        return None
+    parts = [data.get('email'), data.get('task'), data.get('round', 1), data.get('nonce')]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def new_job_record(job_id, data):
+    """Builds the initial status record for a queued build job"""
+    now = time.time()
+    return {
+        "id": job_id,
+        "status": "queued",
+        "task": data.get('task'),
+        "round": data.get('round', 1),
+        "created_at": now,
+        "updated_at": now,
+        "stages": {},
+        "result": None,
+        "error": None
+    }
+
+
+class InMemoryJobStore:
+    """Keeps job records in a dict. Only the most recent jobs are retained."""
+
+    # Records die with the process, so every job in the store has a live owner
+    owner = None
+
+    def __init__(self, max_jobs=1000):
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def owner_alive(self, owner):
+        return True
+
+    def active_jobs(self):
+        return []
+
+    def create(self, record, idempotency_key=None):
+        """
+        Stores a new job record. If `idempotency_key` already belongs to a job
+        that has not failed, nothing is stored and that job is returned instead.
+        """
+        with self.lock:
+            existing = self.jobs.get(self.keys.get(idempotency_key))
+            if existing and existing['status'] not in RETRYABLE_JOB_STATUSES:
+                return json.loads(json.dumps(existing))
+            
+            self.jobs[record['id']] = record
+            if idempotency_key:
+                self.keys[idempotency_key] = record['id']
+            if len(self.jobs) > self.max_jobs:
+                # Dicts keep insertion order, so the first key is the oldest job
+                oldest = self.jobs.pop(next(iter(self.jobs)))
+                if self.keys.get(oldest.get('idempotency_key')) == oldest['id']:
+                    del self.keys[oldest['idempotency_key']]
+            return None
+
+    def get(self, job_id):
+        with self.lock:
+            record = self.jobs.get(job_id)
+            return json.loads(json.dumps(record)) if record else None
+
+    def find(self, idempotency_key):
+        """The job currently holding `idempotency_key`, if any"""
+        with self.lock:
+            record = self.jobs.get(self.keys.get(idempotency_key))
+            return json.loads(json.dumps(record)) if record else None
+
+    def update(self, job_id, mutate):
+        with self.lock:
+            record = self.jobs.get(job_id)
+            if record:
+                mutate(record)
+                record['updated_at'] = time.time()
+
+
+class SQLiteJobStore:
+    """Keeps job records in a local SQLite file so status survives restarts
+    and is visible to every worker process sharing DATA_DIR.
+    
+    Each process holds an exclusive flock on DATA_DIR/job-owners/<owner>.lock
+    and stamps the jobs it queues with that owner. The OS drops the lock when
+    the process dies, so a job whose owner's lock can be taken was orphaned
+    mid-build (see BuildQueue.fail_orphan).
+    """
+
+    def __init__(self, filename='jobs.db'):
+        self.filename = filename
+        self.conn = None
+        self.lock = threading.Lock()
+        self.owner = uuid.uuid4().hex
+        self.owner_file = None
+
+    def _owner_path(self, owner):
+        return os.path.join(DATA_DIR, "job-owners", f"{owner}.lock")
+
+    def _hold_owner_lock(self):
+        # Taken after a preloading server forks, so each worker holds its own
+        if fcntl is None or self.owner_file:
+            return
+        owners_dir = os.path.dirname(self._owner_path(self.owner))
+        os.makedirs(owners_dir, exist_ok=True)
+        # Locked before it appears under its name, so no one sees it unlocked
+        temp_path = f"{self._owner_path(self.owner)}.tmp"
+        self.owner_file = open(temp_path, "w")
+        fcntl.flock(self.owner_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.replace(temp_path, self._owner_path(self.owner))
+        
+        # Lock files of exited processes are removed by the liveness check
+        for name in os.listdir(owners_dir):
+            if name.endswith(".lock"):
+                self.owner_alive(name[:-len(".lock")])
+
+    def owner_alive(self, owner):
+        """False if the process that queued a job has exited"""
+        if owner == self.owner or fcntl is None:
+            return True
+        if not owner:
+            return False  # queued before owners were recorded, i.e. by an earlier process
+        try:
+            with open(self._owner_path(owner)) as owner_file:
+                fcntl.flock(owner_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self._owner_path(owner))
+        except FileNotFoundError:
+            return False
+        except BlockingIOError:
+            return True
+        return False
+
+    def active_jobs(self):
+        """Job records that are still queued, running or deploying"""
+        with self.lock:
+            rows = self._db().execute(
+                "SELECT data FROM jobs WHERE json_extract(data, '$.status') IN ('queued', 'running', 'deploying')"
+            ).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def _db(self):
+        # Opened on first use so a preloading server does not share it across forks
+        if self.conn is None:
+            self.conn = open_sqlite(self.filename)
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    "id TEXT PRIMARY KEY, data TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS job_keys ("
+                    "key TEXT PRIMARY KEY, job_id TEXT NOT NULL)"
+                )
+            self._hold_owner_lock()
+        return self.conn
+
+    def create(self, record, idempotency_key=None):
+        """
+        Stores a new job record. If `idempotency_key` already belongs to a job
+        that has not failed, nothing is stored and that job is returned instead.
+        """
+        with self.lock, self._db():
+            if idempotency_key:
+                # INSERT OR IGNORE makes the claim atomic across processes
+                claimed = self.conn.execute(
+                    "INSERT OR IGNORE INTO job_keys (key, job_id) VALUES (?, ?)",
+                    (idempotency_key, record['id'])
+                ).rowcount
+                if not claimed:
+                    row = self.conn.execute(
+                        "SELECT jobs.id, jobs.data FROM job_keys JOIN jobs ON jobs.id = job_keys.job_id "
+                        "WHERE job_keys.key = ?", (idempotency_key,)
+                    ).fetchone()
+                    existing = json.loads(row['data']) if row else None
+                    if existing and existing['status'] not in RETRYABLE_JOB_STATUSES:
+                        return existing
+                    self.conn.execute(
+                        "UPDATE job_keys SET job_id = ? WHERE key = ?", (record['id'], idempotency_key)
+                    )
+            
+            self.conn.execute(
+                "INSERT INTO jobs (id, data, created_at) VALUES (?, ?, ?)",
+                (record['id'], json.dumps(record), record['created_at'])
+            )
+            return None
+
+    def get(self, job_id):
+        with self.lock:
+            row = self._db().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def find(self, idempotency_key):
+        """The job currently holding `idempotency_key`, if any"""
+        with self.lock:
+            row = self._db().execute(
+                "SELECT jobs.data FROM job_keys JOIN jobs ON jobs.id = job_keys.job_id WHERE job_keys.key = ?",
+                (idempotency_key,)
+            ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def update(self, job_id, mutate):
+        with self.lock, self._db():
+            row = self.conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row:
+                record = json.loads(row['data'])
+                mutate(record)
+                record['updated_at'] = time.time()
+                self.conn.execute("UPDATE jobs SET data = ? WHERE id = ?", (json.dumps(record), job_id))
+
+
+# A new request with the same idempotency key replaces jobs in these states
+RETRYABLE_JOB_STATUSES = ("failed", "rejected")
+
+# Jobs in these states are still owned by the process that queued them
+ACTIVE_JOB_STATUSES = ("queued", "running", "deploying")
+
+JOB_STORES = {
+    "memory": InMemoryJobStore,
+    "sqlite": SQLiteJobStore
+}
+
+
+class BuildQueue:
+    """
+    Bounded in-process worker pool for build jobs.
+
+    Jobs are handed to a fixed number of worker threads through a bounded
+    queue; the store backend only holds status records, so it can be swapped
+    (see JOB_STORES) without touching the workers.
+    """
+
+    def __init__(self, store, workers, max_queued, runtime=None):
+        self.store = store
+        self.workers = workers
+        self.runtime = runtime  # AsyncRuntime when builds run as coroutines
+        self.pending = queue.Queue(maxsize=max_queued)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.draining = False
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for job in self.store.active_jobs():
+                if not self.store.owner_alive(job.get('owner')):
+                    self.fail_orphan(job)
+            if self.runtime:
+                thread = threading.Thread(target=self._dispatch_async, name="build-dispatcher", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"build-worker-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, data, max_wait=None):
+        """
+        Queues a build, deduplicated on (email, task, round, nonce). A new
+        build must first be admitted (see AdmissionControl), waiting up to
+        `max_wait` seconds for capacity (default ADMISSION_MAX_WAIT, which
+        is 0: refuse at once).
+        
+        Returns:
+            Tuple of (job, is_duplicate). For a duplicate, `job` is the
+            in-flight or finished job for the same request. `job` is None
+            if the queue is full or the server is shutting down.
+        Raises:
+            AdmissionRejected if the build was not admitted
+        """
+        if self.draining:
+            return None, False
+        self.start()
+        job_id = uuid.uuid4().hex
+        key = idempotency_key(data)
+        record = new_job_record(job_id, data)
+        record['idempotency_key'] = key
+        record['owner'] = self.store.owner
+        
+        # The ledger also knows builds finished before a restart
+        existing = build_ledger.finished_duplicate(data) if key else None
+        
+        # Retries of an in-flight build attach to it without needing a build slot
+        existing = existing or (self.store.find(key) if key else None)
+        if existing and self.orphaned(existing):
+            self.fail_orphan(existing)
+            existing = None
+        if existing and existing['status'] not in RETRYABLE_JOB_STATUSES:
+            metrics.inc("build_duplicates_total")
+            return existing, True
+        
+        # Admit before storing anything, so refused requests leave no job behind.
+        # Revisions of a deployed app may use the reserved slots.
+        priority = data.get('round', 1) == 2 and build_ledger.has_succeeded(data.get('task'), 1)
+        admission.admit(job_id, priority, max_wait)
+        
+        try:
+            # create() settles races with a duplicate submitted meanwhile
+            existing = self.store.create(record, idempotency_key=key)
+            if existing and self.orphaned(existing):
+                # Its process died mid-build and nothing will finish it; take over the key
+                self.fail_orphan(existing)
+                existing = self.store.create(record, idempotency_key=key)
+            if existing:
+                admission.release(job_id, finished=False)
+                metrics.inc("build_duplicates_total")
+                return existing, True
+            
+            build_ledger.open(job_id, data)
+        except Exception as e:
+            # Nothing will run this build: give its slot back, and fail its
+            # record (if it was stored) so the request can be retried
+            admission.release(job_id, finished=False)
+            with contextlib.suppress(Exception):
+                self.store.update(job_id, lambda stored: stored.update(status="failed", error=f"Not queued: {e}"))
+            raise
+        
+        metrics.gauge_add("build_jobs_in_flight", None, 1)
+        try:
+            self.pending.put_nowait((job_id, data))
+        except queue.Full:
+            self.finish(job_id, "rejected", error="Build queue is full")
+            return None, False
+        return record, False
+
+    def orphaned(self, job):
+        """True for an unfinished job whose worker process has exited"""
+        return job['status'] in ACTIVE_JOB_STATUSES and not self.store.owner_alive(job.get('owner'))
+
+    def fail_orphan(self, job):
+        """Marks a job orphaned by a dead process as failed (so its key can be retried)"""
+        print(f"⚠️ Job {job['id']} was {job['status']} in a process that exited, marking it failed")
+        
+        def mutate(record):
+            record['status'] = "failed"
+            record['error'] = "Interrupted: the process running this build exited"
+        self.store.update(job['id'], mutate)
+        
+        job = self.store.get(job['id'])
+        if job:
+            build_ledger.close(job)
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def create_batch(self, builds):
+        """Stores the record of a /build-batch submission next to the job records"""
+        batch = {
+            "id": f"batch-{uuid.uuid4().hex}",
+            "kind": "batch",
+            "status": "submitted",
+            "created_at": time.time(),
+            "builds": builds
+        }
+        self.store.create(batch)
+        return batch
+
+    def get_batch(self, batch_id):
+        record = self.store.get(batch_id)
+        return record if record and record.get('kind') == "batch" else None
+
+    def set_stage(self, job_id, stage, status, **info):
+        """Records the status of a single pipeline stage for a job"""
+        now = time.time()
+
+        def mutate(record):
+            entry = record['stages'].setdefault(stage, {})
+            if status in ("running", "queued"):
+                entry['started_at'] = now
+            else:
+                entry['finished_at'] = now
+            entry['status'] = status
+            entry.update(info)
+            record['stage'] = stage
+        self.store.update(job_id, mutate)
+
+    def set_status(self, job_id, status):
+        self.store.update(job_id, lambda record: record.update(status=status))
+        build_ledger.set_status(job_id, status)
+
+    def finish(self, job_id, status, result=None, error=None):
+        admission.release(job_id)
+        metrics.gauge_add("build_jobs_in_flight", None, -1)
+        metrics.inc("build_jobs_total", {"status": status})
+        trace_event("job_finished", job_id=job_id, status=status, error=error)
+
+        def mutate(record):
+            record['status'] = status
+            record['result'] = result
+            record['error'] = error
+        self.store.update(job_id, mutate)
+        
+        job = self.store.get(job_id)
+        if job:
+            build_ledger.close(job)
+
+    def _worker(self):
+        while True:
+            job_id, data = self.pending.get()
+            trace_id.set(job_id)
+            try:
+                self.set_status(job_id, "running")
+                result = run_build_pipeline(job_id, data)
+                if result is not None:
+                    self.finish(job_id, "succeeded", result=result)
+            except Exception as e:
+                print(f"❌ Job {job_id} failed: {str(e)}")
+                self.finish(job_id, "failed", error=str(e))
+            finally:
+                self.pending.task_done()
+
+    def _dispatch_async(self):
+        """Moves queued jobs onto the event loop, at most runtime.max_builds at a time"""
+        while True:
+            self.runtime.slots.acquire()
+            job_id, data = self.pending.get()
+            self.runtime.submit(self._run_async(job_id, data))
+
+    async def _run_async(self, job_id, data):
+        trace_id.set(job_id)
+        try:
+            # Job store and ledger writes are SQLite calls; keep them off the event loop
+            await asyncio.to_thread(self.set_status, job_id, "running")
+            result = await arun_build_pipeline(job_id, data)
+            await asyncio.to_thread(self.finish, job_id, "succeeded", result=result)
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {str(e)}")
+            await asyncio.to_thread(self.finish, job_id, "failed", error=str(e))
+        finally:
+            self.runtime.slots.release()
+            self.pending.task_done()
+
+
+llm_executor = ThreadPoolExecutor(max_workers=LLM_THREADS, thread_name_prefix="llm")
+build_queue = BuildQueue(JOB_STORES[JOB_BACKEND](), BUILD_WORKERS, BUILD_QUEUE_SIZE,
+                         runtime=async_runtime if BUILD_EXECUTOR == "async" else None)
+
+
+@app.route('/', methods=['GET'])
+def home():
+    """Health check endpoint"""
+    return jsonify({
+        "status": "running",
+        "message": "LLM App Builder API is live!",
+        "endpoints": ["/build-app", "/jobs/<job_id>", "/metrics"]
+    })
+
+# Add this test endpoint to your Flask app temporarily
+@app.route('/test-gemini', methods=['GET'])
+def test_gemini():
+    try:
+        payload = {
+            "contents": [{"parts": [{"text": "Say hello"}]}],
+            "generationConfig": {"temperature": 0.5, "maxOutputTokens": 100}
+        }
+        
+        response = gemini_request(payload, timeout=30)
+        
+        return jsonify({
+            "status_code": response.status_code,
+            "response": response.json()
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+
+@app.route('/build-app', methods=['POST'])
+def build_app():
+    """
+    Main endpoint that receives build requests from instructors.
+    Verifies the secret, queues the build and returns 202 with a job id.
+    The build itself runs in the background worker pool (see run_build_pipeline).
+    """
+    try:
+        # Get JSON data from request
+        data = request.json
+        
+        # STEP 1: Verify secret
+        if data.get('secret') != MY_SECRET:
+            return jsonify({"error": "Invalid secret"}), 401
+        
+        print(f"✅ Secret verified for task: {data.get('task')}")
+        
+        # STEP 2: Queue the build (the secret is not kept with the job)
+        job_data = {key: value for key, value in data.items() if key != 'secret'}
+        try:
+            job, duplicate = build_queue.submit(job_data)
+        except AdmissionRejected as e:
+            print(f"🚦 Not admitted ({e.reason}), retry after {e.retry_after}s: {data.get('task')}")
+            response = jsonify({"error": f"{e.reason}, try again later", "retry_after": e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+        
+        if not job:
+            return jsonify({"error": "Build queue is full, try again later"}), 503
+        
+        if duplicate and job['status'] == "succeeded":
+            # Same request already finished: hand back the stored result
+            print(f"♻️ Duplicate of finished job {job['id']}")
+            return jsonify(dict(job['result'], message="App already built", job_id=job['id'],
+                                task=job['task'], round=job['round'])), 200
+        
+        if duplicate:
+            print(f"♻️ Duplicate of in-flight job {job['id']}")
+        else:
+            print(f"📥 Queued job {job['id']} for: {data.get('task')} (Round {data.get('round', 1)})")
+        
+        return jsonify({
+            "message": "Build already in progress" if duplicate else "Build queued",
+            "job_id": job['id'],
+            "status_url": f"/jobs/{job['id']}",
+            "task": data.get('task'),
+            "round": data.get('round', 1)
+        }), 202
+        
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Returns the overall and per-stage status of a queued build"""
+    job = build_queue.get(job_id)
+    if not job or job.get('kind') == "batch":
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+# Job statuses after which a build in a batch will not change any more
+FINISHED_BUILD_STATUSES = ("succeeded", "failed", "rejected", "invalid")
+
+
+@app.route('/build-batch', methods=['POST'])
+def build_batch():
+    """
+    Queues many builds at once: {"secret": ..., "builds": [build payloads]}.
+    
+    Every build goes through the same queue and pipeline as /build-app, so
+    they overlap stage by stage: LLM calls and GitHub writes are capped
+    across all builds (LLM_MAX_IN_FLIGHT, GITHUB_WRITES_IN_FLIGHT) and every
+    pending Pages site is tracked by the one deployment watcher. Returns 202
+    with a batch id; GET /batches/<batch_id> reports per-build results as
+    they finish.
+    """
+    try:
+        data = request.json
+        
+        if data.get('secret') != MY_SECRET:
+            return jsonify({"error": "Invalid secret"}), 401
+        
+        builds = data.get('builds')
+        if not isinstance(builds, list) or not builds:
+            return jsonify({"error": "builds must be a non-empty list"}), 400
+        if len(builds) > BATCH_MAX_BUILDS:
+            return jsonify({"error": f"At most {BATCH_MAX_BUILDS} builds per batch"}), 400
+        
+        entries = []
+        for index, build in enumerate(builds):
+            if not isinstance(build, dict):
+                entries.append({"index": index, "job_id": None, "status": "invalid",
+                                "error": "Each build must be an object"})
+                continue
+            
+            job_data = {key: value for key, value in build.items() if key != 'secret'}
+            try:
+                # No waiting per build: the caller resubmits the rejected ones
+                job, duplicate = build_queue.submit(job_data, max_wait=0)
+            except AdmissionRejected as e:
+                entries.append({"index": index, "task": build.get('task'), "round": build.get('round', 1),
+                                "job_id": None, "status": "rejected", "error": e.reason,
+                                "retry_after": e.retry_after})
+                continue
+            entries.append({
+                "index": index,
+                "task": build.get('task'),
+                "round": build.get('round', 1),
+                "job_id": job['id'] if job else None,
+                "status": "rejected" if not job else job['status'],
+                "duplicate": duplicate
+            })
+        
+        batch = build_queue.create_batch(entries)
+        queued = sum(1 for entry in entries if entry['job_id'])
+        print(f"📥 Queued batch {batch['id']}: {queued}/{len(entries)} builds")
+        
+        return jsonify({
+            "message": "Batch queued",
+            "batch_id": batch['id'],
+            "status_url": f"/batches/{batch['id']}",
+            "builds": entries
+        }), 202
+        
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """Per-build status and results of a /build-batch submission"""
+    batch = build_queue.get_batch(batch_id)
+    if not batch:
+        return jsonify({"error": "Batch not found"}), 404
+    
+    builds = []
+    for entry in batch['builds']:
+        job = build_queue.get(entry['job_id']) if entry.get('job_id') else None
+        if job:
+            entry = dict(entry, status=job['status'], stage=job.get('stage'),
+                         result=job['result'], error=job['error'])
+        builds.append(entry)
+    
+    return jsonify({
+        "batch_id": batch['id'],
+        "created_at": batch['created_at'],
+        "total": len(builds),
+        "counts": dict(collections.Counter(entry['status'] for entry in builds)),
+        "finished": all(entry['status'] in FINISHED_BUILD_STATUSES for entry in builds),
+        "builds": builds
+    }), 200
+
+
+def build_steps(job_id, data):
+    """
+    Steps 1-3 of a build, shared by both executors: generate the code,
+    push it to the task's repo and make sure Pages is enabled.
+    
+    Returns:
+        Dictionary with repo_url, pages_url and commit_sha
+    Raises:
+        RuntimeError if a required stage fails
+    """
+    # Extract request data
+    task = data.get('task')
+    round_num = data.get('round', 1)
+    brief = data.get('brief')
+    checks = data.get('checks', [])
+    
+    print(f"📝 Building app for: {task} (Round {round_num})")
+    
+    # The Round 1 repo and its Pages config don't depend on the generated
+    # code, so they are set up while the LLM generates
+    provisioning = None
+    if round_num == 1 and SPECULATIVE_REPOS:
+        yield stage_call(job_id, "provision", "running")
+        provisioning = yield Background(
+            Call(provision_github_repo, job_id, task, brief, afunc=aprovision_github_repo)
+        )
+    
+    # STEP 1: Generate code using LLM
+    print("🤖 Calling LLM to generate code...")
+    yield stage_call(job_id, "generate", "running")
+    try:
+        attachments = yield Call(process_attachments, data.get('attachments', []))
+        base_sha = (yield Call(repo_file_sha, task.replace(' ', '-').lower(), "index.html")) if round_num == 2 else None
+        prompt_hash = generation_cache_key(brief, attachments, checks, task, round_num, base_sha)
+        
+        # A retry of a build that failed after generation (e.g. on push) reuses its files;
+        # a repeat of the same prompt reuses the validated files from generation_cache
+        generated_code = yield Call(stored_generation, task, round_num, prompt_hash)
+        if generated_code:
+            print("♻️ Reusing the generated files of an earlier attempt")
+        else:
+            generated_code = yield Call(cached_generation, prompt_hash)
+        if not generated_code:
+            # Collects the provider:model of every LLM answer below (see LLMRouter.race)
+            answers = set()
+            llm_answers.set(answers)
+            if round_num == 2:
+                # Patch the existing page (update_repo_steps writes the README); fall back to full regeneration below
+                revised = yield from revise_code_steps(task, brief, attachments, checks)
+                generated_code = {"html": revised, "readme": None} if revised else None
+            if not generated_code:
+                generated_code = yield Call(generate_code_with_llm, brief, attachments, checks, task,
+                                            afunc=agenerate_code_with_llm)
+            
+            if not generated_code:
+                yield stage_call(job_id, "generate", "failed")
+                raise RuntimeError("Failed to generate code")
+            
+            # Catch missing elements or libraries before spending a deploy on them
+            html_code = yield Call(check_generated_page, generated_code['html'], brief, checks, attachments,
+                                   afunc=acheck_generated_page)
+            generated_code = dict(generated_code, html=html_code)
+            yield Call(cache_generation, prompt_hash, answers, generated_code)
+        yield Call(save_generation, job_id, prompt_hash, generated_code)
+    except Exception:
+        if provisioning:
+            # Don't leave an empty repo behind
+            repo_url, _ = yield Join(provisioning)
+            yield Call(release_provisioned_repo, task, repo_url)
+        raise
+    yield stage_call(job_id, "generate", "done")
+    
+    # STEP 2: Create GitHub repository (push into the provisioned one, if any)
+    print("📦 Creating GitHub repository...")
+    yield stage_call(job_id, "repo", "running")
+    repo_url, pages_url = (yield Join(provisioning)) if provisioning else (None, None)
+    repo_url, commit_sha = yield Call(
+        create_github_repo, task, generated_code, brief, round_num,
+        extra_files=attachment_files(attachments), repo_url=repo_url, afunc=acreate_github_repo
+    )
+    
+    if not repo_url:
+        yield stage_call(job_id, "repo", "failed")
+        raise RuntimeError("Failed to create GitHub repo")
+    yield stage_call(job_id, "repo", "done", repo_url=repo_url, commit_sha=commit_sha)
+    
+    # STEP 3: Enable GitHub Pages (already on if provisioned, or if an earlier round of the task deployed)
+    print("🌐 Enabling GitHub Pages...")
+    yield stage_call(job_id, "pages", "running")
+    if not pages_url and round_num == 2:
+        pages_url = yield Call(build_ledger.pages_url, task)
+    if pages_url:
+        print(f"✅ GitHub Pages already enabled: {pages_url}")
+    else:
+        pages_url = yield Call(enable_github_pages, task, afunc=aenable_github_pages)
+    
+    if not pages_url:
+        yield stage_call(job_id, "pages", "failed")
+        raise RuntimeError("Failed to enable GitHub Pages")
+    yield stage_call(job_id, "pages", "done", pages_url=pages_url)
+    
+    return {
+        "repo_url": repo_url,
+        "pages_url": pages_url,
+        "commit_sha": commit_sha
+    }
+
+
+def run_build_pipeline(job_id, data):
+    """
+    Runs the full build for one queued job.
+    This handles both Round 1 (initial build) and Round 2 (revisions).
+    
+    Returns:
+        None once the deploy wait has been handed to the deployment watcher,
+        which finishes the job itself (see finish_build)
+    Raises:
+        RuntimeError if a required stage fails
+    """
+    result = run_steps(build_steps(job_id, data))
+    task = data.get('task')
+    
+    # STEP 4: Hand off to the deployment watcher. The worker is released
+    # now; the watcher notifies the evaluator once the new commit is live.
+    print(f"⏳ Waiting for GitHub Pages to deploy Round {data.get('round', 1)} changes...")
+    build_queue.set_stage(job_id, "deploy", "running")
+    build_queue.set_status(job_id, "deploying")
+    
+    deployment_watcher.watch(
+        task.replace(' ', '-').lower(), result['commit_sha'], result['pages_url'],
+        lambda status: finish_build(job_id, data, result, status)
+    )
+    return None
+
+
+def finish_build(job_id, data, result, deploy_status):
+    """
+    Completes a build once its Pages deployment is live (or timed out):
+    notifies the evaluation URL and marks the job finished.
+    """
+    try:
+        build_queue.set_stage(job_id, "deploy", "done" if deploy_status == "ready" else deploy_status)
+        
+        if deploy_status != "ready":
+            print(f"⚠️ Pages deployment {deploy_status}, notifying evaluator anyway")
+        
+        # STEP 5: Notify evaluation URL (delivered by the outbox dispatcher)
+        print("📤 Queueing evaluation URL notification...")
+        outbox_id = notify_evaluation_url(
+            data.get('evaluation_url'), data.get('email'), data.get('task'),
+            data.get('round', 1), data.get('nonce'),
+            result['repo_url'], result['commit_sha'], result['pages_url'],
+            job_id=job_id
+        )
+        build_queue.set_stage(job_id, "notify", "queued", outbox_id=outbox_id)
+        
+        print(f"✅ Successfully completed task: {data.get('task')}")
+        build_queue.finish(job_id, "succeeded", result=result)
+    except Exception as e:
+        print(f"❌ Job {job_id} failed: {str(e)}")
+        build_queue.finish(job_id, "failed", result=result, error=str(e))
+
+
+# ===== ARTIFACT STORE =====
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for generated files under DATA_DIR/<dirname>.
+    
+    Each blob is a file named by its git blob id, which is the same id the
+    Git Data API and the build ledger use. Identical outputs are therefore
+    stored once, whichever task produced them. Blobs are zstd-compressed
+    (zlib when `zstandard` is not installed) and read through mmap. Once
+    the store grows past `max_bytes`, the least recently used blobs are
+    deleted.
+    """
+
+    def __init__(self, dirname, max_bytes):
+        self.dirname = dirname
+        self.max_bytes = max_bytes
+        self.total = None  # bytes on disk, counted on first write
+        self.lock = threading.Lock()
+
+    def _path(self, sha):
+        return os.path.join(DATA_DIR, self.dirname, sha[:2], sha[2:])
+
+    @staticmethod
+    def _compress(raw):
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=9).compress(raw)
+        return zlib.compress(raw, 9)
+
+    @staticmethod
+    def _decompress(data):
+        if data[:4] == ZSTD_MAGIC:
+            if zstandard is None:
+                raise RuntimeError("zstd-compressed artifact but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def _files(self):
+        root = os.path.join(DATA_DIR, self.dirname)
+        for directory, _, names in os.walk(root):
+            for name in names:
+                if not name.endswith(".tmp"):
+                    yield os.path.join(directory, name)
+
+    def put(self, raw):
+        """Stores `raw` (bytes) unless already present. Returns its git blob id."""
+        sha = git_blob_sha(raw)
+        path = self._path(sha)
+        if os.path.exists(path):
+            os.utime(path)  # counts as a use for the GC
+            metrics.inc("artifact_store_writes_total", {"result": "deduplicated"})
+            return sha
+        
+        data = self._compress(raw)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as blob_file:
+            blob_file.write(data)
+        os.replace(temp_path, path)
+        metrics.inc("artifact_store_writes_total", {"result": "stored"})
+        
+        with self.lock:
+            if self.total is None:
+                self.total = sum(os.path.getsize(file_path) for file_path in self._files())
+            else:
+                self.total += len(data)
+            over = self.total > self.max_bytes
+        if over:
+            self.collect()
+        return sha
+
+    def get(self, sha):
+        """Returns the stored bytes for a git blob id, or None if missing or corrupt"""
+        path = self._path(sha)
+        try:
+            with open(path, "rb") as blob_file:
+                with mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    raw = self._decompress(mapped)
+            os.utime(path)
+        except (OSError, ValueError, RuntimeError, zlib.error) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"⚠️ Unreadable artifact {sha}: {str(e)}")
+            return None
+        if git_blob_sha(raw) != sha:
+            print(f"⚠️ Corrupt artifact {sha}, discarding")
+            os.remove(path)
+            return None
+        return raw
+
+    def snapshot(self):
+        return {"bytes": self.total, "max_bytes": self.max_bytes, "compression": "zstd" if zstandard else "zlib"}
+
+    def collect(self):
+        """Deletes least recently used blobs until the store is below 90% of max_bytes"""
+        with self.lock:
+            entries = []
+            for path in self._files():
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self.total = total
+        metrics.inc("artifact_store_evictions_total", None, removed)
+        print(f"🧹 Artifact store GC removed {removed} blobs ({total} bytes left)")
+
+
+artifact_store = ArtifactStore('artifacts', ARTIFACT_STORE_MAX_BYTES)
+
+
+def stored_generation(task, round_num, prompt_hash):
+    """
+    The generated files of the task round's previous attempt, if it failed
+    after generation (e.g. its push to GitHub failed) with the same prompt.
+    Like generation_cache, disabled by GENERATION_CACHE_ENABLED=false.
+    
+    Returns:
+        Dictionary with 'html' and 'readme' (None for a patched Round 2
+        page), or None
+    """
+    if not GENERATION_CACHE_ENABLED:
+        return None
+    shas = build_ledger.failed_generation(task, round_num, prompt_hash)
+    if not shas:
+        return None
+    html_code = artifact_store.get(shas['html_sha'])
+    readme_text = artifact_store.get(shas['readme_sha']) if shas['readme_sha'] else None
+    if html_code is None or (shas['readme_sha'] and readme_text is None):
+        return None
+    return {"html": html_code.decode(), "readme": readme_text.decode() if readme_text is not None else None}
+
+
+def save_generation(job_id, prompt_hash, generated_code):
+    """Stores the generated files as artifacts and records them for the job in the ledger"""
+    html_sha = artifact_store.put(generated_code['html'].encode())
+    readme = generated_code['readme']
+    readme_sha = artifact_store.put(readme.encode()) if readme is not None else None
+    build_ledger.record_artifacts(job_id, prompt_hash, html_sha, readme_sha)
+
+
+# ===== BUILD LEDGER =====
+
+class BuildLedger:
+    """
+    Durable history of every build (SQLite in WAL mode under DATA_DIR):
+    task, round, nonce, prompt and artifact hashes, repo/Pages URLs, commit,
+    per-stage timings and final status.
+    
+    Unlike the job store (which may be in memory and only keeps recent
+    jobs), it survives restarts, so finished duplicates and the Pages URL of
+    an earlier round are local index lookups.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _db(self):
+        if self.conn is None:
+            self.conn = open_sqlite(self.filename)
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS builds ("
+                    "job_id TEXT PRIMARY KEY, task TEXT, round INTEGER, nonce TEXT, email TEXT, "
+                    "status TEXT NOT NULL, prompt_hash TEXT, html_sha TEXT, readme_sha TEXT, "
+                    "repo_url TEXT, pages_url TEXT, commit_sha TEXT, stages TEXT, error TEXT, "
+                    "created_at REAL NOT NULL, updated_at REAL NOT NULL, finished_at REAL)"
+                )
+                self.conn.execute("CREATE INDEX IF NOT EXISTS builds_task_round ON builds (task, round, created_at)")
+                self.conn.execute("CREATE INDEX IF NOT EXISTS builds_nonce ON builds (nonce)")
+                self.conn.execute("CREATE INDEX IF NOT EXISTS builds_created ON builds (created_at)")
+        return self.conn
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(f"UPDATE builds SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def open(self, job_id, data):
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "INSERT OR IGNORE INTO builds (job_id, task, round, nonce, email, status, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                    (job_id, data.get('task'), data.get('round', 1), data.get('nonce'), data.get('email'), now, now)
+                )
+
+    def set_status(self, job_id, status):
+        self._update(job_id, status=status)
+
+    def record_artifacts(self, job_id, prompt_hash, html_sha, readme_sha):
+        """Stores the prompt hash and the git blob ids (artifact ids) of the generated page and README"""
+        self._update(job_id, prompt_hash=prompt_hash, html_sha=html_sha, readme_sha=readme_sha)
+
+    def failed_generation(self, task, round_num, prompt_hash):
+        """
+        Artifact ids of the latest build of the task's round that got past
+        generation, if that build failed and was generated from
+        `prompt_hash`; otherwise None.
+        """
+        with self.lock:
+            row = self._db().execute(
+                "SELECT status, prompt_hash, html_sha, readme_sha FROM builds "
+                "WHERE task = ? AND round = ? AND html_sha IS NOT NULL ORDER BY created_at DESC LIMIT 1",
+                (task, round_num)
+            ).fetchone()
+        if not row or row['status'] != 'failed' or row['prompt_hash'] != prompt_hash:
+            return None
+        return {"html_sha": row['html_sha'], "readme_sha": row['readme_sha']}
+
+    def close(self, job):
+        """Records the final state of a finished job record"""
+        result = job.get('result') or {}
+        self._update(
+            job['id'],
+            status=job['status'],
+            repo_url=result.get('repo_url'),
+            pages_url=result.get('pages_url'),
+            commit_sha=result.get('commit_sha'),
+            stages=json.dumps(job.get('stages') or {}),
+            error=job.get('error'),
+            finished_at=time.time()
+        )
+
+    @staticmethod
+    def _entry(row):
+        entry = dict(row)
+        stages = json.loads(entry['stages'] or "{}")
+        for stage in stages.values():
+            if 'started_at' in stage and 'finished_at' in stage:
+                stage['seconds'] = round(stage['finished_at'] - stage['started_at'], 3)
+        entry['stages'] = stages
+        if entry['finished_at']:
+            entry['duration'] = round(entry['finished_at'] - entry['created_at'], 3)
+        return entry
+
+    def get(self, job_id):
+        with self.lock:
+            row = self._db().execute("SELECT * FROM builds WHERE job_id = ?", (job_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    def list(self, task=None, round_num=None, status=None, nonce=None, limit=50, offset=0):
+        filters = {"task": task, "round": round_num, "status": status, "nonce": nonce}
+        filters = {name: value for name, value in filters.items() if value is not None}
+        query = "SELECT * FROM builds"
+        if filters:
+            query += " WHERE " + " AND ".join(f"{name} = ?" for name in filters)
+        # rowid breaks ties between builds opened in the same clock tick, so pages never overlap
+        query += " ORDER BY created_at DESC, rowid DESC LIMIT ? OFFSET ?"
+        with self.lock:
+            rows = self._db().execute(query, (*filters.values(), limit, offset)).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def finished_duplicate(self, data):
+        """
+        The succeeded build for the same (email, task, round, nonce), as a job
+        record like BuildQueue.get returns, or None.
+        """
+        with self.lock:
+            row = self._db().execute(
+                "SELECT * FROM builds WHERE nonce = ? AND task = ? AND round = ? AND email IS ? "
+                "AND status = 'succeeded' ORDER BY created_at DESC LIMIT 1",
+                (data.get('nonce'), data.get('task'), data.get('round', 1), data.get('email'))
+            ).fetchone()
+        if not row:
+            return None
+        entry = self._entry(row)
+        return {
+            "id": entry['job_id'],
+            "status": entry['status'],
+            "task": entry['task'],
+            "round": entry['round'],
+            "created_at": entry['created_at'],
+            "updated_at": entry['updated_at'],
+            "stages": entry['stages'],
+            "result": {key: entry[key] for key in ("repo_url", "pages_url", "commit_sha")},
+            "error": None
+        }
+
+    def has_succeeded(self, task, round_num):
+        """True if a build of the task's round `round_num` succeeded"""
+        with self.lock:
+            row = self._db().execute(
+                "SELECT 1 FROM builds WHERE task = ? AND round = ? AND status = 'succeeded' LIMIT 1",
+                (task, round_num)
+            ).fetchone()
+        return row is not None
+
+    def pages_url(self, task):
+        """Pages URL of the task's latest succeeded build, if any"""
+        with self.lock:
+            row = self._db().execute(
+                "SELECT pages_url FROM builds WHERE task = ? AND status = 'succeeded' AND pages_url IS NOT NULL "
+                "ORDER BY round DESC, created_at DESC LIMIT 1",
+                (task,)
+            ).fetchone()
+        return row['pages_url'] if row else None
+
+
+build_ledger = BuildLedger('ledger.db')
+
+
+# ===== ATTACHMENTS =====
+
+RESERVED_FILENAMES = ("index.html", "README.md", "LICENSE")
+
+
+def decode_data_uri(url, max_bytes):
+    """
+    Decodes a data: URI, checking the size before decoding base64 payloads.
+    
+    Returns:
+        Tuple of (declared_mime, memoryview, size), with a None memoryview if
+        the decoded payload would exceed max_bytes. Returns None if `url` is
+        not a data URI.
+    
+    Raises:
+        binascii.Error: If a base64 payload cannot be decoded
+    """
+    if not url.startswith("data:") or "," not in url[:512]:
+        return None
+    
+    comma = url.index(",")
+    header = url[5:comma]
+    declared_mime = header.split(";")[0] or "text/plain"
+    payload = url[comma + 1:]
+    
+    if header.endswith(";base64"):
+        size = len(payload) * 3 // 4
+        if size > max_bytes:
+            return declared_mime, None, size
+        if not payload.isascii():
+            raise binascii.Error("base64 payload contains non-ASCII characters")
+        if len(payload) % 4:
+            # Senders often drop the trailing "="; extra padding is ignored
+            payload += "=" * (-len(payload) % 4)
+        data = base64.b64decode(payload, validate=False)
+        if not data and payload.strip("="):
+            raise binascii.Error("base64 payload has no valid characters")
+    else:
+        data = unquote_to_bytes(payload)
+        size = len(data)
+        if size > max_bytes:
+            return declared_mime, None, size
+    return declared_mime, memoryview(data), len(data)
+
+
+def sniff_mime(data, declared_mime, name):
+    """Detects the MIME type from magic bytes, falling back to the declared type / extension"""
+    head = bytes(data[:16])
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"GIF8"):
+        return "image/gif"
+    if head.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if head.startswith(b"%PDF"):
+        return "application/pdf"
+    
+    guessed = mimetypes.guess_type(name)[0]
+    if guessed and declared_mime in ("text/plain", "application/octet-stream"):
+        return guessed
+    if head.lstrip()[:1] in (b"{", b"[") and declared_mime == "text/plain":
+        return "application/json"
+    return declared_mime or guessed or "application/octet-stream"
+
+
+def image_dimensions(data, mime):
+    """Reads (width, height) from PNG/GIF/JPEG headers, or None"""
+    if mime == "image/png" and len(data) >= 24:
+        return struct.unpack(">II", bytes(data[16:24]))
+    if mime == "image/gif" and len(data) >= 10:
+        return struct.unpack("<HH", bytes(data[6:10]))
+    if mime == "image/jpeg":
+        position = 2
+        while position + 9 < len(data):
+            if data[position] != 0xFF:
+                return None
+            marker = data[position + 1]
+            length = struct.unpack(">H", bytes(data[position + 2:position + 4]))[0]
+            # SOF0-SOF15 carry the frame size (except DHT/JPG/DAC markers)
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", bytes(data[position + 5:position + 9]))
+                return width, height
+            position += 2 + length
+    return None
+
+
+def summarize_attachment(name, mime, data):
+    """Builds a compact description of an attachment for the prompt"""
+    if mime.startswith("image/"):
+        dimensions = image_dimensions(data, mime)
+        return f"image {dimensions[0]}x{dimensions[1]}" if dimensions else "image"
+    
+    # Only a bounded prefix is decoded for text summaries
+    text = bytes(data[:ATTACHMENT_SAMPLE_BYTES]).decode("utf-8", errors="replace")
+    
+    if mime == "text/csv" or name.lower().endswith(".csv"):
+        rows = list(itertools.islice(csv.reader(io.StringIO(text)), ATTACHMENT_SAMPLE_ROWS + 1))
+        if not rows:
+            return "empty CSV"
+        summary = f"CSV columns: {', '.join(column.strip() for column in rows[0])}"
+        for row in rows[1:]:
+            summary += f"\n    sample row: {', '.join(row)}"
+        return summary
+    
+    if mime == "application/json" or name.lower().endswith(".json"):
+        try:
+            parsed = json.loads(bytes(data).decode("utf-8"))
+        except ValueError:
+            return f"JSON (could not parse), starts with: {text[:200]}"
+        if isinstance(parsed, dict):
+            return f"JSON object with keys: {', '.join(list(parsed)[:20])}"
+        if isinstance(parsed, list):
+            first = parsed[0] if parsed else None
+            keys = f", item keys: {', '.join(list(first)[:20])}" if isinstance(first, dict) else ""
+            return f"JSON array of {len(parsed)} items{keys}"
+        return f"JSON value: {text[:200]}"
+    
+    if mime.startswith("text/"):
+        return f"text, starts with: {text[:200]}"
+    return mime
+
+
+def safe_attachment_filename(name, taken=()):
+    """
+    Keeps attachment files in the repo root and away from the generated files.
+    A name already in `taken` gets a numeric suffix (data.csv -> data-2.csv).
+    """
+    filename = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(name or "")) or "attachment"
+    if filename in RESERVED_FILENAMES:
+        filename = f"data-{filename}"
+    stem, extension = os.path.splitext(filename)
+    counter = 2
+    while filename in taken:
+        filename = f"{stem}-{counter}{extension}"
+        counter += 1
+    return filename
+
+
+def process_attachments(attachments):
+    """
+    Decodes and inspects request attachments.
+    
+    Returns:
+        List of dicts with name, filename (unique), mime, size, sha256 (of the
+        decoded bytes, or of the URL if not decoded), summary, data
+        (memoryview, or None if not committed) and url (for non-data URLs)
+    """
+    processed = []
+    filenames = set()
+    for att in attachments:
+        name = att.get('name', '')
+        url = att.get('url', '')
+        filename = safe_attachment_filename(name, filenames)
+        filenames.add(filename)
+        entry = {
+            "name": name,
+            "filename": filename,
+            "mime": mimetypes.guess_type(name)[0] or "application/octet-stream",
+            "size": None,
+            "sha256": hashlib.sha256(url.encode()).hexdigest(),
+            "summary": "",
+            "data": None,
+            "url": None
+        }
+        
+        try:
+            decoded = decode_data_uri(url, MAX_ATTACHMENT_BYTES)
+        except binascii.Error as e:
+            print(f"⚠️ Attachment {name} could not be decoded: {str(e)}")
+            entry['summary'] = "undecodable"
+            processed.append(entry)
+            continue
+        
+        if decoded is None:
+            # Remote URL: the app loads it directly
+            entry['url'] = url
+            entry['summary'] = "remote file"
+        else:
+            declared_mime, data, size = decoded
+            entry['size'] = size
+            if data is None:
+                entry['mime'] = declared_mime
+                entry['summary'] = f"too large to include ({size} bytes)"
+            else:
+                entry['mime'] = sniff_mime(data, declared_mime, name)
+                entry['data'] = data
+                entry['sha256'] = hashlib.sha256(data).hexdigest()
+                entry['summary'] = summarize_attachment(name, entry['mime'], data)
+        
+        processed.append(entry)
+    return processed
+
+
+def attachment_files(processed):
+    """Returns {filename: data} for the attachments to commit next to index.html"""
+    return {att['filename']: att['data'] for att in processed if att['data'] is not None}
+
+
+# ===== PROMPT BUDGET =====
+# Templates and truncation are in prompts.py; this records what they produce.
+
+PROMPT_TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def render_prompt(name, template, fixed, sections, budget=None):
+    """
+    Renders a prompt within its token budget (see prompts.fit_prompt) and
+    records its size in the llm_prompt_tokens histogram, labelled `name`.
+    
+    Returns:
+        The rendered prompt text
+    """
+    budget = budget or PROMPT_TOKEN_BUDGET
+    prompt, tokens, shrunk = fit_prompt(template, fixed, sections, budget)
+    
+    labels = {"prompt": name}
+    metrics.observe("llm_prompt_tokens", labels, tokens, buckets=PROMPT_TOKEN_BUCKETS)
+    if shrunk:
+        metrics.inc("llm_prompt_truncations_total", labels)
+        print(f"✂️ {name} prompt over budget, shrank {', '.join(shrunk)} (~{tokens}/{budget} tokens)")
+    trace_event("prompt", prompt=name, tokens=tokens, budget=budget, shrunk=shrunk)
+    return prompt
+
+
+# ===== GENERATION CACHE =====
+
+class GenerationCache:
+    """
+    Disk-backed cache of generated {html, readme} keyed on the prompt inputs.
+    
+    Entries are zlib-compressed JSON in SQLite. Reads refresh an entry's
+    access time; expired entries (TTL) and the least recently used entries
+    beyond the entry/byte limits are evicted on write.
+    """
+
+    def __init__(self, filename, ttl, max_entries, max_bytes):
+        self.filename = filename
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.conn = None
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _db(self):
+        # Opened on first use so importing the app does not touch DATA_DIR
+        if self.conn is None:
+            self.conn = open_sqlite(self.filename)
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS generation_cache ("
+                    "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self.conn.execute(
+                    "CREATE INDEX IF NOT EXISTS generation_cache_accessed "
+                    "ON generation_cache (accessed_at)"
+                )
+        return self.conn
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, created_at FROM generation_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if not row or now - row['created_at'] > self.ttl:
+                self.stats['misses'] += 1
+                metrics.inc("generation_cache_requests_total", {"result": "miss"})
+                return None
+            with db:
+                db.execute("UPDATE generation_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.stats['hits'] += 1
+            metrics.inc("generation_cache_requests_total", {"result": "hit"})
+        return json.loads(zlib.decompress(row['value']))
+
+    def put(self, key, value):
+        blob = zlib.compress(json.dumps(value).encode())
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO generation_cache (key, value, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, blob, len(blob), now, now)
+                )
+                self.stats['writes'] += 1
+                self._evict(db, now)
+
+    def _evict(self, db, now):
+        evicted = db.execute("DELETE FROM generation_cache WHERE created_at < ?", (now - self.ttl,)).rowcount
+        count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_cache").fetchone()
+        
+        # Drop least recently used entries until both limits hold
+        if count > self.max_entries or total > self.max_bytes:
+            for row in db.execute("SELECT key, size FROM generation_cache ORDER BY accessed_at").fetchall():
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM generation_cache WHERE key = ?", (row['key'],))
+                count -= 1
+                total -= row['size']
+                evicted += 1
+        self.stats['evictions'] += evicted
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+def generation_cache_key(brief, attachments, checks, task, round_num=1, base_sha=None):
+    """
+    Hashes the normalized prompt inputs and model config for one round.
+    Attachments (already processed) are reduced to (name, content hash); a
+    revision also depends on the page it patches (`base_sha`, its git blob id).
+    """
+    normalized = {
+        "task": (task or "").strip(),
+        "brief": " ".join((brief or "").split()),
+        "checks": [" ".join(str(check).split()) for check in checks],
+        "attachments": sorted(
+            (att['name'], att['sha256'])
+            for att in attachments
+        ),
+        "round": round_num,
+        "model": GEMINI_MODEL,
+        "streaming": LLM_STREAMING
+    }
+    if base_sha:
+        normalized["base"] = base_sha
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+generation_cache = GenerationCache(
+    'cache.db', GENERATION_CACHE_TTL, GENERATION_CACHE_MAX_ENTRIES, GENERATION_CACHE_MAX_BYTES
+)
+
+
+def answered_cache_key(prompt_hash, models):
+    """generation_cache key: the prompt hash plus the provider:model(s) that answered it"""
+    return hashlib.sha256(json.dumps([prompt_hash, sorted(models)]).encode()).hexdigest()
+
+
+def cached_generation(prompt_hash):
+    """
+    Validated files generated earlier for `prompt_hash` by the provider and
+    model the router would use now, so a failover answer is only reused
+    while that provider is still the one answering.
+    
+    Returns:
+        Dictionary with 'html' and 'readme', or None
+    """
+    if not GENERATION_CACHE_ENABLED:
+        return None
+    model = llm_router.preferred_model("stream" if LLM_STREAMING else "complete")
+    cached = generation_cache.get(answered_cache_key(prompt_hash, [model])) if model else None
+    if cached:
+        print("⚡ Using cached generation")
+    return cached
+
+
+def cache_generation(prompt_hash, models, generated_code):
+    """Stores validated files under the provider:model(s) that produced them (see cached_generation)"""
+    if GENERATION_CACHE_ENABLED and models:
+        generation_cache.put(answered_cache_key(prompt_hash, models), generated_code)
+
+
+def generate_code_with_llm(brief, attachments, checks, task):
+    """
+    Generates the app HTML and README with two concurrent LLM calls.
+    
+    The README prompt only needs task/brief/checks, so it runs alongside the
+    HTML generation instead of after it. A README failure falls back to
+    default_readme(); only an HTML failure fails the build.
+    
+    Returns:
+        Dictionary with 'html' and 'readme', or None
+    """
+    try:
+        html_future = submit_with_context(llm_executor, generate_html_with_llm, brief, attachments, checks)
+        readme_future = submit_with_context(llm_executor, generate_readme_with_llm, task, brief, checks)
+        
+        html_code = html_future.result()
+        if not html_code:
+            readme_future.cancel()
+            return None
+        
+        try:
+            readme_text = readme_future.result()
+        except Exception as e:
+            print(f"⚠️ README generation failed, using template: {str(e)}")
+            readme_text = default_readme(task, brief, checks)
+        
+        return {
+            "html": html_code,
+            "readme": readme_text
+        }
+        
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def build_html_payload(brief, attachments, checks):
+    """Builds the Gemini request for the full-page HTML generation"""
+    
+    # Describe attachments (see process_attachments) instead of inlining them
+    attachment_items = []
+    for att in attachments:
+        if att['url']:
+            source = f"load with fetch('{att['url']}')"
+        elif att['data'] is not None:
+            source = f"load with fetch('./{att['filename']}')"
+        else:
+            source = "not available"
+        attachment_items.append(f"- {att['filename']} ({att['mime']}): {source}\n  {att['summary']}")
+    
+    prompt = render_prompt("html", HTML_PROMPT, {
+        "attachments_header": "\nATTACHMENTS (files committed next to index.html):\n" if attachments else "",
+        # Special instructions for CSV files
+        "csv_instructions": CSV_INSTRUCTIONS if has_csv_attachment(attachments) else "",
+    }, [
+        ("attachments", attachment_items, truncate_attachments, 100),
+        ("brief", brief, truncate_text, 500),
+        ("checks", bullet_lines(checks), functools.partial(truncate_items, noun="checks"), 500),
+    ])
+    
+    return {
+        "contents": [{
+            "parts": [{"text": prompt}]
+        }],
+        "generationConfig": {
+            "temperature": 0.2,  # Even lower for consistency
+            "maxOutputTokens": 8000,
+        }
+    }
+
+
+def has_csv_attachment(attachments):
+    return any(att['mime'] == 'text/csv' or 'csv' in att['name'].lower() for att in attachments)
+
+
+def candidate_text(result):
+    """Returns the text of the first candidate in a Gemini response, or None"""
+    if 'candidates' not in result or not result['candidates']:
+        return None
+    return result['candidates'][0]['content']['parts'][0]['text']
+
+
+def validate_html(html_code):
+    """Returns the HTML if it looks like a page, otherwise logs a preview and returns None"""
+    if not ("<!DOCTYPE" in html_code or "<html" in html_code):
+        print("❌ Invalid HTML generated")
+        print(f"Preview: {html_code[:300]}")
+        return None
+    return html_code
+
+
+def streamed_html(extractor):
+    """The page collected by an HtmlExtractor once streaming has stopped"""
+    if extractor.rejected:
+        print("❌ Response is not HTML, stopped streaming early")
+    print(f"✅ Generated code ({len(extractor.text)} chars streamed)")
+    return extractor.result() or extractor.text.strip()
+
+
+@traced("llm_html")
+def generate_html_with_llm(brief, attachments, checks):
+    """Enhanced version with better CSV handling and streamlined prompt"""
+    try:
+        payload = build_html_payload(brief, attachments, checks)
+        print("🤖 Calling LLM API...")
+        
+        if LLM_STREAMING:
+            # Stop reading as soon as </html> arrives, or early if it is clearly not HTML
+            extractor = HtmlExtractor()
+            chunks = llm_router.stream(payload, LLM_HTML_TIMEOUT)
+            try:
+                for chunk in chunks:
+                    extractor.feed(chunk)
+                    if extractor.done or extractor.rejected:
+                        break
+            finally:
+                chunks.close()
+            
+            html_code = streamed_html(extractor)
+        else:
+            llm_response = llm_router.complete(payload, LLM_HTML_TIMEOUT)
+            print(f"✅ Generated code ({len(llm_response)} chars)")
+            html_code = extract_html(llm_response) or llm_response.strip()
+        
+        return validate_html(html_code)
+        
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+class HtmlExtractor:
+    """
+    Incrementally pulls the HTML document out of (streamed) LLM text.
+    
+    Feed chunks as they arrive. `done` turns True once the document's
+    </html> is seen, and `rejected` turns True when no <!DOCTYPE / <html
+    shows up within the first `start_limit` characters, i.e. the model is
+    writing prose, not a page.
+    
+    The document is tokenized as it streams (text, tags, comments and raw
+    <script>/<style> content), so an </html> inside a script, a comment or
+    an attribute value does not end it early.
+    """
+
+    START_MARKERS = ("<!DOCTYPE", "<html")
+    END_MARKER = "</html>"
+    RAW_TEXT_TAG = re.compile(r"<(script|style)[\s>/]", re.I)
+    TAG_START = re.compile(r"</?[A-Za-z!?]")
+    TAG_DELIMITER = re.compile(r"[\"'>]")
+    RAW_TEXT_END = {tag: re.compile(f"</{tag}", re.I) for tag in ("script", "style")}
+    # Longest lookahead needed to classify a "<": "<script" plus the following character
+    LOOKAHEAD = len("<script ")
+
+    def __init__(self, start_limit=None):
+        self.start_limit = start_limit or HTML_START_LIMIT
+        self.text = ""
+        self.start = None
+        self.end = None
+        self.scanned = 0
+        self.rejected = False
+        # Tokenizer state: "text", "tag", "comment" or "raw" (inside script/style)
+        self.position = None
+        self.state = "text"
+        self.quote = None
+        self.raw_tag = None
+        self.pending_raw_tag = None
+
+    @property
+    def done(self):
+        return self.end is not None
+
+    def feed(self, chunk):
+        if self.done or self.rejected:
+            return
+        self.text += chunk
+        
+        if self.start is None:
+            # Only rescan new text, plus enough overlap to catch a marker split across chunks
+            scan_from = max(self.scanned - len("<!DOCTYPE"), 0)
+            positions = [self.text.find(marker, scan_from) for marker in self.START_MARKERS]
+            positions = [position for position in positions if position != -1]
+            if positions:
+                self.start = self.position = min(positions)
+            elif len(self.text) > self.start_limit:
+                self.rejected = True
+        self.scanned = len(self.text)
+        
+        if self.start is not None:
+            self._scan()
+
+    def _scan(self):
+        """Advances the tokenizer over the new text; sets `end` at an </html> in plain text"""
+        text, length = self.text, len(self.text)
+        while self.position < length:
+            if self.state == "text":
+                lt = text.find("<", self.position)
+                if lt == -1:
+                    self.position = length
+                    return
+                ahead = text[lt:lt + self.LOOKAHEAD]
+                if ahead.lower().startswith(self.END_MARKER):
+                    self.end = lt + len(self.END_MARKER)
+                    return
+                if len(ahead) < self.LOOKAHEAD:
+                    # Could be the start of a marker split across chunks: wait for more text
+                    self.position = lt
+                    return
+                if ahead.startswith("<!--"):
+                    self.state, self.position = "comment", lt + 4
+                elif self.TAG_START.match(ahead):
+                    raw = self.RAW_TEXT_TAG.match(ahead)
+                    self.pending_raw_tag = raw.group(1).lower() if raw else None
+                    self.state, self.position = "tag", lt + 1
+                else:
+                    self.position = lt + 1
+            
+            elif self.state == "tag":
+                if self.quote:
+                    close = text.find(self.quote, self.position)
+                    if close == -1:
+                        self.position = length
+                        return
+                    self.quote, self.position = None, close + 1
+                    continue
+                match = self.TAG_DELIMITER.search(text, self.position)
+                if not match:
+                    self.position = length
+                    return
+                if match.group() == ">":
+                    self.raw_tag, self.pending_raw_tag = self.pending_raw_tag, None
+                    self.state = "raw" if self.raw_tag else "text"
+                else:
+                    self.quote = match.group()
+                self.position = match.end()
+            
+            elif self.state == "comment":
+                close = text.find("-->", self.position)
+                if close == -1:
+                    self.position = max(length - 2, self.position)
+                    return
+                self.state, self.position = "text", close + 3
+            
+            else:
+                # Raw text ends only at its closing tag, whatever the script's strings contain
+                close = self.RAW_TEXT_END[self.raw_tag].search(text, self.position)
+                if not close:
+                    self.position = max(length - len(f"</{self.raw_tag}"), self.position)
+                    return
+                self.state, self.raw_tag, self.position = "tag", None, close.start() + 1
+
+    def result(self):
+        """Returns the cleaned HTML, or None if no HTML document was found"""
+        if self.start is None:
+            return None
+        
+        # Clean markdown artifacts
+        html_code = self.text[self.start:self.end]
+        html_code = html_code.replace("```html", "").replace("```", "")
+        return html_code.strip()
+
+
+def extract_html(text):
+    """
+    Extracts the HTML document from a complete LLM response. With the whole
+    text available, the document ends at the LAST </html>.
+    """
+    extractor = HtmlExtractor(start_limit=len(text) + 1)
+    extractor.feed(text)
+    if extractor.start is not None:
+        end = text.rfind(HtmlExtractor.END_MARKER)
+        extractor.end = end + len(HtmlExtractor.END_MARKER) if end >= extractor.start else None
+    return extractor.result()
+
+
+def sse_text_parts(line):
+    """Text parts of the first candidate in one `data:` line of a Gemini SSE stream"""
+    if not line or not line.startswith("data:"):
+        return []
+    event = json.loads(line[len("data:"):])
+    return [
+        part['text']
+        for candidate in event.get('candidates', [])[:1]
+        for part in candidate.get('content', {}).get('parts', [])
+        if part.get('text')
+    ]
+
+
+def build_readme_payload(task, brief, checks):
+    """Builds the Gemini request for the Round 1 README"""
+    readme_prompt = render_prompt("readme", README_PROMPT, {"task": task}, [
+        ("brief", brief, truncate_text, 500),
+        ("checks", bullet_lines(checks), functools.partial(truncate_items, noun="requirements"), 300),
+    ])
+
+    return {
+        "contents": [{"parts": [{"text": readme_prompt}]}],
+        "generationConfig": {"temperature": 0.3, "maxOutputTokens": 1000}
+    }
+
+
+@traced("llm_readme")
+def generate_readme_with_llm(task, brief, checks):
+    """
+    Generates the README through the LLM router.
+    
+    Raises:
+        RuntimeError if no provider returns a usable README
+    """
+    readme_text = llm_router.complete(build_readme_payload(task, brief, checks), LLM_README_TIMEOUT)
+    print("✅ README generated")
+    return readme_text.strip()
+
+
+def default_readme(task, brief, checks):
+    """Template README used when README generation fails"""
+    features = "\n".join(f"- {check}" for check in checks) or "- See the live demo"
+    return f"""# {task}
+
+## Overview
+{brief}
+
+## Features
+{features}
+
+## How to Use
+Open `index.html` in a browser, or visit the GitHub Pages site for this repository.
+
+## Technology Stack
+- HTML, CSS and JavaScript
+- Bootstrap 5
+
+## Project Structure
+```
+index.html
+README.md
+LICENSE
+```
+
+## Local Development
+```bash
+git clone {github_repo_url(task.replace(' ', '-').lower())}.git
+```
+Then open `index.html` in a browser.
+
+## License
+MIT License
+"""
+
+# ===== LOCAL PAGE VALIDATION =====
+
+# Libraries a check can ask for: words in the check -> substrings of the <script src>/<link href> that loads it
+PAGE_LIBRARIES = {
+    "Bootstrap": (("bootstrap",), ("bootstrap",)),
+    "PapaParse": (("papaparse", "papa.parse"), ("papaparse",)),
+    "Chart.js": (("chart.js",), ("chart.js", "chart.umd", "/chart")),
+    "highlight.js": (("highlight.js", "hljs"), ("highlight",)),
+    "marked": (("marked.js", "marked.parse"), ("marked",)),
+}
+
+SELECTOR_CALL = re.compile(r"""(?:querySelector(?:All)?|\$\$?|locator|closest|matches)\(\s*(['"`])(.+?)\1""")
+ID_CALL = re.compile(r"""getElementById\(\s*(['"`])([^'"`]+)\1""")
+ID_MENTION = re.compile(r"(?<![\w&/#-])#([A-Za-z][\w-]*)(\$?\{)?")
+# A name directly followed by \0 (a replaced template placeholder) is only a prefix
+SELECTOR_PART = re.compile(r"([#.]?)(-?[A-Za-z_][\w-]*)(\0?)|\[\s*([\w-]+)")
+TEMPLATE_PLACEHOLDER = re.compile(r"\$?\{[^{}]*\}")
+# Playwright selector engines ("text=Total", "role=button[name=OK]"); css= and id= are checked, the rest skipped
+LOCATOR_ENGINE = re.compile(r"^\s*([a-z][\w-]*)\s*=\s*(.*)$", re.S)
+HEX_COLOR = re.compile(r"[0-9a-fA-F]{3,4}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8}")
+# A #hex mention is a colour only in a CSS value: right after ":" or near a colour property
+CSS_VALUE_CONTEXT = re.compile(r""":\s*["'`]?$|\b(?:colou?r|background|border|fill|stroke)\b""", re.I)
+HTML_ELEMENTS = frozenset("""
+    a abbr address area article aside audio b base bdi bdo blockquote body br button canvas caption cite
+    code col colgroup data datalist dd del details dfn dialog div dl dt em embed fieldset figcaption figure
+    footer form h1 h2 h3 h4 h5 h6 head header hgroup hr html i iframe img input ins kbd label legend li link
+    main map mark menu meta meter nav noscript object ol optgroup option output p picture pre progress q rp
+    rt ruby s samp script search section select slot small source span strong style sub summary sup table
+    tbody td template textarea tfoot th thead time title tr track u ul var video wbr
+    svg g path circle ellipse line polyline polygon rect
+""".split())
+
+
+class PageIndex:
+    """Element ids, classes, tags and attributes of a page, its external script/stylesheet URLs and its inline script text"""
+
+    def __init__(self):
+        self.ids = set()
+        self.classes = set()
+        self.tags = set()
+        self.attributes = set()
+        self.urls = []
+        self.scripts = []
+
+    def add_element(self, tag, attrs):
+        self.tags.add(tag)
+        for name, value in attrs:
+            self.attributes.add(name)
+            if not value:
+                continue
+            if name == "id":
+                self.ids.add(value)
+            elif name == "class":
+                self.classes.update(value.split())
+            elif name in ("src", "href") and tag in ("script", "link"):
+                self.urls.append(value.lower())
+
+    @property
+    def script_text(self):
+        return "\n".join(self.scripts)
+
+
+class PageParser(html.parser.HTMLParser):
+    """Fills a PageIndex using the standard library parser (used when lxml is not installed)"""
+
+    def __init__(self, index):
+        super().__init__(convert_charrefs=True)
+        self.index = index
+        self.in_script = False
+
+    def handle_starttag(self, tag, attrs):
+        self.index.add_element(tag, attrs)
+        self.in_script = tag == "script"
+
+    def handle_endtag(self, tag):
+        if tag == "script":
+            self.in_script = False
+
+    def handle_data(self, data):
+        if self.in_script:
+            self.index.scripts.append(data)
+
+
+def index_page(html_code):
+    """Parses a page into a PageIndex, with lxml if available"""
+    index = PageIndex()
+    if lxml is not None:
+        try:
+            root = lxml.html.document_fromstring(html_code)
+        except (ValueError, lxml.etree.ParserError):
+            root = None
+        if root is not None:
+            for element in root.iter():
+                if not isinstance(element.tag, str):
+                    continue  # comments and processing instructions
+                index.add_element(element.tag.lower(), element.attrib.items())
+                if element.tag == "script" and element.text:
+                    index.scripts.append(element.text)
+            return index
+    
+    parser = PageParser(index)
+    parser.feed(html_code)
+    parser.close()
+    return index
+
+
+def id_reference(value):
+    """("id", value), or ("id_prefix", ...) for a templated id like github-user-${seed}; None if nothing is fixed"""
+    prefix = TEMPLATE_PLACEHOLDER.split(value, 1)[0]
+    if prefix == value:
+        return ("id", value)
+    return ("id_prefix", prefix) if prefix else None
+
+
+def selector_references(selector):
+    """Element references in one CSS selector or Playwright locator string"""
+    references = set()
+    for part in selector.split(">>"):
+        part = part.strip()
+        engine = LOCATOR_ENGINE.match(part)
+        if engine and engine.group(1) == "id":
+            references.add(id_reference(engine.group(2).strip().strip("'\"")))
+            continue
+        if engine:
+            if engine.group(1) != "css":
+                continue  # text=, role=, xpath=, ... match on content, not on names
+            part = engine.group(2)
+        if part[:1] in ("'", '"'):
+            continue  # Playwright text selector
+        
+        # Drop pseudo-classes and attribute values, keep [name]; mark template placeholders
+        part = re.sub(r"::?[\w-]+(\([^)]*\))?", " ", part)
+        part = re.sub(r"\[\s*([\w-]+)[^\]]*\]", r"[\1]", part)
+        part = TEMPLATE_PLACEHOLDER.sub("\0", part)
+        for prefix, name, templated, attribute in SELECTOR_PART.findall(part):
+            if attribute:
+                references.add(("attribute", attribute))
+            elif prefix:
+                kind = {"#": "id", ".": "class"}[prefix]
+                references.add((f"{kind}_prefix", name) if templated else (kind, name))
+            elif not templated and name.lower() in HTML_ELEMENTS:
+                references.add(("tag", name.lower()))
+    references.discard(None)
+    return references
+
+
+def check_references(checks):
+    """
+    Element references in the evaluation checks. Ids and classes built from
+    template placeholders (`#item-${i}`) are reduced to their fixed prefix;
+    only real HTML element names count as tags.
+    
+    Returns:
+        Set of (kind, name) with kind "id", "id_prefix", "class",
+        "class_prefix", "tag" or "attribute"
+    """
+    references = set()
+    for check in checks:
+        text = str(check)
+        for match in ID_CALL.finditer(text):
+            references.add(id_reference(match.group(2)))
+        for match in SELECTOR_CALL.finditer(text):
+            references |= selector_references(match.group(2))
+        for match in ID_MENTION.finditer(text):
+            if match.group(2):
+                references.add(("id_prefix", match.group(1)))
+            elif not (HEX_COLOR.fullmatch(match.group(1))
+                      and CSS_VALUE_CONTEXT.search(text, max(0, match.start() - 30), match.start())):
+                references.add(("id", match.group(1)))
+    references.discard(None)
+    return references
+
+
+def created_by_script(kind, name, script_text):
+    """True if the page's inline scripts appear to create the element a check refers to"""
+    name = re.escape(name)
+    patterns = {
+        "id": rf"""\bid\s*=\s*\\?["'`]{name}\\?["'`]|\.id\s*=\s*["'`]{name}["'`]|setAttribute\(\s*["']id["']\s*,\s*["'`]{name}["'`]""",
+        "class": rf"""class(?:Name)?\s*=\s*\\?["'`][^"'`]*\b{name}\b|classList\.(?:add|toggle)\([^)]*["'`]{name}["'`]""",
+        "tag": rf"""createElement\(\s*["'`]{name}["'`]|<{name}[\s>/]""",
+        "attribute": name,
+        # A prefix only has to start the id/class the script writes
+        "id_prefix": rf"""\bid\s*=\s*\\?["'`]{name}|\.id\s*=\s*["'`]{name}|setAttribute\(\s*["']id["']\s*,\s*["'`]{name}""",
+        "class_prefix": rf"""class(?:Name)?\s*=\s*\\?["'`][^"'`]*\b{name}|classList\.(?:add|toggle)\([^)]*["'`]{name}""",
+    }
+    return re.search(patterns[kind], script_text, re.IGNORECASE if kind == "tag" else 0) is not None
+
+
+def page_problems(html_code, checks, attachments):
+    """
+    Checks a generated page offline: every element id, class, tag and
+    attribute referenced by the checks must exist (or be created by the
+    page's scripts), and libraries the checks or a CSV attachment call for
+    must be loaded.
+    
+    Returns:
+        List of problem descriptions, empty if the page passed
+    """
+    index = index_page(html_code)
+    script_text = index.script_text
+    present = {"id": index.ids, "class": index.classes, "tag": index.tags, "attribute": index.attributes}
+    
+    problems = []
+    for kind, name in sorted(check_references(checks)):
+        if kind.endswith("_prefix"):
+            found = any(value.startswith(name) for value in present[kind[:-len("_prefix")]])
+        else:
+            found = name in present[kind]
+        if found or created_by_script(kind, name, script_text):
+            continue
+        problems.append({
+            "id": f'no element with id="{name}"',
+            "id_prefix": f'no element with an id starting with "{name}"',
+            "class": f'no element with class "{name}"',
+            "class_prefix": f'no element with a class starting with "{name}"',
+            "tag": f"no <{name}> element",
+            "attribute": f"no element with a {name} attribute",
+        }[kind])
+    
+    check_text = " ".join(str(check) for check in checks).lower()
+    for library, (triggers, needles) in PAGE_LIBRARIES.items():
+        required = any(trigger in check_text for trigger in triggers)
+        if library == "PapaParse" and has_csv_attachment(attachments):
+            required = True
+        if required and not any(needle in url for url in index.urls for needle in needles):
+            problems.append(f"{library} is not loaded from a CDN <script>/<link>")
+    return problems
+
+
+def fix_brief(brief, problems):
+    """Brief for the targeted fix of a page that failed page_problems()"""
+    listed = "\n".join(f"- {problem}" for problem in problems)
+    return (
+        f"The page below was checked before deployment and has these problems:\n{listed}\n"
+        f"Fix only these, keeping everything else as it is. Original task: {brief}"
+    )
+
+
+def pick_fixed_page(html_code, fixed, problems, checks, attachments):
+    """Keeps the fixed page if it has fewer problems than the original"""
+    remaining = page_problems(fixed, checks, attachments) if fixed else problems
+    if fixed and len(remaining) < len(problems):
+        outcome = "fixed" if not remaining else "improved"
+        print(f"🔧 Targeted fix applied, {len(remaining)} problem(s) left")
+        html_code = fixed
+    else:
+        outcome = "unfixed"
+        print("⚠️ Targeted fix did not help, keeping the generated page")
+    metrics.inc("page_validation_total", {"result": outcome})
+    trace_event("page_validation", result=outcome, problems=problems, remaining=remaining)
+    return html_code
+
+
+def check_page_steps(html_code, brief, checks, attachments):
+    """
+    Validates the generated page locally before any GitHub I/O. If it misses
+    something the checks refer to, one targeted fix is requested as
+    SEARCH/REPLACE edits (see generate_revision_with_llm).
+    
+    Returns:
+        The page to push: the fixed one, or the original if it passed or the
+        fix did not help
+    """
+    if not PAGE_VALIDATION:
+        return html_code
+    
+    problems = page_problems(html_code, checks, attachments)
+    if not problems:
+        metrics.inc("page_validation_total", {"result": "passed"})
+        return html_code
+    
+    print(f"🔎 Page validation found {len(problems)} problem(s): {'; '.join(problems)}")
+    fixed = yield Call(generate_revision_with_llm, html_code, fix_brief(brief, problems), checks, attachments,
+                       afunc=agenerate_revision_with_llm)
+    return pick_fixed_page(html_code, fixed, problems, checks, attachments)
+
+
+@traced("validate")
+def check_generated_page(html_code, brief, checks, attachments):
+    return run_steps(check_page_steps(html_code, brief, checks, attachments))
+
+
+# ===== ROUND 2: Patch-Based Revisions =====
+
+# Markers only count on a line of their own, so "// =======" in a script is page text
+SEARCH_REPLACE_PATTERN = re.compile(r"^<<<<<<< SEARCH\n(.*?)^>>>>>>> REPLACE[ \t]*$", re.DOTALL | re.MULTILINE)
+SEARCH_REPLACE_DIVIDER = re.compile(r"^=======[ \t]*(?:\n|$)", re.MULTILINE)
+
+
+def parse_search_replace_blocks(text, html_code=None):
+    """
+    Parses SEARCH/REPLACE blocks from an LLM response into (search, replace)
+    pairs. A block whose text has several ======= lines is split at the
+    last one whose SEARCH part still occurs in `html_code` (if given), else
+    at the first.
+    """
+    blocks = []
+    for body in SEARCH_REPLACE_PATTERN.findall(text.replace("\r\n", "\n")):
+        splits = [
+            (body[:divider.start()].removesuffix("\n"), body[divider.end():].removesuffix("\n"))
+            for divider in SEARCH_REPLACE_DIVIDER.finditer(body)
+        ]
+        if not splits:
+            continue
+        matching = [split for split in splits if html_code is not None and split[0] and split[0] in html_code]
+        blocks.append(matching[-1] if matching else splits[0])
+    return blocks
+
+
+def apply_search_replace_blocks(html_code, blocks):
+    """
+    Applies SEARCH/REPLACE blocks in order. Each SEARCH text must appear
+    exactly once in the current document.
+    
+    Raises:
+        ValueError if there are no blocks, a block does not match exactly
+        once, or the result is no longer a complete HTML document
+    """
+    if not blocks:
+        raise ValueError("No SEARCH/REPLACE blocks in response")
+    
+    for i, (search, replace) in enumerate(blocks, 1):
+        count = html_code.count(search) if search else 0
+        if count != 1:
+            raise ValueError(f"Block {i}: SEARCH text found {count} times")
+        html_code = html_code.replace(search, replace, 1)
+    
+    if "</html>" not in html_code or not ("<!DOCTYPE" in html_code or "<html" in html_code):
+        raise ValueError("Patched document is not complete HTML")
+    return html_code
+
+
+def build_revision_payload(current_html, brief, checks, attachments):
+    """Builds the Gemini request for SEARCH/REPLACE edits to an existing page"""
+    attachment_items = [
+        f"- {att['filename']} ({att['mime']}): fetch('./{att['filename']}')\n  {att['summary']}"
+        for att in attachments if att['data'] is not None
+    ]
+    
+    # The current page has to be quoted verbatim, so only the rest is budgeted
+    prompt = render_prompt("revision", REVISION_PROMPT, {
+        "current_html": current_html,
+        "attachments_header": "ATTACHMENTS (files committed next to index.html):\n" if attachment_items else "",
+    }, [
+        ("attachments", attachment_items, truncate_attachments, 100),
+        ("brief", brief, truncate_text, 500),
+        ("checks", bullet_lines(checks), functools.partial(truncate_items, noun="checks"), 500),
+    ], budget=PROMPT_TOKEN_BUDGET + estimate_tokens(current_html))
+
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"temperature": 0.2, "maxOutputTokens": LLM_REVISION_MAX_TOKENS}
+    }
+    return payload
+
+
+def apply_revision_patch(current_html, patch_text):
+    """
+    Applies the edit blocks of an LLM revision response.
+    
+    Returns:
+        The revised HTML, or None if the patch does not apply
+    """
+    try:
+        blocks = parse_search_replace_blocks(patch_text, current_html)
+        revised = apply_search_replace_blocks(current_html, blocks)
+    except ValueError as e:
+        print(f"⚠️ Could not apply revision patch: {str(e)}")
+        return None
+    
+    print(f"✅ Applied {len(blocks)} edit blocks ({len(patch_text)} chars of patch)")
+    return revised
+
+
+@traced("llm_revision")
+def generate_revision_with_llm(current_html, brief, checks, attachments):
+    """
+    Asks the LLM for SEARCH/REPLACE edits to the existing page instead of a
+    full regeneration, and applies them locally.
+    
+    Returns:
+        The revised HTML, or None if the patch could not be generated or applied
+    """
+    payload = build_revision_payload(current_html, brief, checks, attachments)
+    try:
+        patch_text = llm_router.complete(payload, LLM_HTML_TIMEOUT)
+        return apply_revision_patch(current_html, patch_text)
+        
+    except Exception as e:
+        print(f"❌ Revision Error: {str(e)}")
+        return None
+
+
+def revise_code_steps(task, brief, attachments, checks):
+    """
+    Round 2 generation: patches the current index.html of the task's repo.
+    The README is written by update_repo_steps.
+    
+    Returns:
+        The revised page, or None to fall back to full regeneration (no
+        current page, or the patch failed)
+    """
+    repo_name = task.replace(' ', '-').lower()
+    current_html = yield Call(read_repo_file, repo_name, "index.html")
+    if current_html is None:
+        print("⚠️ No current index.html found, regenerating from scratch")
+        return None
+    
+    revised = yield Call(generate_revision_with_llm, current_html.decode(), brief, checks, attachments,
+                         afunc=agenerate_revision_with_llm)
+    return revised or None
+
+
+def extract_section(text, start_marker, end_marker):
+    """Helper function to extract sections from LLM response"""
+    try:
+        start_idx = text.find(start_marker)
+        if start_idx == -1:
+            return None
+        
+        start_idx += len(start_marker)
+        
+        if end_marker:
+            end_idx = text.find(end_marker, start_idx)
+            if end_idx == -1:
+                return text[start_idx:].strip()
+            return text[start_idx:end_idx].strip()
+        else:
+            return text[start_idx:].strip()
+    except:
+        return None
+
+
+# ===== REPO STATE CACHE =====
+
+def git_blob_sha(raw):
+    """Git's object id for a blob, so unchanged files can be detected without an API call"""
+    digest = hashlib.sha1(b"blob %d\0" % len(raw))
+    digest.update(raw)
+    return digest.hexdigest()
+
+
+class RepoStateStore:
+    """
+    Local record of what each generated repo looks like on GitHub, filled in
+    at push time: the head commit and tree, and per file the blob sha,
+    content hash and (for small files) the compressed content. Round 2 uses
+    it to skip unchanged files and to read the old README/index.html
+    without GitHub round-trips.
+    """
+
+    def __init__(self, filename, max_content_bytes):
+        self.filename = filename
+        self.max_content_bytes = max_content_bytes
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _db(self):
+        if self.conn is None:
+            self.conn = open_sqlite(self.filename)
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS repo_heads ("
+                    "repo TEXT PRIMARY KEY, commit_sha TEXT NOT NULL, tree_sha TEXT NOT NULL, "
+                    "updated_at REAL NOT NULL)"
+                )
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS repo_files ("
+                    "repo TEXT NOT NULL, path TEXT NOT NULL, blob_sha TEXT NOT NULL, "
+                    "content_hash TEXT, commit_sha TEXT, content BLOB, etag TEXT, "
+                    "updated_at REAL NOT NULL, PRIMARY KEY (repo, path))"
+                )
+        return self.conn
+
+    def head(self, repo):
+        with self.lock:
+            row = self._db().execute("SELECT * FROM repo_heads WHERE repo = ?", (repo,)).fetchone()
+        return dict(row) if row else None
+
+    def files(self, repo):
+        with self.lock:
+            rows = self._db().execute(
+                "SELECT path, blob_sha, content_hash, commit_sha, etag FROM repo_files WHERE repo = ?", (repo,)
+            ).fetchall()
+        return {row['path']: dict(row) for row in rows}
+
+    def file(self, repo, path):
+        """Returns the cached file record with decompressed `content` (None if not stored)"""
+        with self.lock:
+            row = self._db().execute(
+                "SELECT * FROM repo_files WHERE repo = ? AND path = ?", (repo, path)
+            ).fetchone()
+        if not row:
+            return None
+        record = dict(row)
+        record['content'] = zlib.decompress(row['content']) if row['content'] is not None else None
+        return record
+
+    def forget(self, repo):
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute("DELETE FROM repo_heads WHERE repo = ?", (repo,))
+                db.execute("DELETE FROM repo_files WHERE repo = ?", (repo,))
+
+    def record_file(self, repo, path, raw, blob_sha, commit_sha=None, etag=None):
+        content = zlib.compress(raw) if len(raw) <= self.max_content_bytes else None
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO repo_files "
+                    "(repo, path, blob_sha, content_hash, commit_sha, content, etag, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (repo, path, blob_sha, hashlib.sha256(raw).hexdigest(), commit_sha,
+                     content, etag, time.time())
+                )
+
+    def record_push(self, repo, raw_files, blob_shas, commit_sha, tree_sha, replace):
+        if replace:
+            self.forget(repo)
+        for path, raw in raw_files.items():
+            self.record_file(repo, path, raw, blob_shas[path], commit_sha)
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO repo_heads (repo, commit_sha, tree_sha, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (repo, commit_sha, tree_sha, time.time())
+                )
+
+
+repo_state = RepoStateStore('repo_state.db', REPO_STATE_MAX_CONTENT_BYTES)
+
+
+def read_repo_file(repo_name, path):
+    """
+    Reads a file of a generated repo, from the local repo state when
+    possible. A cold cache falls back to the Contents API with
+    If-None-Match, so an unchanged file costs a 304 and no quota.
+    
+    Returns:
+        The file content as bytes, or None if it does not exist
+    """
+    cached = repo_state.file(repo_name, path)
+    if cached and cached['content'] is not None and cached['commit_sha']:
+        # Recorded when we pushed it, so it is what the repo holds
+        return cached['content']
+    
+    headers = dict(GITHUB_HEADERS)
+    if cached and cached['etag'] and cached['content'] is not None:
+        headers['If-None-Match'] = cached['etag']
+    response = http_request("GET", f"{GITHUB_API_URL}/repos/{GITHUB_USERNAME}/{repo_name}/contents/{path}",
+                            headers=headers)
+    
+    if response.status_code == 304:
+        return cached['content']
+    if response.status_code != 200:
+        return None
+    
+    file_info = response.json()
+    raw = base64.b64decode(file_info['content'])
+    repo_state.record_file(repo_name, path, raw, file_info['sha'], etag=response.headers.get('ETag'))
+    return raw
+
+
+def repo_file_sha(repo_name, path):
+    """Git blob id of a file of a generated repo (see read_repo_file), or None if it does not exist"""
+    raw = read_repo_file(repo_name, path)
+    return git_blob_sha(raw) if raw is not None else None
+
+
+def plan_push(repo_name, files, base_on_parent):
+    """
+    Encodes the files for push_files and drops those the repo already has.
+    
+    Returns:
+        Tuple of (raw_files to upload, blob_shas of all files, head commit
+        sha if there is nothing to push)
+    """
+    raw_files = {
+        path: content.encode() if isinstance(content, str) else content
+        for path, content in files.items()
+    }
+    blob_shas = {path: git_blob_sha(raw) for path, raw in raw_files.items()}
+    
+    # Only push files whose content differs from what the repo already has
+    if base_on_parent:
+        known = repo_state.files(repo_name)
+        raw_files = {
+            path: raw for path, raw in raw_files.items()
+            if known.get(path, {}).get('blob_sha') != blob_shas[path]
+        }
+        head = repo_state.head(repo_name)
+        if not raw_files and head:
+            print(f"✅ No changes to push to {repo_name}")
+            return raw_files, blob_shas, head['commit_sha']
+    return raw_files, blob_shas, None
+
+
+def push_steps(repo_name, files, message, base_on_parent):
+    """
+    Pushes several files as ONE commit using the Git Data API:
+    blobs (created in parallel) -> tree -> commit -> move the branch ref.
+    
+    With base_on_parent, files whose blob sha matches the local repo state
+    are skipped, and the cached head/tree replace the GET ref/commit calls
+    (refreshed from GitHub if the ref moved under us).
+    
+    Args:
+        repo_name: Repository name under GITHUB_USERNAME
+        files: Dictionary of {path: str or bytes}
+        message: Commit message
+        base_on_parent: Keep files from the parent commit that are not in
+            `files` (False replaces the whole tree)
+    
+    Returns:
+        The new commit SHA (or the current head if nothing changed)
+    """
+    git_path = f"/repos/{GITHUB_USERNAME}/{repo_name}/git"
+    raw_files, blob_shas, unchanged_sha = yield Call(plan_push, repo_name, files, base_on_parent)
+    if unchanged_sha:
+        return unchanged_sha
+    
+    # STEP 1: Create one blob per changed file, in parallel
+    paths = list(raw_files)
+    trace_event("push_files", paths=paths, bytes=sum(len(raw) for raw in raw_files.values()))
+    responses = yield Parallel(
+        github_call("POST", f"{git_path}/blobs", json={
+            "content": base64.b64encode(raw_files[path]).decode(),
+            "encoding": "base64"
+        })
+        for path in paths
+    )
+    for path, blob_response in zip(paths, responses):
+        blob_response.raise_for_status()
+        blob_shas[path] = blob_response.json()['sha']
+    
+    for attempt in range(2):
+        # STEP 2: Current head of main (the parent of our commit), cached when possible
+        head = (yield Call(repo_state.head, repo_name)) if attempt == 0 else None
+        if head:
+            parent_sha, base_tree = head['commit_sha'], head['tree_sha']
+        else:
+            response = yield github_call("GET", f"{git_path}/ref/heads/main")
+            response.raise_for_status()
+            parent_sha = response.json()['object']['sha']
+            base_tree = None
+            if base_on_parent:
+                response = yield github_call("GET", f"{git_path}/commits/{parent_sha}")
+                response.raise_for_status()
+                base_tree = response.json()['tree']['sha']
         
-        payload = {
-            "contents": [{"parts": [{"text": "Say hello"}]}],
-            "generationConfig": {"temperature": 0.5, "maxOutputTokens": 100}
+        # STEP 3: Build the tree
+        tree_data = {
+            "tree": [
+                {"path": path, "mode": "100644", "type": "blob", "sha": blob_shas[path]}
+                for path in paths
+            ]
         }
+        if base_on_parent:
+            tree_data["base_tree"] = base_tree
         
-        response = requests.post(GEMINI_URL, json=payload, timeout=30)
+        response = yield github_call("POST", f"{git_path}/trees", json=tree_data)
+        response.raise_for_status()
+        tree_sha = response.json()['sha']
         
-        return jsonify({
-            "status_code": response.status_code,
-            "response": response.json()
+        # STEP 4: Commit and move the ref
+        response = yield github_call("POST", f"{git_path}/commits", json={
+            "message": message,
+            "tree": tree_sha,
+            "parents": [parent_sha]
         })
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        response.raise_for_status()
+        commit_sha = response.json()['sha']
+        
+        response = yield github_call("PATCH", f"{git_path}/refs/heads/main", json={"sha": commit_sha})
+        if response.status_code == 422 and head:
+            # Not a fast-forward: the cached head is stale
+            print(f"⚠️ Cached head of {repo_name} is stale, refreshing...")
+            continue
+        response.raise_for_status()
+        
+        yield Call(repo_state.record_push, repo_name, raw_files, blob_shas, commit_sha, tree_sha,
+                   replace=not base_on_parent)
+        print(f"✅ Pushed {', '.join(paths)} in commit {commit_sha[:7]}")
+        return commit_sha
 
 
+@traced("push")
+def push_files(repo_name, files, message, base_on_parent=True):
+    """Pushes `files` as one commit (see push_steps). Returns the commit SHA."""
+    return run_steps(push_steps(repo_name, files, message, base_on_parent))
 
-@app.route('/build-app', methods=['POST'])
-def build_app():
+
+def create_empty_repo_steps(repo_name, brief, reuse=True):
     """
-    Main endpoint that receives build requests from instructors.
-    This handles both Round 1 (initial build) and Round 2 (revisions).
+    Claims a pre-created repository, or creates one. An existing repo of
+    the same name (a rebuilt task, or a retry after the repo was created)
+    is reused if `reuse` is set: the Round 1 push replaces its whole tree,
+    so its site stays up until then and nothing is ever deleted.
+    
+    Returns:
+        The repo URL, or None if the name is taken and `reuse` is not set
+    Raises:
+        requests.HTTPError if GitHub refuses the creation
     """
-    try:
-        # Get JSON data from request
-        data = request.json
+    repo_url = (yield from claim_pool_repo_steps(repo_name, brief)) if REPO_POOL_SIZE > 0 else None
+    
+    if not repo_url:
+        repo_data = {
+            "name": repo_name,
+            "description": brief[:100],  # Max 100 chars for description
+            "private": False,  # Must be public for GitHub Pages
+            "auto_init": True  # The Git Data API needs an initial commit to build on
+        }
         
-        # STEP 1: Verify secret
-        if data.get('secret') != MY_SECRET:
-            return jsonify({"error": "Invalid secret"}), 401
+        response = yield github_call("POST", "/user/repos", json=repo_data)
         
-        print(f"✅ Secret verified for task: {data.get('task')}")
+        if response.status_code == 422 and not reuse:
+            print(f"⚠️ Repo {repo_name} exists, leaving it in place")
+            return None
+        if response.status_code == 422:
+            # Repo already exists: reuse it
+            response = yield github_call("GET", f"/repos/{GITHUB_USERNAME}/{repo_name}")
+            response.raise_for_status()
+            repo_url = response.json()['html_url']
+            print(f"♻️ Repo {repo_name} exists, reusing it: {repo_url}")
+        else:
+            response.raise_for_status()
+            repo_info = response.json()
+            repo_url = repo_info['html_url']
+            
+            print(f"✅ Created repo: {repo_url}")
+    
+    # What we knew about a repo of this name may be stale
+    yield Call(repo_state.forget, repo_name)
+    return repo_url
+
+
+def create_repo_steps(task_name, generated_code, brief, round_num, extra_files, repo_url):
+    """
+    Creates a GitHub repository and pushes the generated code.
+    
+    Args:
+        task_name: Unique name for the repo (e.g., "calculator-abc123")
+        generated_code: Dictionary with 'html' and 'readme'
+        brief: Description for the repo
+        round_num: Round number (1 or 2)
+        extra_files: Optional {path: bytes} to commit alongside (attachments)
+        repo_url: URL of a repo already provisioned for the task (see provision_steps)
+    
+    Returns:
+        Tuple of (repo_url, commit_sha)
+    """
+    try:
+        # Sanitize repo name (GitHub doesn't allow certain characters)
+        repo_name = task_name.replace(' ', '-').lower()
         
-        # STEP 2: Extract request data
-        email = data.get('email')
-        task = data.get('task')
-        round_num = data.get('round', 1)
-        nonce = data.get('nonce')
-        brief = data.get('brief')
-        checks = data.get('checks', [])
-        evaluation_url = data.get('evaluation_url')
-        attachments = data.get('attachments', [])
+        # Check if repo exists (for Round 2 updates)
+        if round_num == 2:
+            # For Round 2, we update existing repo
+            return (yield Call(update_github_repo, repo_name, generated_code, brief, extra_files,
+                               afunc=aupdate_github_repo))
         
-        print(f"📝 Building app for: {task} (Round {round_num})")
+        # STEP 1: Claim a pre-created repository, or create one
+        if not repo_url:
+            repo_url = yield from create_empty_repo_steps(repo_name, brief)
         
-        # STEP 3: Generate code using LLM
-        print("🤖 Calling LLM to generate code...")
-        generated_code = generate_code_with_llm(brief, attachments, checks, task)
+        # STEP 2: Push all files in a single commit (one Pages build)
+        files_to_create = {
+            **(extra_files or {}),
+            "index.html": generated_code['html'],
+            "README.md": generated_code['readme'],
+            "LICENSE": get_mit_license()
+        }
         
+        # Replace the whole tree so the auto_init README is dropped
+        commit_sha = yield Call(push_files, repo_name, files_to_create, "Add generated app",
+                                base_on_parent=False, afunc=apush_files)
         
-        if not generated_code:
-            return jsonify({"error": "Failed to generate code"}), 500
+        return repo_url, commit_sha
         
-        # STEP 4: Create GitHub repository
-        print("📦 Creating GitHub repository...")
-        repo_url, commit_sha = create_github_repo(task, generated_code, brief, round_num)
+    except Exception as e:
+        print(f"❌ GitHub Error: {str(e)}")
+        return None, None
+
+
+@traced("repo")
+def create_github_repo(task_name, generated_code, brief, round_num, extra_files=None, repo_url=None):
+    """Creates (or, in Round 2, updates) the task's repo; see create_repo_steps"""
+    return run_steps(create_repo_steps(task_name, generated_code, brief, round_num, extra_files, repo_url))
+
+
+def round2_readme(old_readme, brief):
+    """The existing README with a Round 2 section for `brief` appended"""
+    return old_readme + f"""
+---
+## Round 2 Enhancement
+**Updated:** {datetime.now().strftime('%Y-%m-%d')}
+### New Feature
+{brief}
+### Implementation
+- Updated with new functionality
+- All Round 1 features remain intact
+"""
+
+
+def update_repo_steps(repo_name, generated_code, brief, extra_files):
+    """Updates existing repo for Round 2"""
+    try:
+        # Get existing README (local repo state, or a conditional GET)
+        old_readme = yield Call(read_repo_file, repo_name, "README.md")
         
-        if not repo_url:
-            return jsonify({"error": "Failed to create GitHub repo"}), 500
-        
-        # STEP 5: Enable GitHub Pages
-        print("🌐 Enabling GitHub Pages...")
-        pages_url = enable_github_pages(task)
-
-
-        # # Replace placeholders in README
-        # if generated_code and "readme" in generated_code:
-        #     generated_code["readme"] = (
-        #         generated_code["readme"]
-        #         .replace("[REPO_URL]", repo_url)
-        #         .replace("[LIVE_DEMO_URL]", pages_url)
-        #     )
-        
-        if not pages_url:
-            return jsonify({"error": "Failed to enable GitHub Pages"}), 500
-
-        # NEW STEP 5.5: Wait for deployment to complete (Round 2 only)
-
-        # STEP 5.5: Wait for deployment to complete (both rounds)
-        import time
-        print(f"⏳ Waiting 47 seconds for GitHub Pages to deploy Round {round_num} changes...")
-        time.sleep(47)
-        print("✅ Deployment wait complete")
-
-        # import time
-        # if round_num == 1:
-        #     print("⏳ Waiting 47 seconds for GitHub Pages to deploy Round 1 changes...")
-        #     time.sleep(47)
-        #     print("✅ Deployment wait complete")
-
-        # if round_num == 2:
-        #     # NOW update README (after deployment is done)
-        #     repo_name = task.replace(' ', '-').lower()
-        #     update_readme_after_deployment(repo_name, generated_code.get('readme', ''))
-        #     print("⏳ Waiting 47 seconds for GitHub Pages to deploy Round 2 changes...")
-        #     time.sleep(47)
-        #     print("✅ Deployment wait complete")
-
-
-        # if round_num == 2:
-        #     # Update README and VERIFY it completed
-        #     repo_name = task.replace(' ', '-').lower()
-        #     readme_content = generated_code.get('readme', '')
-            
-        #     print(f"📝 Committing README update ({len(readme_content)} chars)...")
-        #     success = update_readme_after_deployment(repo_name, readme_content)
-            
-        #     if not success:
-        #         print("❌ CRITICAL: README commit failed!")
-        #         return jsonify({"error": "Failed to update README"}), 500
-            
-        #     print("✅ README commit completed")
+        if old_readme is not None:
+            old_readme = old_readme.decode()
             
-        #     # Now wait for deployment
-        #     print("⏳ Waiting 47 seconds for GitHub Pages to deploy Round 2 changes...")
-        #     time.sleep(47)
-        #     print("✅ Deployment wait complete")
-
-        # STEP 6: Notify evaluation URL
-        print("📤 Notifying evaluation URL...")
-        notification_success = notify_evaluation_url(
-            evaluation_url, email, task, round_num, nonce, 
-            repo_url, commit_sha, pages_url
-        )
+            # Append only the brief, not the full generated README
+            generated_code['readme'] = round2_readme(old_readme, brief)
+        elif generated_code['readme'] is None:
+            # A patched page comes without a README; start one for a repo that has none
+            generated_code['readme'] = round2_readme(f"# {repo_name}\n", brief)
         
-        if not notification_success:
-            print("⚠️ Warning: Failed to notify evaluation URL (will retry)")
+        # Update files in a single commit
+        files_to_update = {
+            **(extra_files or {}),
+            "index.html": generated_code['html'],
+            "README.md": generated_code['readme']
+        }
         
-        print(f"✅ Successfully completed task: {task}")
+        commit_sha = yield Call(push_files, repo_name, files_to_update, "Round 2: Update index.html and README.md",
+                                afunc=apush_files)
         
-        # Return success response
-        return jsonify({
-            "message": "App built and deployed successfully",
-            "task": task,
-            "round": round_num,
-            "repo_url": repo_url,
-            "pages_url": pages_url,
-            "commit_sha": commit_sha
-        }), 200
+        repo_url = github_repo_url(repo_name)
+        return repo_url, commit_sha
         
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        print(f"❌ Update Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return None, None
 
 
-def generate_code_with_llm(brief, attachments, checks, task):
-    """Enhanced version with better CSV handling and streamlined prompt"""
+@traced("repo_update")
+def update_github_repo(repo_name, generated_code, brief, extra_files=None):
+    """Updates existing repo for Round 2 (see update_repo_steps)"""
+    return run_steps(update_repo_steps(repo_name, generated_code, brief, extra_files))
+
+
+def pages_steps(repo_name):
+    """
+    Enables GitHub Pages for the repository.
     
-    # Decode attachments if present
-    attachment_info = ""
-    attachment_urls = {}
-    
-    if attachments:
-        attachment_info = "\n\nATTACHMENTS:\n"
-        for att in attachments:
-            attachment_info += f"- {att['name']}: Use data URL directly in fetch()\n"
-            attachment_urls[att['name']] = att['url']
-    
-    # Special instructions for CSV files
-    csv_instructions = ""
-    has_csv = any('csv' in att['name'].lower() for att in attachments)
-    
-    if has_csv:
-        csv_instructions = """
-CSV HANDLING (CRITICAL):
-- Include: <script src="https://cdnjs.cloudflare.com/ajax/libs/PapaParse/5.4.1/papaparse.min.js"></script>
-- Parse: Papa.parse(csvText, {header: true, dynamicTyping: true, skipEmptyLines: true, delimitersToGuess: [',', '\t', '|']})
-- NEVER assume column names - use actual headers from parsed data
-- Strip whitespace from headers: Object.keys(parsed.data[0]).map(k => k.trim())
-- Calculate sums properly: rows.reduce((sum, row) => sum + (parseFloat(row[colName]) || 0), 0)
-- Console.log the parsed data to verify
-- Handle missing/null values with || 0
-"""
+    Returns:
+        The GitHub Pages URL
+    """
+    if repo_pool.pages_ready(repo_name):
+        print(f"✅ GitHub Pages already enabled on pooled repo: {pages_site_url(repo_name)}")
+        return pages_site_url(repo_name)
     
     try:
-        prompt = f"""Create a complete, working single-page HTML application.
-TASK: {brief}
-{attachment_info}
-{csv_instructions}
-EVALUATION CHECKS (MUST PASS):
-{chr(10).join(f"- {check}" for check in checks)}
-TECHNICAL SPECS:
-- ONE HTML file with inline CSS/JS
-- Bootstrap 5: https://cdnjs.cloudflare.com/ajax/libs/bootstrap/5.3.2/css/bootstrap.min.css
-- For data URLs: fetch('{list(attachment_urls.values())[0] if attachment_urls else ""}').then(r => r.text())
-- Match ALL element IDs/classes in checks exactly
-- Professional UI, no placeholders
-- All functionality must work on first load
-CRITICAL: Return ONLY the HTML. Start with <!DOCTYPE html>, end with </html>. No markdown blocks."""
-
-        print("🤖 Calling Gemini API...")
-        
-        GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={GEMINI_API_KEY}"
-        
-        payload = {
-            "contents": [{
-                "parts": [{"text": prompt}]
-            }],
-            "generationConfig": {
-                "temperature": 0.2,  # Even lower for consistency
-                "maxOutputTokens": 8000,
+        pages_data = {
+            "source": {
+                "branch": "main",
+                "path": "/"
             }
         }
         
-        response = requests.post(GEMINI_URL, json=payload, timeout=120)
-        
-        if response.status_code != 200:
-            print(f"❌ Gemini Error: {response.text}")
-            return None
-        
-        result = response.json()
-        
-        # Extract generated code
-        if 'candidates' not in result or not result['candidates']:
-            print("❌ No candidates in response")
-            return None
-        
-        llm_response = result['candidates'][0]['content']['parts'][0]['text']
-        
-        print(f"✅ Generated code ({len(llm_response)} chars)")
-        
-        # Clean markdown artifacts
-        html_code = llm_response.strip()
-        html_code = html_code.replace("```html", "").replace("```", "")
-        
-        # Extract HTML if wrapped in other text
-        if "<!DOCTYPE" in html_code:
-            start = html_code.index("<!DOCTYPE")
-            html_code = html_code[start:]
-        elif "<html" in html_code:
-            start = html_code.index("<html")
-            html_code = html_code[start:]
-        
-        if "</html>" in html_code:
-            end = html_code.rindex("</html>") + 7
-            html_code = html_code[:end]
-        
-        html_code = html_code.strip()
-        
-        # Validate
-        if not ("<!DOCTYPE" in html_code or "<html" in html_code):
-            print("❌ Invalid HTML generated")
-            print(f"Preview: {html_code[:300]}")
-            return None
-        
-        # Generate README
-        readme_prompt = f"""Generate a professional README.md for a GitHub project with these details:
-**Project Name:** {task}
-**Purpose:** {brief}
-**Requirements to highlight:**
-{chr(10).join(f'- {check}' for check in checks)}
-Create a README with these sections:
-1. **Title** - Short, descriptive project name
-2. **Overview** - 2-3 sentences explaining what it does
-3. **Features** - Bullet list of key capabilities based on the requirements
-5. **How to Use** - Step-by-step user instructions
-6. **Technology Stack** - List all libraries/frameworks used
-7. **Project Structure** - Show the file tree
-8. **Local Development** - Clone and run using git clone 
-9. **License** - Mention MIT License
-CRITICAL RULES:
-- Use actual URLs, not placeholders like [GitHub Pages URL]
-- Be specific about what the app does based on the brief
-- Keep it professional - no "auto-generated" footers
-- Use markdown formatting properly
-- Length: 150-250 words
-Return the markdown content directly without wrapping it in triple backticks or code fences."""
-
-        readme_payload = {
-            "contents": [{"parts": [{"text": readme_prompt}]}],
-            "generationConfig": {"temperature": 0.3, "maxOutputTokens": 1000}
-        }
-        
-        readme_response = requests.post(GEMINI_URL, json=readme_payload, timeout=60)
-        readme_result = readme_response.json()
-        
-        readme_text = readme_result["candidates"][0]["content"]["parts"][0]["text"].strip()
-        print("✅ README generated")
-        
-        return {
-            "html": html_code,
-            "readme": readme_text
-        }
+        response = yield github_call("POST", f"/repos/{GITHUB_USERNAME}/{repo_name}/pages", json=pages_data)
         
+        return pages_enabled(repo_name, response.status_code)
+            
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
+        print(f"❌ Pages Error: {str(e)}")
+        # Return expected URL even if API call failed
+        return pages_site_url(repo_name)
+
+
+@traced("pages_enable")
+def enable_github_pages(repo_name):
+    """Enables GitHub Pages (see pages_steps). Returns the Pages URL."""
+    return run_steps(pages_steps(repo_name))
+
+
+def pages_site_url(repo_name):
+    return PAGES_SITE_URL.format(owner=GITHUB_USERNAME, repo=repo_name)
 
-# ===== ROUND 2: Append Enhancement Section =====
 
-def generate_round2_readme_update(old_readme, brief, checks):
-    """Generate prompt for updating README with Round 2 changes"""
+def github_repo_url(repo_name):
+    return f"{GITHUB_WEB_URL}/{GITHUB_USERNAME}/{repo_name}"
+
+
+def pages_enabled(repo_name, status_code):
+    """Logs the result of the enable-Pages call and returns the site URL"""
+    # 201 = created, 409 = already exists (both are OK)
+    if status_code in [201, 409]:
+        print(f"✅ GitHub Pages enabled: {pages_site_url(repo_name)}")
+    else:
+        # Return the expected URL anyway
+        print(f"⚠️ Pages status: {status_code}")
+    return pages_site_url(repo_name)
+
+
+# ===== SPECULATIVE REPO PROVISIONING =====
+
+def provision_steps(job_id, task_name, brief):
+    """
+    Creates (or claims) the Round 1 repo, enables Pages on it and records
+    the job's provision stage. Neither depends on the generated code, so the
+    pipeline runs this in the background while the LLM is generating and
+    only pushes once both are done.
     
-    prompt = f"""You have an existing README.md. Append a "Round 2 Enhancement" section at the end.
-**Existing README:**
-```markdown
-{old_readme}
-```
-**New Enhancement Brief:** {brief}
-**New Requirements:**
-{chr(10).join(f'- {check}' for check in checks)}
-Create a new section with:
-1. **## Round 2 Enhancement** header
-2. **Updated date:** {datetime.now().strftime('%Y-%m-%d')}
-3. **### New Feature** - Describe what was added based on the brief (be specific, not generic)
-4. **### Implementation Details** - Bullet points explaining:
-   - What new elements/IDs were added
-   - How it integrates with existing functionality
-   - Any new user-facing behavior
-CRITICAL RULES:
-- Be SPECIFIC about what changed, not vague like "Updated with new functionality"
-- Mention actual HTML IDs, functions, or features from the brief
-- Keep all Round 1 content unchanged
-- Return ONLY the new section to append, not the full README
-Return format:
-```markdown
----
-## Round 2 Enhancement
-[your content here]
-```
-"""
-    return prompt
+    An existing repo of the same name (a rebuilt task) is never touched
+    here: generation may still fail, and its site must stay up until there
+    is something to replace it with. The pipeline then creates the repo
+    after generation, as without SPECULATIVE_REPOS.
+    
+    Returns:
+        Tuple of (repo_url, pages_url), or (None, None) if nothing was provisioned
+    """
+    repo_name = task_name.replace(' ', '-').lower()
+    try:
+        repo_url = yield from create_empty_repo_steps(repo_name, brief, reuse=False)
+    except Exception as e:
+        print(f"❌ GitHub Error: {str(e)}")
+        yield stage_call(job_id, "provision", "failed")
+        return None, None
+    if not repo_url:
+        yield stage_call(job_id, "provision", "skipped")
+        return None, None
+    pages_url = yield Call(enable_github_pages, repo_name, afunc=aenable_github_pages)
+    yield stage_call(job_id, "provision", "done", repo_url=repo_url, pages_url=pages_url)
+    return repo_url, pages_url
 
-        
-    #     print(f"✅ Validation passed ({len(html_code)} chars)")
-        
-    #     return {
-    #         "html": html_code,
-    #         "readme": readme
-    #     }
-        
-    # except Exception as e:
-    #     print(f"❌ Error: {str(e)}")
-    #     import traceback
-    #     traceback.print_exc()
-    #     return None
 
-def extract_section(text, start_marker, end_marker):
-    """Helper function to extract sections from LLM response"""
+@traced("repo_provision")
+def provision_github_repo(job_id, task_name, brief):
+    """Provisions the Round 1 repo (see provision_steps)"""
+    return run_steps(provision_steps(job_id, task_name, brief))
+
+
+def release_provisioned_repo(task_name, repo_url):
+    """
+    Disposes of a provisioned repo whose build failed before anything was
+    pushed. With a repo pool it becomes a placeholder (Pages is already on),
+    otherwise it is deleted.
+    """
+    if not repo_url:
+        return
+    repo_name = task_name.replace(' ', '-').lower()
     try:
-        start_idx = text.find(start_marker)
-        if start_idx == -1:
-            return None
+        if REPO_POOL_SIZE > 0 and repo_pool.adopt(repo_name):
+            return
+        github_request("DELETE", f"/repos/{GITHUB_USERNAME}/{repo_name}")
+        repo_state.forget(repo_name)
+        print(f"🧹 Deleted unused repo {repo_name}")
+    except Exception as e:
+        print(f"⚠️ Could not clean up repo {repo_name}: {str(e)}")
+
+
+# ===== PRE-CREATED REPOSITORY POOL =====
+
+class RepoPool:
+    """
+    Warm pool of placeholder repos, created ahead of time with Pages already
+    enabled and tracked in SQLite under DATA_DIR. Round 1 claims one and
+    renames it (see claim_pool_repo_steps) instead of creating a repo and enabling
+    Pages while the build waits.
+    
+    A background thread keeps `size` placeholders ready or being created,
+    starting at most one creation every `refill_interval` seconds.
+    """
+
+    def __init__(self, filename, size, refill_interval):
+        self.filename = filename
+        self.size = size
+        self.refill_interval = refill_interval
+        self.conn = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.renamed = set()  # claimed by this process; Pages is already on
+
+    def _db(self):
+        if self.conn is None:
+            self.conn = open_sqlite(self.filename)
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS repo_pool ("
+                    "name TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+                )
+        return self.conn
+
+    def start(self):
+        if self.size <= 0 or not GITHUB_TOKEN:
+            return
+        with self.lock:
+            if self.thread:
+                return
+            db = self._db()
+            with db:
+                # Creations older than this were interrupted by a dead process
+                db.execute(
+                    "DELETE FROM repo_pool WHERE status IN ('creating', 'claimed') AND updated_at < ?",
+                    (time.time() - 600,)
+                )
+            self.thread = threading.Thread(target=self._run, name="repo-pool", daemon=True)
+            self.thread.start()
+
+    def counts(self):
+        with self.lock:
+            rows = self._db().execute("SELECT status, COUNT(*) AS n FROM repo_pool GROUP BY status").fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def snapshot(self):
+        return {"size": self.size, **self.counts()} if self.size > 0 else {"size": 0}
+
+    def take(self):
+        """Atomically claims the oldest ready placeholder. Returns its name, or None if the pool is empty."""
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT name FROM repo_pool WHERE status = 'ready' ORDER BY created_at LIMIT 5"
+            ).fetchall()
+            for row in rows:
+                with db:
+                    claimed = db.execute(
+                        "UPDATE repo_pool SET status = 'claimed', updated_at = ? WHERE name = ? AND status = 'ready'",
+                        (now, row['name'])
+                    ).rowcount
+                if claimed:
+                    self.wakeup.set()
+                    return row['name']
+        metrics.inc("repo_pool_events_total", {"event": "empty"})
+        return None
+
+    def release(self, name):
+        """Returns a placeholder whose rename failed to the pool"""
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "UPDATE repo_pool SET status = 'ready', updated_at = ? WHERE name = ?", (time.time(), name)
+                )
+
+    def remove(self, name, renamed_to=None):
+        """Forgets a placeholder, either renamed into a build repo or lost"""
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute("DELETE FROM repo_pool WHERE name = ?", (name,))
+            if renamed_to:
+                self.renamed.add(renamed_to)
+        metrics.inc("repo_pool_events_total", {"event": "claimed" if renamed_to else "discarded"})
+
+    def adopt(self, repo_name):
+        """
+        Renames an unused build repo with Pages enabled to a placeholder and
+        adds it to the pool. Returns False if the rename failed.
+        """
+        name = f"{REPO_POOL_PREFIX}{uuid.uuid4().hex[:12]}"
+        response = github_request("PATCH", f"/repos/{GITHUB_USERNAME}/{repo_name}", json={
+            "name": name,
+            "description": "Reserved for a generated app"
+        })
+        if not 200 <= response.status_code < 300:
+            return False
         
-        start_idx += len(start_marker)
+        repo_state.forget(repo_name)
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "INSERT INTO repo_pool (name, status, created_at, updated_at) VALUES (?, 'ready', ?, ?)",
+                    (name, now, now)
+                )
+        metrics.inc("repo_pool_events_total", {"event": "adopted"})
+        print(f"🏊 Returned unused repo {repo_name} to the pool as {name}")
+        return True
+
+    def pages_ready(self, repo_name):
+        """True (once) if `repo_name` was claimed from the pool, so Pages is already enabled"""
+        with self.lock:
+            if repo_name in self.renamed:
+                self.renamed.discard(repo_name)
+                return True
+        return False
+
+    def _create(self):
+        name = f"{REPO_POOL_PREFIX}{uuid.uuid4().hex[:12]}"
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "INSERT INTO repo_pool (name, status, created_at, updated_at) VALUES (?, 'creating', ?, ?)",
+                    (name, now, now)
+                )
+        try:
+            response = github_request("POST", "/user/repos", json={
+                "name": name,
+                "description": "Reserved for a generated app",
+                "private": False,
+                "auto_init": True
+            })
+            response.raise_for_status()
+            
+            response = github_request("POST", f"/repos/{GITHUB_USERNAME}/{name}/pages", json={
+                "source": {"branch": "main", "path": "/"}
+            })
+            if response.status_code not in [201, 409]:
+                github_request("DELETE", f"/repos/{GITHUB_USERNAME}/{name}")
+                raise RuntimeError(f"Pages status {response.status_code}")
+        except Exception:
+            self.remove(name)
+            raise
         
-        if end_marker:
-            end_idx = text.find(end_marker, start_idx)
-            if end_idx == -1:
-                return text[start_idx:].strip()
-            return text[start_idx:end_idx].strip()
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "UPDATE repo_pool SET status = 'ready', updated_at = ? WHERE name = ?", (time.time(), name)
+                )
+        metrics.inc("repo_pool_events_total", {"event": "created"})
+        print(f"🏊 Pooled repo {name} ready")
+
+    def _run(self):
+        while True:
+            counts = {}
+            try:
+                counts = self.counts()
+                if counts.get('ready', 0) + counts.get('creating', 0) < self.size:
+                    self._create()
+                    time.sleep(self.refill_interval)
+                    continue
+            except Exception as e:
+                print(f"⚠️ Repo pool refill failed: {str(e)}")
+                time.sleep(max(self.refill_interval, 30))
+                continue
+            metrics.gauge_set("repo_pool_ready", None, counts.get('ready', 0))
+            # Woken by take(); the timeout catches claims made by other processes
+            self.wakeup.wait(60)
+            self.wakeup.clear()
+
+
+repo_pool = RepoPool('repo_pool.db', REPO_POOL_SIZE, REPO_POOL_REFILL_INTERVAL)
+
+
+def claim_pool_repo_steps(repo_name, brief):
+    """
+    Renames a pooled placeholder to `repo_name` (PATCH name/description).
+    If a repo of that name exists, the placeholder goes back to the pool.
+    
+    Returns:
+        The repo URL, or None if the pool is empty or the rename failed
+    """
+    placeholder = yield Call(repo_pool.take)
+    if not placeholder:
+        return None
+    
+    path = f"/repos/{GITHUB_USERNAME}/{placeholder}"
+    rename = {"name": repo_name, "description": brief[:100]}
+    try:
+        response = yield github_call("PATCH", path, json=rename)
+    except Exception as e:
+        print(f"⚠️ Could not claim pooled repo {placeholder}: {str(e)}")
+        yield Call(repo_pool.remove, placeholder)
+        return None
+    return (yield Call(pool_claim_result, placeholder, repo_name, response))
+
+
+def pool_claim_result(placeholder, repo_name, response):
+    """Records the outcome of a placeholder rename; returns the repo URL or None"""
+    if not 200 <= response.status_code < 300:
+        print(f"⚠️ Could not claim pooled repo {placeholder}: HTTP {response.status_code}")
+        if response.status_code == 404:
+            repo_pool.remove(placeholder)
         else:
-            return text[start_idx:].strip()
-    except:
+            repo_pool.release(placeholder)
         return None
+    
+    repo_pool.remove(placeholder, renamed_to=repo_name)
+    repo_url = response.json()['html_url']
+    print(f"✅ Claimed pooled repo {placeholder} as {repo_url}")
+    return repo_url
+
+
+# ===== GITHUB PAGES DEPLOYMENT WATCHER =====
+
+def pages_build_status(build, commit_sha):
+    """Maps a Pages builds/latest record to "ready", "errored" or "pending" for `commit_sha`"""
+    if build.get('commit') != commit_sha:
+        return "pending"
+    if build.get('status') == "built":
+        return "ready"
+    if build.get('status') == "errored":
+        return "errored"
+    return "pending"
+
+
+def site_updated_since(response, since):
+    """True if a HEAD on the Pages site shows it was modified after `since`"""
+    if response.status_code != 200:
+        return False
+    last_modified = response.headers.get('Last-Modified')
+    return bool(last_modified) and parsedate_to_datetime(last_modified).timestamp() >= since - 5
 
 
-def create_github_repo(task_name, generated_code, brief, round_num):
+def check_pages_deployment(repo_name, commit_sha, pages_url, since):
     """
-    Creates a GitHub repository and pushes the generated code.
+    Checks whether GitHub Pages is serving the given commit.
     
-    Args:
-        task_name: Unique name for the repo (e.g., "calculator-abc123")
-        generated_code: Dictionary with 'html' and 'readme'
-        brief: Description for the repo
-        round_num: Round number (1 or 2)
+    Uses the Pages builds API first. If that is unavailable, falls back to a
+    HEAD on the site and accepts it once it was modified after `since`.
     
     Returns:
-        Tuple of (repo_url, commit_sha)
+        "ready", "errored" or "pending"
     """
     try:
-        # Sanitize repo name (GitHub doesn't allow certain characters)
-        repo_name = task_name.replace(' ', '-').lower()
-        
-        # Check if repo exists (for Round 2 updates)
-        if round_num == 2:
-            # For Round 2, we update existing repo
-            return update_github_repo(repo_name, generated_code, brief)
-        
-        # STEP 1: Create the repository
-        create_repo_url = "https://api.github.com/user/repos"
-        headers = {
-            "Authorization": f"token {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json"
-        }
-        
-        repo_data = {
-            "name": repo_name,
-            "description": brief[:100],  # Max 100 chars for description
-            "private": False,  # Must be public for GitHub Pages
-            "auto_init": False
-        }
-        
-        response = requests.post(create_repo_url, headers=headers, json=repo_data)
-        
-        if response.status_code == 422:
-            # Repo already exists, delete and recreate
-            print(f"⚠️ Repo {repo_name} exists, deleting...")
-            delete_url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}"
-            requests.delete(delete_url, headers=headers)
-            # Wait a bit and try again
-            import time
-            time.sleep(2)
-            response = requests.post(create_repo_url, headers=headers, json=repo_data)
+        response = github_request("GET", f"/repos/{GITHUB_USERNAME}/{repo_name}/pages/builds/latest", timeout=10)
         
-        response.raise_for_status()
-        repo_info = response.json()
-        repo_url = repo_info['html_url']
-        
-        print(f"✅ Created repo: {repo_url}")
+        if response.status_code == 200:
+            return pages_build_status(response.json(), commit_sha)
         
-        # STEP 2: Create files in the repository
-        files_to_create = {
-            "index.html": generated_code['html'],
-            "README.md": generated_code['readme'],
-            "LICENSE": get_mit_license()
+        response = http_request("HEAD", pages_url, max_retries=0, timeout=10, allow_redirects=True)
+        if site_updated_since(response, since):
+            return "ready"
+    except Exception as e:
+        print(f"⚠️ Deployment check failed for {repo_name}: {str(e)}")
+    
+    return "pending"
+
+
+def record_deploy_wait(repo_name, started_at, status):
+    """Logs and records metrics for a finished Pages deploy wait"""
+    waited = time.time() - started_at
+    print(f"🌐 Pages deployment for {repo_name}: {status} after {waited:.1f}s")
+    
+    labels = {"stage": "deploy_wait"}
+    metrics.gauge_add("build_stage_in_flight", labels, -1)
+    metrics.observe("build_stage_duration_seconds", labels, waited)
+    if status != "ready":
+        metrics.inc("build_stage_failures_total", labels)
+    trace_event("stage", stage="deploy_wait", status=status, duration=round(waited, 4))
+
+
+class DeploymentWatcher:
+    """
+    Waits for GitHub Pages deployments without holding a thread per build.
+    
+    Pending deployments sit in a heap ordered by their next check time. One
+    scheduler thread hands due checks to a small executor, and each check
+    either reschedules itself with a longer interval or fires the callback.
+    """
+
+    def __init__(self, timeout, initial_interval, max_interval, workers=4):
+        self.timeout = timeout
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pages-check")
+        self.pending = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.active = 0
+        self.checking = set()  # ids of entries whose check is on the executor
+        self.flush_status = None
+        self.flushed = 0
+
+    def watch(self, repo_name, commit_sha, pages_url, callback):
+        """
+        Starts watching a deployment. `callback(status)` is called once with
+        "ready", "errored", "timeout" or (on shutdown) "interrupted".
+        """
+        now = time.time()
+        entry = {
+            "repo_name": repo_name,
+            "commit_sha": commit_sha,
+            "pages_url": pages_url,
+            "callback": callback,
+            "started_at": now,
+            "deadline": now + self.timeout,
+            "interval": self.initial_interval,
+            "context": contextvars.copy_context()
         }
+        metrics.gauge_add("build_stage_in_flight", {"stage": "deploy_wait"}, 1)
+        with self.condition:
+            self.active += 1
+        self._schedule(entry, now + self.initial_interval)
+
+    def flush(self, status):
+        """
+        Completes every deployment still being watched with `status`.
         
-        commit_sha = None
+        Checks already running on the executor are waited for: a deployment
+        they find finished keeps its real status, one still pending is
+        completed with `status` instead of being rescheduled.
         
-        for filename, content in files_to_create.items():
-            file_url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}/contents/{filename}"
-            
-            file_data = {
-                "message": f"Add {filename}",
-                "content": base64.b64encode(content.encode()).decode()
-            }
-            
-            response = requests.put(file_url, headers=headers, json=file_data)
-            response.raise_for_status()
+        Returns:
+            The number of deployments completed with `status`
+        """
+        with self.condition:
+            self.flush_status = status
+            self.flushed = 0
+            entries = [entry for _, _, entry in self.pending]
+            self.pending.clear()
+        for entry in entries:
+            self._complete(entry, status)
+        with self.condition:
+            while self.checking:
+                self.condition.wait()
+            self.flush_status = None
+            return len(entries) + self.flushed
+
+    def _schedule(self, entry, when):
+        with self.condition:
+            flush_status = self.flush_status
+            if flush_status is None:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="pages-watcher", daemon=True)
+                    self.thread.start()
+                heapq.heappush(self.pending, (when, next(self.counter), entry))
+                self.condition.notify()
+                return
+            self.flushed += 1
+        self._complete(entry, flush_status)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending or self.pending[0][0] > time.time():
+                    wait = self.pending[0][0] - time.time() if self.pending else None
+                    self.condition.wait(wait)
+                _, _, entry = heapq.heappop(self.pending)
+                self.checking.add(id(entry))
+            self.executor.submit(self._check, entry)
+
+    def _check(self, entry):
+        try:
+            status = check_pages_deployment(
+                entry['repo_name'], entry['commit_sha'], entry['pages_url'], entry['started_at']
+            )
             
-            # Get commit SHA from the last file
-            commit_sha = response.json()['commit']['sha']
+            if status == "pending":
+                now = time.time()
+                if now >= entry['deadline']:
+                    status = "timeout"
+                else:
+                    # Adaptive backoff: check often at first, then back off
+                    entry['interval'] = min(entry['interval'] * 1.5, self.max_interval)
+                    self._schedule(entry, min(now + entry['interval'], entry['deadline']))
+                    return
             
-            print(f"✅ Added {filename}")
-        
-        return repo_url, commit_sha
+            self._complete(entry, status)
+        finally:
+            with self.condition:
+                self.checking.discard(id(entry))
+                self.condition.notify_all()
+
+    def _complete(self, entry, status):
+        entry['context'].run(record_deploy_wait, entry['repo_name'], entry['started_at'], status)
         
-    except Exception as e:
-        print(f"❌ GitHub Error: {str(e)}")
-        return None, None
+        try:
+            entry['context'].run(entry['callback'], status)
+        except Exception as e:
+            print(f"❌ Deployment callback failed for {entry['repo_name']}: {str(e)}")
+        finally:
+            with self.condition:
+                self.active -= 1
 
 
-def update_github_repo(repo_name, generated_code, brief):
-    """Updates existing repo for Round 2"""
+deployment_watcher = DeploymentWatcher(PAGES_DEPLOY_TIMEOUT, PAGES_POLL_INITIAL, PAGES_POLL_MAX)
+
+
+def notify_evaluation_url(evaluation_url, email, task, round_num, nonce, repo_url, commit_sha, pages_url, job_id=None):
+    """
+    Notifies the instructors' evaluation URL with repo details.
+    
+    The notification is written to the durable outbox and delivered by the
+    background dispatcher (with retries), so this returns immediately.
+    
+    Returns:
+        The outbox entry id
+    """
+    notification_data = {
+        "email": email,
+        "task": task,
+        "round": round_num,
+        "nonce": nonce,
+        "repo_url": repo_url,
+        "commit_sha": commit_sha,
+        "pages_url": pages_url
+    }
+    return notification_outbox.enqueue(evaluation_url, notification_data, job_id=job_id)
+
+@traced("notify")
+def send_notification(evaluation_url, notification_data):
+    """Makes one delivery attempt. Returns True if the evaluator accepted it."""
+    # The outbox schedules retries, so the client must not retry too
+    response = http_request(
+        "POST",
+        evaluation_url,
+        max_retries=0,
+        json=notification_data,
+        headers={"Content-Type": "application/json"},
+        timeout=10
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"Evaluation URL returned {response.status_code}")
+    return True
+
+
+# ===== ASYNC BUILD PIPELINE (BUILD_EXECUTOR=async) =====
+# Coroutine versions of the build stages. The GitHub stages run the same step
+# generators as the threaded pipeline (see run_steps/arun_steps); network
+# calls go through ahttp_request and SQLite/file work through a thread.
+
+@traced("llm_html")
+async def agenerate_html_with_llm(brief, attachments, checks):
     try:
-        headers = {
-            "Authorization": f"token {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json"
-        }
+        payload = build_html_payload(brief, attachments, checks)
+        print("🤖 Calling LLM API...")
         
-        # Get existing README
-        get_readme_url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}/contents/README.md"
-        readme_response = requests.get(get_readme_url, headers=headers)
+        if LLM_STREAMING:
+            extractor = HtmlExtractor()
+            chunks = llm_router.astream(payload, LLM_HTML_TIMEOUT)
+            try:
+                async for chunk in chunks:
+                    extractor.feed(chunk)
+                    if extractor.done or extractor.rejected:
+                        break
+            finally:
+                await chunks.aclose()
+            html_code = streamed_html(extractor)
+        else:
+            llm_response = await llm_router.acomplete(payload, LLM_HTML_TIMEOUT)
+            print(f"✅ Generated code ({len(llm_response)} chars)")
+            html_code = extract_html(llm_response) or llm_response.strip()
         
-        if readme_response.status_code == 200:
-            old_readme = base64.b64decode(
-                readme_response.json()['content']
-            ).decode()
-            
-            # Append only the brief, not the full generated README
-            generated_code['readme'] = old_readme + f"""
----
-## Round 2 Enhancement
-**Updated:** {datetime.now().strftime('%Y-%m-%d')}
-### New Feature
-{brief}
-### Implementation
-- Updated with new functionality
-- All Round 1 features remain intact
-"""
+        return validate_html(html_code)
         
-        # Update files
-        files_to_update = {
-            "index.html": generated_code['html'],
-            "README.md": generated_code['readme']
-        }
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return None
+
+
+@traced("llm_readme")
+async def agenerate_readme_with_llm(task, brief, checks):
+    readme_text = await llm_router.acomplete(build_readme_payload(task, brief, checks), LLM_README_TIMEOUT)
+    print("✅ README generated")
+    return readme_text.strip()
+
+
+async def agenerate_code_with_llm(brief, attachments, checks, task):
+    """Coroutine version of generate_code_with_llm (HTML and README generated concurrently)"""
+    try:
+        readme_task = asyncio.ensure_future(agenerate_readme_with_llm(task, brief, checks))
+        html_code = await agenerate_html_with_llm(brief, attachments, checks)
+        if not html_code:
+            readme_task.cancel()
+            return None
         
-        commit_sha = None
+        try:
+            readme_text = await readme_task
+        except Exception as e:
+            print(f"⚠️ README generation failed, using template: {str(e)}")
+            readme_text = default_readme(task, brief, checks)
         
-        for i, (filename, content) in enumerate(files_to_update.items()):
-            get_url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}/contents/{filename}"
-            response = requests.get(get_url, headers=headers)
-            
-            if response.status_code == 200:
-                current_sha = response.json()['sha']
-                
-                file_data = {
-                    "message": f"Round 2: Update {filename}",
-                    "content": base64.b64encode(content.encode()).decode(),
-                    "sha": current_sha
-                }
-                
-                response = requests.put(get_url, headers=headers, json=file_data)
-                response.raise_for_status()
-                commit_sha = response.json()['commit']['sha']
-                
-                print(f"✅ Updated {filename}")
-                # if filename == "index.html":
-                #     import time
-                #     print("⏳ Waiting 20 seconds for first deployment to start...")
-                #     time.sleep(5)
-        
-        # ONLY commit index.html (README will be updated later)
-        # html_url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}/contents/index.html"
-        # html_response = requests.get(html_url, headers=headers)
-        
-        # if html_response.status_code == 200:
-        #     html_sha = html_response.json()['sha']
-            
-        #     html_data = {
-        #         "message": "Round 2: Update functionality",
-        #         "content": base64.b64encode(generated_code['html'].encode()).decode(),
-        #         "sha": html_sha
-        #     }
-            
-        #     response = requests.put(html_url, headers=headers, json=html_data)
-        #     response.raise_for_status()
-        #     commit_sha = response.json()['commit']['sha']
-            
-        #     print(f"✅ Updated index.html (README will be updated after deployment)")
-                
+        return {
+            "html": html_code,
+            "readme": readme_text
+        }
         
-        repo_url = f"https://github.com/{GITHUB_USERNAME}/{repo_name}"
-        return repo_url, commit_sha
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return None
+
+
+@traced("llm_revision")
+async def agenerate_revision_with_llm(current_html, brief, checks, attachments):
+    payload = build_revision_payload(current_html, brief, checks, attachments)
+    try:
+        patch_text = await llm_router.acomplete(payload, LLM_HTML_TIMEOUT)
+        return apply_revision_patch(current_html, patch_text)
         
     except Exception as e:
-        print(f"❌ Update Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None, None
+        print(f"❌ Revision Error: {str(e)}")
+        return None
+
+
+@traced("validate")
+async def acheck_generated_page(html_code, brief, checks, attachments):
+    return await arun_steps(check_page_steps(html_code, brief, checks, attachments))
+
+
+@traced("push")
+async def apush_files(repo_name, files, message, base_on_parent=True):
+    return await arun_steps(push_steps(repo_name, files, message, base_on_parent))
+
+
+@traced("repo")
+async def acreate_github_repo(task_name, generated_code, brief, round_num, extra_files=None, repo_url=None):
+    return await arun_steps(create_repo_steps(task_name, generated_code, brief, round_num, extra_files, repo_url))
+
+
+@traced("repo_update")
+async def aupdate_github_repo(repo_name, generated_code, brief, extra_files=None):
+    return await arun_steps(update_repo_steps(repo_name, generated_code, brief, extra_files))
 
 
+@traced("pages_enable")
+async def aenable_github_pages(repo_name):
+    return await arun_steps(pages_steps(repo_name))
 
-def update_readme_after_deployment(repo_name, readme_content):
-    """Update README after main deployment completes"""
+
+async def acheck_pages_deployment(repo_name, commit_sha, pages_url, since):
+    """Coroutine version of check_pages_deployment"""
     try:
-        headers = {
-            "Authorization": f"token {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json"
-        }
-        
-        readme_url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}/contents/README.md"
-        readme_response = requests.get(readme_url, headers=headers)
-        
-        if readme_response.status_code == 200:
-            readme_sha = readme_response.json()['sha']
-            
-            readme_data = {
-                "message": "Round 2: Update documentation",
-                "content": base64.b64encode(readme_content.encode()).decode(),
-                "sha": readme_sha
-            }
-            
-            response = requests.put(readme_url, headers=headers, json=readme_data)
-            response.raise_for_status()
-            
-            print(f"✅ Updated README.md")
-            return True
-        
-        return False
+        response = await agithub_request("GET", f"/repos/{GITHUB_USERNAME}/{repo_name}/pages/builds/latest", timeout=10)
+        if response.status_code == 200:
+            return pages_build_status(response.json(), commit_sha)
         
+        response = await ahttp_request("HEAD", pages_url, max_retries=0, timeout=10, follow_redirects=True)
+        if site_updated_since(response, since):
+            return "ready"
     except Exception as e:
-        print(f"⚠️ README update failed (non-critical): {str(e)}")
-        return False
+        print(f"⚠️ Deployment check failed for {repo_name}: {str(e)}")
+    
+    return "pending"
 
 
-def enable_github_pages(repo_name):
+async def await_pages_deployment(repo_name, commit_sha, pages_url):
     """
-    Enables GitHub Pages for the repository.
+    Polls for the Pages deployment with the same adaptive backoff as
+    DeploymentWatcher, sleeping on the event loop between checks.
     
     Returns:
-        The GitHub Pages URL
+        "ready", "errored", "timeout" or (on shutdown) "interrupted"
     """
+    started_at = time.time()
+    deadline = started_at + PAGES_DEPLOY_TIMEOUT
+    interval = PAGES_POLL_INITIAL
+    status = "pending"
+    
+    metrics.gauge_add("build_stage_in_flight", {"stage": "deploy_wait"}, 1)
+    async_runtime.deploy_waits += 1
     try:
-        headers = {
-            "Authorization": f"token {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json"
-        }
-        
-        pages_url = f"https://api.github.com/repos/{GITHUB_USERNAME}/{repo_name}/pages"
-        
-        pages_data = {
-            "source": {
-                "branch": "main",
-                "path": "/"
-            }
-        }
-        
-        response = requests.post(pages_url, headers=headers, json=pages_data)
-        
-        # 201 = created, 409 = already exists (both are OK)
-        if response.status_code in [201, 409]:
-            pages_site_url = f"https://{GITHUB_USERNAME}.github.io/{repo_name}/"
-            print(f"✅ GitHub Pages enabled: {pages_site_url}")
-            return pages_site_url
-        else:
-            print(f"⚠️ Pages status: {response.status_code}")
-            # Return the expected URL anyway
-            return f"https://{GITHUB_USERNAME}.github.io/{repo_name}/"
+        while status == "pending":
+            try:
+                await asyncio.wait_for(async_runtime.interrupted.wait(), max(min(interval, deadline - time.time()), 0))
+                status = "interrupted"
+                break
+            except asyncio.TimeoutError:
+                pass
             
-    except Exception as e:
-        print(f"❌ Pages Error: {str(e)}")
-        # Return expected URL even if API call failed
-        return f"https://{GITHUB_USERNAME}.github.io/{repo_name}/"
+            status = await acheck_pages_deployment(repo_name, commit_sha, pages_url, started_at)
+            if status == "pending" and time.time() >= deadline:
+                status = "timeout"
+            interval = min(interval * 1.5, PAGES_POLL_MAX)
+    finally:
+        async_runtime.deploy_waits -= 1
+        record_deploy_wait(repo_name, started_at, status)
+    return status
+
+
+async def anotify_evaluation_url(*args, job_id=None):
+    """Coroutine version of notify_evaluation_url. The outbox write runs off the event loop."""
+    return await asyncio.to_thread(notify_evaluation_url, *args, job_id=job_id)
+
 
+@traced("repo_provision")
+async def aprovision_github_repo(job_id, task_name, brief):
+    return await arun_steps(provision_steps(job_id, task_name, brief))
 
-def notify_evaluation_url(evaluation_url, email, task, round_num, nonce, repo_url, commit_sha, pages_url):
+
+async def arun_build_pipeline(job_id, data):
     """
-    Notifies the instructors' evaluation URL with repo details.
-    Implements retry logic with exponential backoff.
+    Coroutine version of run_build_pipeline. The Pages deploy wait happens
+    inline, so the build is complete (notification queued) when it returns.
+    
+    Returns:
+        Dictionary with repo_url, pages_url and commit_sha
+    Raises:
+        RuntimeError if a required stage fails
     """
-    notification_data = {
-        "email": email,
-        "task": task,
-        "round": round_num,
-        "nonce": nonce,
-        "repo_url": repo_url,
-        "commit_sha": commit_sha,
-        "pages_url": pages_url
-    }
+    result = await arun_steps(build_steps(job_id, data))
+    task = data.get('task')
+    round_num = data.get('round', 1)
+    repo_url, pages_url, commit_sha = result['repo_url'], result['pages_url'], result['commit_sha']
+    
+    # STEP 4: Wait for the deployment without holding a thread
+    await asyncio.to_thread(build_queue.set_stage, job_id, "deploy", "running")
+    await asyncio.to_thread(build_queue.set_status, job_id, "deploying")
+    deploy_status = await await_pages_deployment(task.replace(' ', '-').lower(), commit_sha, pages_url)
+    await asyncio.to_thread(
+        build_queue.set_stage, job_id, "deploy", "done" if deploy_status == "ready" else deploy_status
+    )
+    if deploy_status != "ready":
+        print(f"⚠️ Pages deployment {deploy_status}, notifying evaluator anyway")
     
-    max_retries = 5
-    delay = 1  # Start with 1 second
+    # STEP 5: Notify evaluation URL (delivered by the outbox dispatcher)
+    outbox_id = await anotify_evaluation_url(
+        data.get('evaluation_url'), data.get('email'), task, round_num, data.get('nonce'),
+        repo_url, commit_sha, pages_url, job_id=job_id
+    )
+    await asyncio.to_thread(build_queue.set_stage, job_id, "notify", "queued", outbox_id=outbox_id)
+    
+    print(f"✅ Successfully completed task: {task}")
+    return result
+
+
+# ===== EVALUATION NOTIFICATION OUTBOX =====
+
+class NotificationOutbox:
+    """
+    Durable outbox for evaluator notifications (SQLite under DATA_DIR).
     
-    for attempt in range(max_retries):
+    Entries move pending -> delivering -> delivered, or to "dead" after
+    OUTBOX_MAX_ATTEMPTS. Dispatcher threads claim due entries, deliver them
+    with at most OUTBOX_HOST_CONCURRENCY requests per evaluator host, and
+    reschedule failures with jittered exponential backoff. Entries left in
+    "delivering" by a crashed process are picked up again on start.
+    """
+
+    def __init__(self, filename, workers):
+        self.filename = filename
+        self.workers = workers
+        self.conn = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.host_slots = {}
+        self.threads = []
+
+    def _db(self):
+        if self.conn is None:
+            self.conn = open_sqlite(self.filename)
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS outbox ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT, url TEXT NOT NULL, "
+                    "payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                    "next_attempt_at REAL NOT NULL, last_error TEXT, "
+                    "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+                )
+                self.conn.execute(
+                    "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)"
+                )
+        return self.conn
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            db = self._db()
+            with db:
+                # Claims older than a delivery timeout belong to a dead process
+                db.execute(
+                    "UPDATE outbox SET status = 'pending' WHERE status = 'delivering' AND updated_at < ?",
+                    (time.time() - 60,)
+                )
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def enqueue(self, url, payload, job_id=None):
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            with db:
+                entry_id = db.execute(
+                    "INSERT INTO outbox (job_id, url, payload, status, next_attempt_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'pending', ?, ?, ?)",
+                    (job_id, url, json.dumps(payload), now, now, now)
+                ).lastrowid
+        metrics.inc("outbox_entries_total", {"event": "enqueued"})
+        self.start()
+        self.wakeup.set()
+        return entry_id
+
+    def list(self, status=None, limit=50, offset=0):
+        query = "SELECT * FROM outbox"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self.lock:
+            rows = self._db().execute(query, params).fetchall()
+        return [dict(row, payload=json.loads(row['payload'])) for row in rows]
+
+    def replay(self, entry_id):
+        """Puts a dead (or any) entry back into the pending state for immediate delivery"""
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            with db:
+                updated = db.execute(
+                    "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ? "
+                    "WHERE id = ? AND status != 'delivering'",
+                    (now, now, entry_id)
+                ).rowcount
+        if updated:
+            self.start()
+            self.wakeup.set()
+        return bool(updated)
+
+    def _claim(self):
+        """Atomically claims the next due entry whose host has a free slot"""
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 20",
+                (now,)
+            ).fetchall()
+            for row in rows:
+                slot = self.host_slots.setdefault(
+                    urlparse(row['url']).netloc, threading.Semaphore(OUTBOX_HOST_CONCURRENCY)
+                )
+                if not slot.acquire(blocking=False):
+                    continue
+                with db:
+                    claimed = db.execute(
+                        "UPDATE outbox SET status = 'delivering', updated_at = ? WHERE id = ? AND status = 'pending'",
+                        (now, row['id'])
+                    ).rowcount
+                if claimed:
+                    return dict(row), slot
+                slot.release()
+        return None, None
+
+    def _run(self):
+        while True:
+            entry, slot = self._claim()
+            if not entry:
+                self.wakeup.wait(OUTBOX_POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            try:
+                self._deliver(entry)
+            finally:
+                slot.release()
+
+    def _deliver(self, entry):
+        attempts = entry['attempts'] + 1
+        error = None
         try:
-            response = requests.post(
-                evaluation_url,
-                json=notification_data,
-                headers={"Content-Type": "application/json"},
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                print(f"✅ Notified evaluation URL successfully")
-                return True
-            else:
-                print(f"⚠️ Evaluation URL returned {response.status_code}, retrying...")
-                
+            send_notification(entry['url'], json.loads(entry['payload']))
+            status = "delivered"
+            print(f"✅ Notified evaluation URL successfully (outbox #{entry['id']})")
         except Exception as e:
-            print(f"⚠️ Notification attempt {attempt + 1} failed: {str(e)}")
+            error = str(e)
+            status = "dead" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending"
+            print(f"⚠️ Notification #{entry['id']} attempt {attempts} failed: {error}")
+        
+        now = time.time()
+        delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX) * random.uniform(0.5, 1.5)
+        with self.lock:
+            db = self._db()
+            with db:
+                db.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (status, attempts, now + delay, error, now, entry['id'])
+                )
         
-        if attempt < max_retries - 1:
-            import time
-            time.sleep(delay)
-            delay *= 2  # Exponential backoff: 1, 2, 4, 8 seconds
+        metrics.inc("outbox_entries_total", {"event": status})
+        if status == "dead":
+            print(f"❌ Notification #{entry['id']} moved to dead-letter after {attempts} attempts")
+        if entry['job_id'] and status != "pending":
+            build_queue.set_stage(entry['job_id'], "notify", "done" if status == "delivered" else "failed",
+                                  outbox_id=entry['id'], attempts=attempts)
+
+
+notification_outbox = NotificationOutbox('outbox.db', OUTBOX_WORKERS)
+
+
+def is_admin_request():
+    """Admin endpoints accept the shared secret in the X-Secret header"""
+    return bool(MY_SECRET) and request.headers.get('X-Secret') == MY_SECRET
+
+
+def pagination_args():
+    """
+    Reads ?limit= (default 50, capped at 500) and ?offset= (default 0).
     
-    print("❌ Failed to notify evaluation URL after all retries")
-    return False
+    Returns:
+        (limit, offset)
+    Raises:
+        ValueError: if limit is not a positive integer or offset is negative or not an integer
+    """
+    try:
+        limit = int(request.args.get('limit', 50))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        raise ValueError("limit and offset must be integers")
+    if limit < 1 or offset < 0:
+        raise ValueError("limit must be positive and offset must not be negative")
+    return min(limit, 500), offset
+
+
+@app.route('/admin/outbox', methods=['GET'])
+def list_outbox():
+    """Lists outbox entries, optionally filtered by ?status=pending|delivering|delivered|dead"""
+    if not is_admin_request():
+        return jsonify({"error": "Invalid secret"}), 401
+    try:
+        limit, offset = pagination_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    entries = notification_outbox.list(request.args.get('status'), limit, offset)
+    return jsonify({"entries": entries, "limit": limit, "offset": offset}), 200
+
+
+@app.route('/admin/outbox/<int:entry_id>/replay', methods=['POST'])
+def replay_outbox(entry_id):
+    """Re-queues an outbox entry (e.g. from the dead-letter state) for delivery"""
+    if not is_admin_request():
+        return jsonify({"error": "Invalid secret"}), 401
+    if not notification_outbox.replay(entry_id):
+        return jsonify({"error": "Entry not found or currently being delivered"}), 404
+    return jsonify({"message": "Replay scheduled", "id": entry_id}), 202
+
+
+@app.route('/builds', methods=['GET'])
+def list_builds():
+    """
+    Build history from the ledger, newest first. Filters: ?task=, ?round=,
+    ?status=, ?nonce=; paginate with ?limit= (max 500) and ?offset=.
+    """
+    if not is_admin_request():
+        return jsonify({"error": "Invalid secret"}), 401
+    try:
+        limit, offset = pagination_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    round_num = request.args.get('round')
+    if round_num and not round_num.isdecimal():
+        return jsonify({"error": "round must be an integer"}), 400
+    builds = build_ledger.list(
+        task=request.args.get('task'),
+        round_num=int(round_num) if round_num else None,
+        status=request.args.get('status'),
+        nonce=request.args.get('nonce'),
+        limit=limit,
+        offset=offset
+    )
+    return jsonify({
+        "builds": builds,
+        "limit": limit,
+        "offset": offset,
+        "next_offset": offset + limit if len(builds) == limit else None
+    }), 200
+
+
+@app.route('/builds/<job_id>', methods=['GET'])
+def get_build(job_id):
+    """One build from the ledger, with per-stage timings"""
+    if not is_admin_request():
+        return jsonify({"error": "Invalid secret"}), 401
+    build = build_ledger.get(job_id)
+    if not build:
+        return jsonify({"error": "Build not found"}), 404
+    return jsonify(build), 200
 
 
+@app.before_request
+def start_background_workers():
+    # Pick up notifications left pending by a previous process
+    notification_outbox.start()
+    repo_pool.start()
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    metrics.gauge_set("build_queue_depth", None, build_queue.pending.qsize())
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "alive"}), 200
+    return jsonify({
+        "status": "alive",
+        "http": http_stats.snapshot(),
+        "llm": llm_router.snapshot(),
+        "admission": admission.snapshot(),
+        "repo_pool": repo_pool.snapshot(),
+        "artifact_store": artifact_store.snapshot(),
+        "generation_cache": generation_cache.snapshot()
+    }), 200
 
 def get_mit_license():
     """Returns MIT License text"""
@@ -719,12 +5361,41 @@ SOFTWARE.
 """
 
 
+def drain_builds(timeout):
+    """
+    Graceful shutdown: stops accepting builds, then waits up to `timeout`
+    seconds for queued and running builds, including their Pages deploy
+    waits. Deployments still waiting after that are completed as
+    "interrupted", so their notifications land in the durable outbox.
+    """
+    build_queue.draining = True
+    deadline = time.time() + timeout
+    print(f"🛑 Draining builds (up to {timeout:.0f}s)...")
+    
+    while time.time() < deadline:
+        if not build_queue.pending.unfinished_tasks and not deployment_watcher.active:
+            break
+        time.sleep(0.5)
+    
+    interrupted = deployment_watcher.flush("interrupted")
+    interrupted += async_runtime.interrupt()
+    if build_queue.runtime:
+        # Interrupted coroutines still queue their notifications before finishing
+        settle_deadline = time.time() + 5
+        while build_queue.pending.unfinished_tasks and time.time() < settle_deadline:
+            time.sleep(0.1)
+    remaining = build_queue.pending.unfinished_tasks
+    print(f"🛑 Drain complete ({interrupted} deploy waits interrupted, {remaining} builds unfinished)")
+
+
 if __name__ == '__main__':
-    # Check if required environment variables are set
-    if not OPENROUTER_API_KEY:
-        print("⚠️ WARNING: OPENROUTER_API_KEY not set!")
-    if not GITHUB_TOKEN:
-        print("⚠️ WARNING: GITHUB_TOKEN not set!")
+    # Local development server. In production use: gunicorn -c gunicorn.conf.py app:app
+    log_startup_config()
+    
+    def handle_sigterm(signum, frame):
+        drain_builds(BUILD_DRAIN_TIMEOUT)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, handle_sigterm)
     
     print("🚀 Starting Flask app...")
-    app.run(host='0.0.0.0', port=7860, debug=True)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', '7860')), debug=os.environ.get('FLASK_DEBUG') == '1')
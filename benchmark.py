@@ -0,0 +1,640 @@
+"""
+Offline load test for /build-app against local mock servers.
+
+    python benchmark.py --builds 200 --concurrency 50 --executor threads async
+    python benchmark.py --builds 50 --rounds 2 --github-error-rate 0.05 --gemini-rate-limit-rate 0.1
+    python benchmark.py --builds 100 --batch 100 --executor async
+
+Starts stand-ins for the Gemini API (generateContent and SSE
+streamGenerateContent), OpenRouter chat completions, the GitHub REST endpoints app.py uses (repos, Git
+Data, contents, repo renames, Pages, Pages builds), the Pages sites and the evaluation URL.
+Each upstream has its own latency, error rate (503) and rate-limit rate
+(429 + Retry-After, or GitHub's 403 with an exhausted X-RateLimit quota).
+
+For each executor, app.py runs in a subprocess pointed at the mocks through
+GITHUB_API_URL, GEMINI_API_URL and PAGES_SITE_URL. `--concurrency` clients
+then submit builds and poll /jobs until each is finished. The report gives
+throughput and p50/p95/p99 latency per pipeline stage. Nothing leaves the
+machine.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+MOCK_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8"><title>Benchmark</title></head>
+<body><h1 id="title">Benchmark app</h1><script>console.log("ready");</script></body>
+</html>"""
+
+MOCK_REVISION = """<<<<<<< SEARCH
+<h1 id="title">Benchmark app</h1>
+=======
+<h1 id="title">Benchmark app (revised)</h1>
+>>>>>>> REPLACE"""
+
+MOCK_README = "# Benchmark app\n\nGenerated README."
+
+UPSTREAMS = ("gemini", "openrouter", "github", "evaluator")
+STAGES = ("submit", "provision", "generate", "repo", "pages", "deploy", "notify", "total")
+
+
+class UpstreamProfile:
+    """Simulated behaviour of one mock upstream"""
+
+    def __init__(self, latency, error_rate, rate_limit_rate):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+
+
+class MockState:
+    """Repos, blobs and counters shared by the mock servers"""
+
+    def __init__(self, profiles, deploy_delay):
+        self.profiles = profiles
+        self.deploy_delay = deploy_delay
+        self.repos = {}  # name -> {"head", "commits": {sha: tree}, "pushed_at"}
+        self.blobs = {}  # sha -> base64 content
+        self.trees = {}  # sha -> {path: blob sha}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters = {}
+
+    def sha(self):
+        return hashlib.sha1(uuid.uuid4().bytes).hexdigest()
+
+    def store_blob(self, raw):
+        sha = hashlib.sha1(b"blob %d\0" % len(raw) + raw).hexdigest()
+        with self.lock:
+            self.blobs[sha] = base64.b64encode(raw).decode()
+        return sha
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_HEAD(self):
+        self.route("HEAD")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_PATCH(self):
+        self.route("PATCH")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    def route(self, method):
+        path = urlparse(self.path).path
+        body = self.read_json() if method in ("POST", "PATCH") else None
+        if path.startswith("/site/"):
+            return self.pages_site(path)
+
+        upstream = path.split("/")[1] if path.startswith(("/gemini/", "/openrouter/")) else \
+            "evaluator" if path == "/notify" else "github"
+        profile = self.state.profiles[upstream]
+        self.state.count(f"{upstream}_requests")
+        if self.inject_fault(upstream, profile):
+            return
+        if upstream == "gemini":
+            return self.gemini(path, body, profile)
+        if upstream == "openrouter":
+            return self.openrouter(body, profile)
+        time.sleep(profile.latency)
+        if upstream == "evaluator":
+            return self.send_json({"ok": True})
+        return self.github(method, path, body)
+
+    def inject_fault(self, upstream, profile):
+        """Answers with an injected rate limit or error. Returns True if it did."""
+        roll = random.random()
+        if roll < profile.rate_limit_rate:
+            self.state.count(f"{upstream}_rate_limited")
+            if upstream == "github":
+                # Exhausted primary quota, resetting in a second
+                self.send_json({"message": "API rate limit exceeded"}, 403, {
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset": str(int(time.time()) + 1)
+                })
+            else:
+                self.send_json({"error": "rate limited"}, 429, {"Retry-After": "1"})
+            return True
+        if roll < profile.rate_limit_rate + profile.error_rate:
+            self.state.count(f"{upstream}_errors")
+            self.send_json({"error": "injected failure"}, 503)
+            return True
+        return False
+
+    def mock_text(self, prompt):
+        if prompt.startswith("You are revising"):
+            return MOCK_REVISION
+        if "README" in prompt[:80]:
+            return MOCK_README
+        return MOCK_HTML
+
+    def send_events(self, events, latency):
+        """Server-sent events, spread over the simulated latency"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for event in events:
+            time.sleep(latency / len(events))
+            self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode())
+            self.wfile.flush()
+        self.close_connection = True
+
+    def gemini(self, path, body, profile):
+        text = self.mock_text(body["contents"][0]["parts"][0]["text"])
+        if not path.endswith(":streamGenerateContent"):
+            time.sleep(profile.latency)
+            return self.send_json({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+        self.send_events([
+            {"candidates": [{"content": {"parts": [{"text": text[i:i + 64]}]}}]}
+            for i in range(0, len(text), 64)
+        ], profile.latency)
+
+    def openrouter(self, body, profile):
+        text = self.mock_text(body["messages"][0]["content"])
+        if not body.get("stream"):
+            time.sleep(profile.latency)
+            return self.send_json({"choices": [{"message": {"role": "assistant", "content": text}}]})
+        self.send_events([
+            {"choices": [{"delta": {"content": text[i:i + 64]}}]}
+            for i in range(0, len(text), 64)
+        ], profile.latency)
+
+    def github(self, method, path, body):
+        state = self.state
+        if path == "/user/repos" and method == "POST":
+            readme_sha = state.store_blob(b"# init\n")
+            tree, commit = state.sha(), state.sha()
+            with state.lock:
+                if body["name"] in state.repos:
+                    return self.send_json({"message": "name already exists"}, 422)
+                state.trees[tree] = {"README.md": readme_sha}
+                state.repos[body["name"]] = {"head": commit, "commits": {commit: tree}, "pushed_at": 0}
+            return self.send_json({"html_url": f"https://github.com/bench/{body['name']}"}, 201)
+
+        parts = path.split("/")  # /repos/{owner}/{repo}/...
+        if len(parts) < 4 or parts[1] != "repos" or parts[3] not in state.repos:
+            return self.send_json({"message": "Not Found"}, 404)
+        repo = state.repos[parts[3]]
+        rest = "/".join(parts[4:])
+
+        if rest == "" and method == "GET":
+            return self.send_json({"html_url": f"https://github.com/bench/{parts[3]}"})
+        if rest == "" and method == "DELETE":
+            with state.lock:
+                state.repos.pop(parts[3], None)
+            return self.send_empty(204)
+        if rest == "" and method == "PATCH":
+            with state.lock:
+                if body["name"] in state.repos:
+                    return self.send_json({"message": "name already exists"}, 422)
+                state.repos[body["name"]] = state.repos.pop(parts[3])
+            return self.send_json({"html_url": f"https://github.com/bench/{body['name']}"})
+        if rest == "git/blobs":
+            return self.send_json({"sha": state.store_blob(base64.b64decode(body["content"]))}, 201)
+        if rest == "git/trees":
+            files = dict(state.trees.get(body.get("base_tree"), {}))
+            files.update({entry["path"]: entry["sha"] for entry in body["tree"]})
+            tree = state.sha()
+            with state.lock:
+                state.trees[tree] = files
+            return self.send_json({"sha": tree}, 201)
+        if rest == "git/commits":
+            commit = state.sha()
+            with state.lock:
+                repo["commits"][commit] = body["tree"]
+            return self.send_json({"sha": commit}, 201)
+        if rest.startswith("git/commits/"):
+            return self.send_json({"tree": {"sha": repo["commits"][parts[-1]]}})
+        if rest == "git/ref/heads/main":
+            return self.send_json({"object": {"sha": repo["head"]}})
+        if rest == "git/refs/heads/main" and method == "PATCH":
+            with state.lock:
+                repo["head"] = body["sha"]
+                repo["pushed_at"] = time.time()
+            return self.send_json({"object": {"sha": body["sha"]}})
+        if rest.startswith("contents/"):
+            blob_sha = state.trees[repo["commits"][repo["head"]]].get(rest[len("contents/"):])
+            if not blob_sha:
+                return self.send_json({"message": "Not Found"}, 404)
+            if self.headers.get("If-None-Match") == f'"{blob_sha}"':
+                return self.send_empty(304)
+            return self.send_json({"sha": blob_sha, "content": state.blobs[blob_sha]}, 200, {"ETag": f'"{blob_sha}"'})
+        if rest == "pages" and method == "POST":
+            return self.send_json({}, 201)
+        if rest == "pages/builds/latest":
+            built = time.time() - repo["pushed_at"] >= state.deploy_delay
+            return self.send_json({"commit": repo["head"], "status": "built" if built else "building"})
+        return self.send_json({"message": "Not Found"}, 404)
+
+    def pages_site(self, path):
+        """HEAD/GET on a Pages site (/site/{owner}/{repo}/), live deploy_delay after the last push"""
+        parts = path.split("/")
+        repo = self.state.repos.get(parts[3]) if len(parts) > 3 else None
+        if not repo or time.time() - repo["pushed_at"] < self.state.deploy_delay:
+            return self.send_empty(404)
+        return self.send_empty(200, {"Last-Modified": formatdate(repo["pushed_at"] + self.state.deploy_delay, usegmt=True)})
+
+
+def start_mocks(state):
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def thread_count(pid):
+    """Current OS thread count of a process (Linux only, else None)"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def wait_for_app(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(f"{base_url}/", timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+
+def wait_for_repo_pool(base_url, size, timeout=120):
+    """Waits until the app's pool of pre-created repos is full"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if requests.get(f"{base_url}/health", timeout=5).json()["repo_pool"].get("ready", 0) >= size:
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else None
+
+
+def stage_latencies(jobs, submit_seconds):
+    """Seconds per stage across finished jobs (only stages that both started and finished)"""
+    latencies = {stage: [] for stage in STAGES}
+    latencies["submit"] = list(submit_seconds)
+    for job in jobs:
+        for stage, info in job.get("stages", {}).items():
+            if "started_at" in info and "finished_at" in info and stage in latencies:
+                latencies[stage].append(info["finished_at"] - info["started_at"])
+        latencies["total"].append(job["updated_at"] - job["created_at"])
+    return latencies
+
+
+class LoadDriver:
+    """
+    Closed-loop load: `concurrency` clients each submit a build, poll its
+    job until it is finished, then take the next one. With --batch, all
+    builds of a round are instead submitted through /build-batch.
+    """
+
+    def __init__(self, base_url, mock_url, args, label):
+        self.base_url = base_url
+        self.mock_url = mock_url
+        self.args = args
+        self.label = label
+        self.remaining = args.builds
+        self.jobs = []
+        self.submit_seconds = []
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def run(self):
+        if self.args.batch:
+            return self._run_batches()
+        clients = [threading.Thread(target=self._client, daemon=True) for _ in range(self.args.concurrency)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+    def _take(self):
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def _client(self):
+        session = requests.Session()
+        while self._take():
+            task = f"bench-{self.label}-{uuid.uuid4().hex[:10]}"
+            for round_num in range(1, self.args.rounds + 1):
+                job = self._build(session, task, round_num)
+                if not job or job["status"] != "succeeded":
+                    break
+
+    def _payload(self, task, round_num):
+        return {
+            "secret": "bench-secret",
+            "email": "bench@example.com",
+            "task": task,
+            "round": round_num,
+            "nonce": uuid.uuid4().hex,
+            "brief": "Benchmark app" if round_num == 1 else "Revise the title",
+            "checks": ["Page has #title"],
+            "evaluation_url": f"{self.mock_url}/notify",
+            "attachments": []
+        }
+
+    def _run_batches(self):
+        session = requests.Session()
+        tasks = [f"bench-{self.label}-{uuid.uuid4().hex[:10]}" for _ in range(self.args.builds)]
+        for round_num in range(1, self.args.rounds + 1):
+            batch_urls = []
+            for start in range(0, len(tasks), self.args.batch):
+                builds = [self._payload(task, round_num) for task in tasks[start:start + self.args.batch]]
+                started = time.time()
+                response = session.post(f"{self.base_url}/build-batch", json={"secret": "bench-secret", "builds": builds})
+                self.submit_seconds.append(time.time() - started)
+                if response.status_code == 202:
+                    batch_urls.append(f"{self.base_url}{response.json()['status_url']}")
+
+            # Round 2 only revises the apps whose Round 1 succeeded
+            tasks = []
+            deadline = time.time() + self.args.timeout
+            for batch_url in batch_urls:
+                while time.time() < deadline:
+                    batch = session.get(batch_url).json()
+                    if batch["finished"]:
+                        break
+                    time.sleep(self.args.poll_interval)
+                for entry in batch["builds"]:
+                    if not entry["job_id"]:
+                        self.rejected += 1
+                        continue
+                    job = session.get(f"{self.base_url}/jobs/{entry['job_id']}").json()
+                    self.jobs.append(job)
+                    if job["status"] == "succeeded":
+                        tasks.append(job["task"])
+
+    def _build(self, session, task, round_num):
+        payload = self._payload(task, round_num)
+        deadline = time.time() + self.args.timeout
+        while True:
+            started = time.time()
+            response = session.post(f"{self.base_url}/build-app", json=payload)
+            if response.status_code not in (429, 503) or time.time() > deadline:
+                break
+            # Queue full or not admitted: back off and resubmit
+            with self.lock:
+                self.rejected += 1
+            time.sleep(min(float(response.headers.get('Retry-After', 0.5)), 5))
+        with self.lock:
+            self.submit_seconds.append(time.time() - started)
+        if response.status_code != 202:
+            return None
+
+        job_url = f"{self.base_url}/jobs/{response.json()['job_id']}"
+        while time.time() < deadline:
+            time.sleep(self.args.poll_interval)
+            job = session.get(job_url).json()
+            if job["status"] in ("succeeded", "failed", "rejected"):
+                with self.lock:
+                    self.jobs.append(job)
+                return job
+        return None
+
+
+def run_executor(executor, args, mock_url, state):
+    """Runs one load test against a fresh app process. Returns a result dict."""
+    base_url = f"http://127.0.0.1:{args.port}"
+    data_dir = tempfile.mkdtemp(prefix=f"bench-{executor}-")
+    env = dict(
+        os.environ,
+        PORT=str(args.port),
+        MY_SECRET="bench-secret",
+        GITHUB_TOKEN="bench-token",
+        GITHUB_USERNAME="bench",
+        GEMINI_API_KEY="bench-key",
+        GITHUB_API_URL=mock_url,
+        GEMINI_API_URL=f"{mock_url}/gemini",
+        OPENROUTER_API_KEY="bench-key",
+        OPENROUTER_URL=f"{mock_url}/openrouter/chat/completions",
+        LLM_PROVIDERS=args.providers,
+        GITHUB_WEB_URL=f"{mock_url}/web",
+        PAGES_SITE_URL=f"{mock_url}/site/{{owner}}/{{repo}}/",
+        DATA_DIR=data_dir,
+        BUILD_EXECUTOR=executor,
+        BUILD_QUEUE_SIZE=str(args.queue_size),
+        ADMISSION_MAX_BUILDS=str(args.admission_max_builds or args.queue_size),
+        ASYNC_MAX_BUILDS=str(args.concurrency),
+        LLM_STREAMING="true" if args.streaming else "false",
+        GENERATION_CACHE_ENABLED="false",
+        HTTP_RATE_PER_HOST=str(args.client_rate),
+        HTTP_BURST_PER_HOST=str(int(args.client_rate)),
+        HTTP_MAX_RETRY_WAIT="5",
+        PAGES_POLL_INITIAL="0.5",
+        PAGES_POLL_MAX="1",
+        OUTBOX_POLL_INTERVAL="0.2",
+        OUTBOX_BACKOFF_BASE="0.5",
+        OUTBOX_WORKERS="8",
+        OUTBOX_HOST_CONCURRENCY="8",
+        BATCH_MAX_BUILDS=str(max(args.batch, 1)),
+        LLM_MAX_IN_FLIGHT=str(args.llm_in_flight),
+        GITHUB_WRITES_IN_FLIGHT=str(args.github_writes),
+        REPO_POOL_SIZE=str(args.repo_pool),
+        REPO_POOL_REFILL_INTERVAL="0.05",
+    )
+    env.pop("BUILD_WORKERS", None)
+    env.pop("LLM_THREADS", None)
+    if args.workers:
+        env.update(BUILD_WORKERS=str(args.workers), LLM_THREADS=str(args.workers * 2))
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    log = open(os.path.join(data_dir, "app.log"), "w")
+    process = subprocess.Popen([sys.executable, app_path], env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not wait_for_app(base_url):
+            raise RuntimeError(f"app did not start, see {log.name}")
+        if args.repo_pool and not wait_for_repo_pool(base_url, args.repo_pool):
+            raise RuntimeError(f"repo pool did not fill, see {log.name}")
+
+        state.reset_counters()
+        driver = LoadDriver(base_url, mock_url, args, executor)
+        peak_threads = 0
+        started = time.time()
+        runner = threading.Thread(target=driver.run, daemon=True)
+        runner.start()
+        while runner.is_alive():
+            peak_threads = max(peak_threads, thread_count(process.pid) or 0)
+            runner.join(0.25)
+        elapsed = time.time() - started
+
+        # Notifications land shortly after their jobs finish; refetch for the notify stage
+        session = requests.Session()
+        settle_deadline = time.time() + 10
+        jobs = driver.jobs
+        while time.time() < settle_deadline:
+            jobs = [session.get(f"{base_url}/jobs/{job['id']}").json() for job in driver.jobs]
+            if all(job["stages"].get("notify", {}).get("status") != "queued" for job in jobs):
+                break
+            time.sleep(0.5)
+
+        return {
+            "executor": executor,
+            "builds": len(jobs),
+            "succeeded": sum(job["status"] == "succeeded" for job in jobs),
+            "failed": sum(job["status"] != "succeeded" for job in jobs),
+            "rejected_retries": driver.rejected,
+            "seconds": round(elapsed, 2),
+            "builds_per_second": round(len(jobs) / elapsed, 2),
+            "peak_threads": peak_threads or None,
+            "upstream": dict(state.counters),
+            "stages": {
+                stage: {
+                    "count": len(values),
+                    **{name: round(percentile(values, fraction), 3) if values else None
+                       for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+                }
+                for stage, values in stage_latencies(jobs, driver.submit_seconds).items()
+            },
+            "log": log.name,
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        log.close()
+
+
+def print_report(result):
+    print(f"\n== {result['executor']}: {result['succeeded']}/{result['builds']} builds succeeded in "
+          f"{result['seconds']}s ({result['builds_per_second']} builds/s, peak {result['peak_threads']} threads)")
+    print(f"{'stage':<10}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for stage, row in result["stages"].items():
+        cells = "".join(f"{row[name] if row[name] is not None else '-':>9}" for name in ("p50", "p95", "p99"))
+        print(f"{stage:<10}{row['count']:>7}{cells}")
+    if result["upstream"]:
+        print("upstream: " + ", ".join(f"{name}={count}" for name, count in sorted(result["upstream"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--builds", type=int, default=100, help="builds (tasks) to run")
+    parser.add_argument("--concurrency", type=int, default=50, help="clients submitting builds in parallel")
+    parser.add_argument("--rounds", type=int, choices=[1, 2], default=1, help="2 = follow each build with a revision")
+    parser.add_argument("--providers", default="gemini,openrouter", help="LLM_PROVIDERS of the app")
+    parser.add_argument("--executor", nargs="+", default=["threads", "async"], choices=["threads", "async"])
+    parser.add_argument("--workers", type=int, default=0,
+                        help="BUILD_WORKERS for the threads executor (default: the app's, one per --llm-in-flight)")
+    parser.add_argument("--queue-size", type=int, default=1000, help="BUILD_QUEUE_SIZE")
+    parser.add_argument("--admission-max-builds", type=int, default=0,
+                        help="ADMISSION_MAX_BUILDS (default: the queue size)")
+    parser.add_argument("--client-rate", type=float, default=1000, help="HTTP_RATE_PER_HOST of the app")
+    parser.add_argument("--batch", type=int, default=0, help="submit through /build-batch, this many builds per request")
+    parser.add_argument("--llm-in-flight", type=int, default=32, help="LLM_MAX_IN_FLIGHT of the app")
+    parser.add_argument("--github-writes", type=int, default=8, help="GITHUB_WRITES_IN_FLIGHT of the app")
+    parser.add_argument("--repo-pool", type=int, default=0, help="REPO_POOL_SIZE; the pool is filled before the run")
+    parser.add_argument("--deploy-delay", type=float, default=2.0, help="seconds until a push is live")
+    parser.add_argument("--no-streaming", dest="streaming", action="store_false")
+    parser.add_argument("--poll-interval", type=float, default=0.25, help="seconds between /jobs polls")
+    parser.add_argument("--timeout", type=float, default=600, help="per-build timeout in seconds")
+    parser.add_argument("--port", type=int, default=7861)
+    parser.add_argument("--seed", type=int, help="random seed for fault injection")
+    parser.add_argument("--json", help="also write the results to this file")
+    defaults = {"gemini": 2.0, "openrouter": 2.0, "github": 0.05, "evaluator": 0.05}
+    for upstream in UPSTREAMS:
+        parser.add_argument(f"--{upstream}-latency", type=float, default=defaults[upstream])
+        parser.add_argument(f"--{upstream}-error-rate", type=float, default=0.0, help="fraction answered 503")
+        parser.add_argument(f"--{upstream}-rate-limit-rate", type=float, default=0.0,
+                            help="fraction answered 429 (GitHub: 403 with an exhausted quota)")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    profiles = {
+        upstream: UpstreamProfile(
+            getattr(args, f"{upstream}_latency"),
+            getattr(args, f"{upstream}_error_rate"),
+            getattr(args, f"{upstream}_rate_limit_rate")
+        )
+        for upstream in UPSTREAMS
+    }
+    state = MockState(profiles, args.deploy_delay)
+    mocks = start_mocks(state)
+    mock_url = f"http://127.0.0.1:{mocks.server_address[1]}"
+    print(f"Mock upstreams on {mock_url}")
+
+    results = []
+    for executor in args.executor:
+        print(f"Running {args.builds} builds x {args.rounds} round(s), concurrency {args.concurrency}, "
+              f"BUILD_EXECUTOR={executor}...")
+        result = run_executor(executor, args, mock_url, state)
+        print_report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+    mocks.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Gunicorn settings for serving app.py in production:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+/build-app only verifies and queues builds; the pipeline itself runs on the
+app's background threads. Request threads therefore mostly wait on I/O, and
+shutdown has to give those background builds time to finish.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '7860')}"
+worker_class = "gthread"
+
+# Threads per worker ~ cores * (1 + wait time / compute time)
+cpu_count = multiprocessing.cpu_count()
+expected_io_ratio = float(os.environ.get('EXPECTED_IO_RATIO', '4'))
+threads = int(os.environ.get('GUNICORN_THREADS', max(4, int(cpu_count * (1 + expected_io_ratio)))))
+
+# Job status, idempotency keys and the build pool live in the worker process
+# unless JOB_BACKEND=sqlite, so only then can several workers share them.
+if os.environ.get('JOB_BACKEND', 'memory') == 'sqlite':
+    workers = int(os.environ.get('WEB_CONCURRENCY', min(cpu_count, 4)))
+else:
+    workers = 1
+
+# Requests return quickly (202); the slowest is /test-gemini at ~30 s
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+keepalive = 5
+
+# Give background builds BUILD_DRAIN_TIMEOUT to finish before the master kills a worker
+build_drain_timeout = float(os.environ.get('BUILD_DRAIN_TIMEOUT', '120'))
+graceful_timeout = int(build_drain_timeout + 10)
+
+# Import the app once in the master. Its thread pools and SQLite connections
+# are created lazily, so nothing is shared across the fork.
+preload_app = True
+
+
+def when_ready(server):
+    from app import log_startup_config
+    log_startup_config()
+
+
+def worker_exit(server, worker):
+    from app import drain_builds
+    drain_builds(build_drain_timeout)
@@ -0,0 +1,183 @@
+"""
+LLM prompt templates and the token budget they are fitted into.
+
+Templates are parsed once at import time. fit_prompt shrinks the variable
+sections (brief, checks, attachment summaries) of a prompt that would go
+over PROMPT_TOKEN_BUDGET; app.render_prompt records the resulting sizes.
+"""
+import os
+import string
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '6000'))  # estimated input tokens, excluding the page being revised
+PROMPT_CHARS_PER_TOKEN = int(os.environ.get('PROMPT_CHARS_PER_TOKEN', '4'))
+
+
+def estimate_tokens(text):
+    """Rough token count (~PROMPT_CHARS_PER_TOKEN chars per token); close enough for budgeting"""
+    return -(-len(text) // PROMPT_CHARS_PER_TOKEN)
+
+
+class PromptTemplate:
+    """
+    A prompt with {field} placeholders, parsed once at import time so that
+    rendering is a single join instead of re-evaluating an f-string.
+    """
+
+    def __init__(self, text):
+        parsed = list(string.Formatter().parse(text))
+        self.literals = [literal for literal, _, _, _ in parsed]
+        self.fields = [field for _, field, _, _ in parsed]
+        self.static_tokens = estimate_tokens("".join(self.literals))
+
+    def render(self, **values):
+        pieces = []
+        for literal, field in zip(self.literals, self.fields):
+            pieces.append(literal)
+            if field is not None:
+                pieces.append(values[field])
+        return "".join(pieces)
+
+
+# ===== TEMPLATES =====
+
+HTML_PROMPT = PromptTemplate("""Create a complete, working single-page HTML application.
+TASK: {brief}
+{attachments_header}{attachments}
+{csv_instructions}
+EVALUATION CHECKS (MUST PASS):
+{checks}
+TECHNICAL SPECS:
+- ONE HTML file with inline CSS/JS
+- Bootstrap 5: https://cdnjs.cloudflare.com/ajax/libs/bootstrap/5.3.2/css/bootstrap.min.css
+- Load attachments by relative path, e.g. fetch('./data.csv').then(r => r.text())
+- Match ALL element IDs/classes in checks exactly
+- Professional UI, no placeholders
+- All functionality must work on first load
+CRITICAL: Return ONLY the HTML. Start with <!DOCTYPE html>, end with </html>. No markdown blocks.""")
+
+CSV_INSTRUCTIONS = """
+CSV HANDLING (CRITICAL):
+- Include: <script src="https://cdnjs.cloudflare.com/ajax/libs/PapaParse/5.4.1/papaparse.min.js"></script>
+- Parse: Papa.parse(csvText, {header: true, dynamicTyping: true, skipEmptyLines: true, delimitersToGuess: [',', '\t', '|']})
+- NEVER assume column names - use actual headers from parsed data
+- Strip whitespace from headers: Object.keys(parsed.data[0]).map(k => k.trim())
+- Calculate sums properly: rows.reduce((sum, row) => sum + (parseFloat(row[colName]) || 0), 0)
+- Console.log the parsed data to verify
+- Handle missing/null values with || 0
+"""
+
+README_PROMPT = PromptTemplate("""Generate a professional README.md for a GitHub project with these details:
+**Project Name:** {task}
+**Purpose:** {brief}
+**Requirements to highlight:**
+{checks}
+Create a README with these sections:
+1. **Title** - Short, descriptive project name
+2. **Overview** - 2-3 sentences explaining what it does
+3. **Features** - Bullet list of key capabilities based on the requirements
+5. **How to Use** - Step-by-step user instructions
+6. **Technology Stack** - List all libraries/frameworks used
+7. **Project Structure** - Show the file tree
+8. **Local Development** - Clone and run using git clone 
+9. **License** - Mention MIT License
+CRITICAL RULES:
+- Use actual URLs, not placeholders like [GitHub Pages URL]
+- Be specific about what the app does based on the brief
+- Keep it professional - no "auto-generated" footers
+- Use markdown formatting properly
+- Length: 150-250 words
+Return the markdown content directly without wrapping it in triple backticks or code fences.""")
+
+REVISION_PROMPT = PromptTemplate("""You are revising an existing single-page HTML application. Keep every existing feature working.
+CURRENT index.html:
+{current_html}
+REQUESTED CHANGE: {brief}
+{attachments_header}{attachments}
+EVALUATION CHECKS (MUST PASS):
+{checks}
+Return ONLY edit blocks in exactly this format, as many as needed:
+<<<<<<< SEARCH
+exact lines copied from the current file
+=======
+replacement lines
+>>>>>>> REPLACE
+RULES:
+- SEARCH text must match the current file exactly and appear only once (include enough context)
+- Keep blocks small; do not repeat unchanged parts of the file
+- Match ALL element IDs/classes in checks exactly
+- No explanations, no markdown fences""")
+
+
+# ===== BUDGET =====
+
+def truncate_text(text, max_tokens):
+    """Cuts text to about max_tokens at a word boundary, marking the cut"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    marker = " [...truncated]"
+    limit = max(max_tokens * PROMPT_CHARS_PER_TOKEN - len(marker), 0)
+    cut = text[:limit]
+    if " " in cut[limit // 2:]:
+        cut = cut[:cut.rindex(" ")]
+    return cut.rstrip() + marker
+
+
+def truncate_items(items, max_tokens, noun="items"):
+    """Keeps whole lines from the start of a list while they fit, then notes how many were dropped"""
+    kept, used = [], 0
+    for item in items:
+        cost = estimate_tokens(item) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(item)
+        used += cost
+    if len(kept) < len(items):
+        kept.append(f"- ... {len(items) - len(kept)} more {noun} omitted")
+    return "\n".join(kept)
+
+
+def truncate_attachments(items, max_tokens):
+    """Shortens each attachment summary to its share of the budget before dropping attachments"""
+    share = max(max_tokens // max(len(items), 1) - 20, 0)
+    shortened = []
+    for item in items:
+        line, _, summary = item.partition("\n")
+        shortened.append(f"{line}\n{truncate_text(summary, share)}" if summary and share else line)
+    return truncate_items(shortened, max_tokens, "attachments")
+
+
+def bullet_lines(checks):
+    return [f"- {check}" for check in checks]
+
+
+def fit_prompt(template, fixed, sections, budget=None):
+    """
+    Renders a prompt within PROMPT_TOKEN_BUDGET (or `budget`) estimated tokens.
+    
+    `fixed` values are inserted verbatim. `sections` is an ordered list of
+    (field, value, shrink, floor) where value is a string or a list of lines;
+    while the prompt is over budget, each section in turn is replaced with
+    shrink(value, tokens), never going below `floor` tokens. Earlier sections
+    are given up first.
+    
+    Returns:
+        Tuple of (prompt text, estimated tokens, fields that were shrunk)
+    """
+    budget = budget or PROMPT_TOKEN_BUDGET
+    values = dict(fixed)
+    for field, value, _, _ in sections:
+        values[field] = value if isinstance(value, str) else "\n".join(value)
+    tokens = template.static_tokens + sum(estimate_tokens(value) for value in values.values())
+    
+    shrunk = []
+    for field, value, shrink, floor in sections:
+        overflow = tokens - budget
+        if overflow <= 0:
+            break
+        section_tokens = estimate_tokens(values[field])
+        if section_tokens <= floor:
+            continue
+        values[field] = shrink(value, max(section_tokens - overflow, floor))
+        tokens += estimate_tokens(values[field]) - section_tokens
+        shrunk.append(field)
+    return template.render(**values), tokens, shrunk
@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# app.py reads its configuration and opens its SQLite files under DATA_DIR at import time
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="app-tests-"))
+# Tests poll local fake servers faster than the default per-host client rate
+os.environ.setdefault("HTTP_RATE_PER_HOST", "1000")
+os.environ.setdefault("HTTP_BURST_PER_HOST", "1000")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def github(monkeypatch):
+    """
+    benchmark.py's mock GitHub (no latency, no faults) with app.py pointed
+    at it. `github.requests` lists every call as (method, path).
+    """
+    import app
+    import benchmark
+
+    state = benchmark.MockState(
+        {upstream: benchmark.UpstreamProfile(0, 0, 0) for upstream in benchmark.UPSTREAMS}, deploy_delay=0
+    )
+    state.requests = []
+
+    class RecordingHandler(benchmark.MockHandler):
+        def route(self, method):
+            with state.lock:
+                state.requests.append((method, self.path))
+            super().route(method)
+
+    RecordingHandler.state = state
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordingHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(app, "GITHUB_API_URL", base_url)
+    monkeypatch.setattr(app, "GITHUB_USERNAME", "bench")
+    monkeypatch.setattr(app, "PAGES_SITE_URL", base_url + "/site/{owner}/{repo}/")
+    yield state
+    server.shutdown()
+    server.server_close()
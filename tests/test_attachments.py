@@ -0,0 +1,95 @@
+"""decode_data_uri / process_attachments"""
+import base64
+import hashlib
+
+import pytest
+
+import app
+
+PNG = (b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\rIHDR" + (3).to_bytes(4, "big") + (2).to_bytes(4, "big")
+       + b"\x08\x02\x00\x00\x00")
+
+
+def data_uri(data, mime="text/plain"):
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+
+def test_decode_base64():
+    mime, data, size = app.decode_data_uri(data_uri(b"a,b\n1,2\n", "text/csv"), 1000)
+    assert mime == "text/csv"
+    assert bytes(data) == b"a,b\n1,2\n"
+    assert size == 8
+
+
+def test_decode_missing_padding():
+    for text in (b"A", b"AB", b"ABC", b"ABCD"):
+        uri = data_uri(text).rstrip("=")
+        assert bytes(app.decode_data_uri(uri, 1000)[1]) == text
+
+
+def test_decode_percent_encoded():
+    mime, data, size = app.decode_data_uri("data:,caf%C3%A9%2C%20ok", 1000)
+    assert mime == "text/plain"
+    assert bytes(data) == "café, ok".encode()
+
+
+def test_non_ascii_header_does_not_shift_the_payload():
+    # Dropping the non-ASCII parameter would move the payload start past the comma
+    uri = "data:text/plain;name=café;base64," + base64.b64encode(b"hello").decode()
+    assert bytes(app.decode_data_uri(uri, 1000)[1]) == b"hello"
+
+
+def test_decode_too_large():
+    mime, data, size = app.decode_data_uri(data_uri(b"x" * 300), 100)
+    assert data is None
+    assert size >= 300
+
+
+def test_not_a_data_uri():
+    assert app.decode_data_uri("https://example.com/data.csv", 1000) is None
+
+
+@pytest.mark.parametrize("payload", ["!!!!", "A", "ABCDE", "QUJDé"])
+def test_garbage_base64_is_an_error(payload):
+    with pytest.raises(app.binascii.Error):
+        app.decode_data_uri(f"data:text/plain;base64,{payload}", 1000)
+
+
+def test_process_attachments():
+    attachments = app.process_attachments([
+        {"name": "sales.csv", "url": data_uri(b"region,total\nnorth,10\n", "text/csv")},
+        {"name": "logo.png", "url": data_uri(PNG, "application/octet-stream")},
+        {"name": "remote.json", "url": "https://example.com/remote.json"},
+        {"name": "broken.csv", "url": "data:text/csv;base64,!!!!"},
+    ])
+    sales, logo, remote, broken = attachments
+
+    assert sales['summary'].startswith("CSV columns: region, total")
+    assert sales['sha256'] == hashlib.sha256(b"region,total\nnorth,10\n").hexdigest()
+    assert logo['mime'] == "image/png"
+    assert logo['summary'] == "image 3x2"
+    assert remote['url'] == "https://example.com/remote.json"
+    assert remote['data'] is None
+
+    assert broken['summary'] == "undecodable"
+    assert broken['data'] is None
+    assert app.attachment_files(attachments).keys() == {"sales.csv", "logo.png"}
+
+
+def test_content_hash_ignores_encoding_details():
+    padded = app.process_attachments([{"name": "a.txt", "url": data_uri(b"hello")}])[0]
+    unpadded = app.process_attachments([{"name": "a.txt", "url": data_uri(b"hello").rstrip("=")}])[0]
+    assert padded['sha256'] == unpadded['sha256']
+
+
+def test_colliding_filenames_are_made_unique():
+    attachments = app.process_attachments([
+        {"name": "data.csv", "url": data_uri(b"a\n1\n")},
+        {"name": "dir/data.csv", "url": data_uri(b"a\n2\n")},
+        {"name": "data?.csv", "url": data_uri(b"a\n3\n")},
+        {"name": "data_.csv", "url": data_uri(b"a\n4\n")},
+        {"name": "index.html", "url": data_uri(b"<p>")},
+    ])
+    filenames = [att['filename'] for att in attachments]
+    assert filenames == ["data.csv", "data-2.csv", "data_.csv", "data_-2.csv", "data-index.html"]
+    assert bytes(app.attachment_files(attachments)["data-2.csv"]) == b"a\n2\n"
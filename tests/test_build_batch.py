@@ -0,0 +1,90 @@
+"""/build-batch admission and /batches/<batch_id> status"""
+import uuid
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Test client over a BuildQueue without workers and admission with the default capacity and reserve"""
+    queue = app.BuildQueue(app.InMemoryJobStore(), workers=0, max_queued=1000)
+    admission = app.AdmissionControl(app.ADMISSION_MAX_BUILDS, app.ADMISSION_ROUND2_RESERVE, 0, 15)
+    monkeypatch.setattr(app, "build_queue", queue)
+    monkeypatch.setattr(app, "admission", admission)
+    monkeypatch.setattr(app, "MY_SECRET", "s3cret")
+    client = app.app.test_client()
+    client.queue = queue
+    return client
+
+
+def build(**overrides):
+    data = {"email": "student@example.com", "task": f"batch-{uuid.uuid4().hex[:8]}", "round": 1,
+            "nonce": uuid.uuid4().hex, "brief": "brief", "checks": []}
+    data.update(overrides)
+    return data
+
+
+def submit(client, builds):
+    response = client.post("/build-batch", json={"secret": "s3cret", "builds": builds})
+    assert response.status_code == 202
+    return response.get_json()
+
+
+def status(client, batch):
+    response = client.get(batch["status_url"])
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_rejects_bad_requests(client):
+    assert client.post("/build-batch", json={"secret": "wrong", "builds": [build()]}).status_code == 401
+    assert client.post("/build-batch", json={"secret": "s3cret", "builds": []}).status_code == 400
+    assert client.post("/build-batch", json={"secret": "s3cret", "builds": "nope"}).status_code == 400
+    too_many = [build() for _ in range(app.BATCH_MAX_BUILDS + 1)]
+    assert client.post("/build-batch", json={"secret": "s3cret", "builds": too_many}).status_code == 400
+    assert client.get("/batches/batch-missing").status_code == 404
+
+
+def test_status_follows_the_builds(client):
+    first, second = build(), build()
+    batch = submit(client, [first, second, "not a build", dict(first)])
+    entries = batch["builds"]
+    assert [entry["status"] for entry in entries] == ["queued", "queued", "invalid", "queued"]
+    assert entries[3]["duplicate"] and entries[3]["job_id"] == entries[0]["job_id"]
+    assert client.queue.pending.qsize() == 2
+
+    report = status(client, batch)
+    assert report["total"] == 4
+    assert report["counts"] == {"queued": 3, "invalid": 1}
+    assert not report["finished"]
+
+    result = {"repo_url": "https://github.com/bench/a", "pages_url": "https://bench.github.io/a/", "commit_sha": "c1"}
+    client.queue.set_stage(entries[0]["job_id"], "push", "running")
+    client.queue.finish(entries[0]["job_id"], "succeeded", result=result)
+    report = status(client, batch)
+    assert report["builds"][0]["result"] == result
+    assert report["builds"][0]["stage"] == "push"
+    assert report["counts"] == {"succeeded": 2, "queued": 1, "invalid": 1}
+    assert not report["finished"]
+
+    client.queue.finish(entries[1]["job_id"], "failed", error="boom")
+    report = status(client, batch)
+    assert report["builds"][1]["error"] == "boom"
+    assert report["counts"] == {"succeeded": 2, "failed": 1, "invalid": 1}
+    assert report["finished"]
+
+
+def test_round2_reserve_turns_away_part_of_a_full_round1_batch(client):
+    """With the defaults (100 slots, 10 reserved), a 100-build Round 1 batch gets 10 entries back"""
+    size = app.BATCH_MAX_BUILDS
+    admitted = app.ADMISSION_MAX_BUILDS - app.admission.reserve
+    batch = submit(client, [build() for _ in range(size)])
+    entries = batch["builds"]
+
+    assert sum(entry["status"] == "queued" for entry in entries) == admitted
+    rejected = [entry for entry in entries if entry["status"] == "rejected"]
+    assert [entry["index"] for entry in rejected] == list(range(admitted, size))
+    assert all(entry["job_id"] is None and entry["retry_after"] >= 1 for entry in rejected)
+    assert status(client, batch)["counts"] == {"queued": admitted, "rejected": size - admitted}
@@ -0,0 +1,72 @@
+"""BuildLedger history and the /builds endpoints"""
+import itertools
+
+import pytest
+
+import app
+
+databases = itertools.count()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Test client over a fresh ledger holding five builds of two tasks"""
+    ledger = app.BuildLedger(f"ledger-test-{next(databases)}.db")
+    for n in range(5):
+        job_id = f"job-{n}"
+        ledger.open(job_id, {"task": f"task-{n % 2}", "round": 1 + n // 3, "nonce": f"nonce-{n}"})
+        ledger.close({"id": job_id, "status": "failed" if n == 4 else "succeeded",
+                      "stages": {"llm": {"started_at": 10.0, "finished_at": 12.5}}})
+    monkeypatch.setattr(app, "build_ledger", ledger)
+    monkeypatch.setattr(app, "MY_SECRET", "s3cret")
+    client = app.app.test_client()
+    client.get_json = lambda path: client.get(path, headers={"X-Secret": "s3cret"})
+    return client
+
+
+def job_ids(response):
+    assert response.status_code == 200
+    return [build["job_id"] for build in response.get_json()["builds"]]
+
+
+def test_requires_the_secret(client):
+    assert client.get("/builds").status_code == 401
+    assert client.get("/builds/job-0").status_code == 401
+
+
+def test_newest_first_and_filters(client):
+    assert job_ids(client.get_json("/builds")) == ["job-4", "job-3", "job-2", "job-1", "job-0"]
+    assert job_ids(client.get_json("/builds?task=task-0")) == ["job-4", "job-2", "job-0"]
+    assert job_ids(client.get_json("/builds?round=2")) == ["job-4", "job-3"]
+    assert job_ids(client.get_json("/builds?status=failed")) == ["job-4"]
+    assert job_ids(client.get_json("/builds?nonce=nonce-1")) == ["job-1"]
+
+
+def test_pagination(client):
+    response = client.get_json("/builds?limit=2")
+    assert job_ids(response) == ["job-4", "job-3"]
+    assert response.get_json()["next_offset"] == 2
+
+    response = client.get_json("/builds?limit=2&offset=4")
+    assert job_ids(response) == ["job-0"]
+    assert response.get_json()["next_offset"] is None
+
+    assert client.get_json("/builds?limit=100000").get_json()["limit"] == 500
+
+
+@pytest.mark.parametrize("query", ["limit=abc", "offset=1e3", "limit=-5", "limit=0", "offset=-1", "round=two"])
+def test_bad_query_is_rejected(client, query):
+    response = client.get_json(f"/builds?{query}")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_single_build_with_stage_timings(client):
+    response = client.get_json("/builds/job-4")
+    assert response.status_code == 200
+    build = response.get_json()
+    assert build["status"] == "failed"
+    assert build["stages"]["llm"]["seconds"] == 2.5
+    assert "duration" in build
+
+    assert client.get_json("/builds/missing").status_code == 404
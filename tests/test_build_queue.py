@@ -0,0 +1,168 @@
+"""BuildQueue.submit: deduplication on (email, task, round, nonce) and orphaned jobs"""
+import uuid
+
+import pytest
+
+import app
+
+RESULT = {"repo_url": "https://github.com/bench/demo", "pages_url": "https://bench.github.io/demo/",
+          "commit_sha": "c1"}
+
+
+@pytest.fixture
+def queue():
+    """A BuildQueue without workers: submitted jobs stay queued until finished by the test"""
+    yield app.BuildQueue(app.InMemoryJobStore(), workers=0, max_queued=10)
+    for job_id in list(app.admission.in_flight):
+        app.admission.release(job_id, finished=False)
+
+
+def request(**overrides):
+    data = {"email": "student@example.com", "task": f"demo-{uuid.uuid4().hex[:8]}", "round": 1,
+            "nonce": uuid.uuid4().hex, "brief": "brief", "checks": []}
+    data.update(overrides)
+    return data
+
+
+def test_in_flight_duplicate_attaches_to_the_job(queue):
+    data = request()
+    job, duplicate = queue.submit(data)
+    assert not duplicate
+    in_flight = len(app.admission.in_flight)
+
+    again, duplicate = queue.submit(dict(data))
+    assert duplicate
+    assert again['id'] == job['id']
+    assert again['status'] == "queued"
+    assert queue.pending.qsize() == 1
+    assert len(app.admission.in_flight) == in_flight  # no second build slot
+
+    # A different nonce is a different request
+    other, duplicate = queue.submit(dict(data, nonce=uuid.uuid4().hex))
+    assert not duplicate
+    assert other['id'] != job['id']
+
+
+def test_finished_duplicate_returns_the_stored_result(queue, monkeypatch):
+    data = request()
+    job, _ = queue.submit(data)
+    queue.finish(job['id'], "succeeded", result=RESULT)
+
+    again, duplicate = queue.submit(dict(data))
+    assert duplicate
+    assert again['id'] == job['id']
+    assert again['result'] == RESULT
+
+    # /build-app answers 200 with the stored result instead of queueing a build
+    monkeypatch.setattr(app, "build_queue", queue)
+    monkeypatch.setattr(app, "MY_SECRET", "s3cret")
+    response = app.app.test_client().post("/build-app", json=dict(data, secret="s3cret"))
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['job_id'] == job['id']
+    assert body['message'] == "App already built"
+    assert {key: body[key] for key in RESULT} == RESULT
+    assert queue.pending.qsize() == 1  # only the original build was ever queued
+
+
+def test_failed_job_can_be_retried(queue):
+    data = request()
+    job, _ = queue.submit(data)
+    queue.finish(job['id'], "failed", error="boom")
+
+    retry, duplicate = queue.submit(dict(data))
+    assert not duplicate
+    assert retry['id'] != job['id']
+
+
+@pytest.mark.skipif(app.fcntl is None, reason="owner locks need fcntl")
+def test_orphaned_job_is_failed_and_its_key_taken_over(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DATA_DIR", str(tmp_path))
+    data = request()
+
+    # The first process queues the build, then dies and its owner lock is released
+    first = app.BuildQueue(app.SQLiteJobStore(), workers=0, max_queued=10)
+    job, _ = first.submit(data)
+    first.store.owner_file.close()
+
+    # A second process sharing DATA_DIR gets the retry
+    second = app.BuildQueue(app.SQLiteJobStore(), workers=0, max_queued=10)
+    try:
+        retry, duplicate = second.submit(dict(data))
+        assert not duplicate
+        assert retry['id'] != job['id']
+        assert retry['owner'] == second.store.owner
+
+        orphan = second.get(job['id'])
+        assert orphan['status'] == "failed"
+        assert orphan['error'].startswith("Interrupted")
+
+        # The new job is alive, so a further retry attaches to it
+        again, duplicate = second.submit(dict(data))
+        assert duplicate
+        assert again['id'] == retry['id']
+    finally:
+        for job_id in list(app.admission.in_flight):
+            app.admission.release(job_id, finished=False)
+
+
+@pytest.fixture
+def full(monkeypatch):
+    """Admission with a single build slot, already taken (configured wait)"""
+    admission = app.AdmissionControl(capacity=1, reserve=0, max_wait=app.ADMISSION_MAX_WAIT,
+                                     github_calls_per_build=15)
+    monkeypatch.setattr(app, "admission", admission)
+    admission.admit("someone-else")
+    return admission
+
+
+def test_retry_of_an_in_flight_build_attaches_without_a_slot(queue, monkeypatch):
+    admission = app.AdmissionControl(capacity=1, reserve=0, max_wait=0, github_calls_per_build=15)
+    monkeypatch.setattr(app, "admission", admission)
+    data = request()
+    job, _ = queue.submit(data)  # takes the only slot
+
+    again, duplicate = queue.submit(dict(data))
+    assert duplicate
+    assert again['id'] == job['id']
+    with pytest.raises(app.AdmissionRejected):
+        queue.submit(request())
+
+
+def test_rejected_at_once_by_default(queue, full, monkeypatch):
+    monkeypatch.setattr(app, "build_queue", queue)
+    monkeypatch.setattr(app, "MY_SECRET", "s3cret")
+    started = app.time.monotonic()
+    response = app.app.test_client().post("/build-app", json=dict(request(), secret="s3cret"))
+
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert app.time.monotonic() - started < 1
+    assert queue.pending.qsize() == 0
+
+
+def test_waiting_is_opt_in(queue, full):
+    app.threading.Timer(0.2, full.release, ("someone-else",)).start()
+    job, duplicate = queue.submit(request(), max_wait=5)
+    assert not duplicate
+    assert job['id'] in full.in_flight
+
+
+def test_slot_released_when_the_job_cannot_be_stored(queue, monkeypatch):
+    admission = app.AdmissionControl(capacity=1, reserve=0, max_wait=0, github_calls_per_build=15)
+    monkeypatch.setattr(app, "admission", admission)
+    data = request()
+
+    def broken_open(job_id, data):
+        raise app.sqlite3.OperationalError("disk I/O error")
+    with monkeypatch.context() as patch:
+        patch.setattr(app.build_ledger, "open", broken_open)
+        with pytest.raises(app.sqlite3.OperationalError):
+            queue.submit(data)
+    assert admission.in_flight == {}
+    assert queue.pending.qsize() == 0
+
+    # The half-stored job was failed, so the same request can be retried
+    job, duplicate = queue.submit(dict(data))
+    assert not duplicate
+    assert job['id'] in admission.in_flight
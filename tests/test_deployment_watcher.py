@@ -0,0 +1,207 @@
+"""DeploymentWatcher and the Pages deployment checks against a fake GitHub/Pages server"""
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app
+
+
+class FakePages:
+    """
+    GitHub Pages stand-in: GET /repos/{owner}/{repo}/pages/builds/latest and
+    HEAD /site/{repo}/. A repo without a `builds` entry answers 404 there,
+    which makes check_pages_deployment fall back to the site's Last-Modified.
+    """
+
+    def __init__(self):
+        self.builds = {}  # repo -> callable(check number) -> (commit, status)
+        self.sites = {}  # repo -> Last-Modified timestamp
+        self.checks = {}  # repo -> [time of each builds/latest request]
+        self.gate = None  # threading.Event that builds/latest requests wait for
+        self.lock = threading.Lock()
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                parts = self.path.split("/")  # /repos/{owner}/{repo}/pages/builds/latest
+                repo = parts[3] if len(parts) > 3 else None
+                with fake.lock:
+                    checks = fake.checks.setdefault(repo, [])
+                    checks.append(time.time())
+                    build = fake.builds.get(repo)
+                if fake.gate is not None:
+                    fake.gate.wait(10)
+                if self.path.endswith("/pages/builds/latest") and build:
+                    commit, status = build(len(checks))
+                    body = f'{{"commit": "{commit}", "status": "{status}"}}'.encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+
+            def do_HEAD(self):
+                repo = self.path.strip("/").split("/")[-1]
+                modified = fake.sites.get(repo)
+                self.send_response(200 if modified else 404)
+                if modified:
+                    self.send_header("Last-Modified", formatdate(modified, usegmt=True))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        return Handler
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    fake = FakePages()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), fake.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(app, "GITHUB_API_URL", base_url)
+    monkeypatch.setattr(app, "GITHUB_USERNAME", "owner")
+    fake.site_url = lambda repo: f"{base_url}/site/{repo}/"
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+def watch(watcher, pages, repo, commit="c1"):
+    """Starts watching `repo`; returns a function that waits for the callback's status"""
+    done = threading.Event()
+    statuses = []
+
+    def callback(status):
+        statuses.append(status)
+        done.set()
+
+    watcher.watch(repo, commit, pages.site_url(repo), callback)
+
+    def result(timeout=10):
+        assert done.wait(timeout), "callback not called"
+        return statuses
+
+    return result
+
+
+def test_pages_build_status():
+    assert app.pages_build_status({"commit": "c1", "status": "built"}, "c1") == "ready"
+    assert app.pages_build_status({"commit": "c1", "status": "errored"}, "c1") == "errored"
+    assert app.pages_build_status({"commit": "c1", "status": "building"}, "c1") == "pending"
+    # A finished build of an older commit says nothing about ours
+    assert app.pages_build_status({"commit": "c0", "status": "built"}, "c1") == "pending"
+
+
+def test_last_modified_fallback(pages):
+    since = time.time()
+    url = pages.site_url("demo")
+
+    assert app.check_pages_deployment("demo", "c1", url, since) == "pending"  # site not up yet
+
+    pages.sites["demo"] = since - 60
+    assert app.check_pages_deployment("demo", "c1", url, since) == "pending"  # still the old deploy
+
+    pages.sites["demo"] = since + 1
+    assert app.check_pages_deployment("demo", "c1", url, since) == "ready"
+
+
+def test_watcher_ready_after_backoff(pages):
+    pages.builds["demo"] = lambda check: ("c1", "built" if check >= 4 else "building")
+    watcher = app.DeploymentWatcher(timeout=10, initial_interval=0.05, max_interval=0.2)
+
+    assert watch(watcher, pages, "demo")() == ["ready"]
+    checks = pages.checks["demo"]
+    assert len(checks) == 4
+    gaps = [later - earlier for earlier, later in zip(checks, checks[1:])]
+    assert gaps[-1] > gaps[0]  # intervals grow by 1.5x per pending check
+    assert gaps[-1] <= 0.2 + 0.1  # capped at max_interval
+    assert watcher.active == 0
+
+
+def test_watcher_ignores_builds_of_older_commits(pages):
+    pages.builds["demo"] = lambda check: ("c1" if check >= 3 else "c0", "built")
+    watcher = app.DeploymentWatcher(timeout=10, initial_interval=0.02, max_interval=0.05)
+
+    assert watch(watcher, pages, "demo")() == ["ready"]
+    assert len(pages.checks["demo"]) == 3
+
+
+def test_watcher_errored(pages):
+    pages.builds["demo"] = lambda check: ("c1", "errored")
+    watcher = app.DeploymentWatcher(timeout=10, initial_interval=0.02, max_interval=0.05)
+
+    assert watch(watcher, pages, "demo")() == ["errored"]
+    assert len(pages.checks["demo"]) == 1
+
+
+def test_watcher_timeout(pages):
+    pages.builds["demo"] = lambda check: ("c1", "building")
+    watcher = app.DeploymentWatcher(timeout=0.5, initial_interval=0.05, max_interval=0.1)
+    started = time.time()
+
+    assert watch(watcher, pages, "demo")() == ["timeout"]
+    assert 0.5 <= time.time() - started < 2
+    # Backoff keeps the number of checks well below timeout / initial_interval
+    assert 3 <= len(pages.checks["demo"]) < 10
+
+
+def test_watcher_last_modified_fallback(pages):
+    pages.sites["demo"] = time.time() + 1  # no builds API for this repo, site already updated
+    watcher = app.DeploymentWatcher(timeout=10, initial_interval=0.02, max_interval=0.05)
+
+    assert watch(watcher, pages, "demo")() == ["ready"]
+
+
+def test_watcher_interrupted_on_flush(pages):
+    pages.builds["demo"] = lambda check: ("c1", "building")
+    watcher = app.DeploymentWatcher(timeout=60, initial_interval=30, max_interval=30)
+    result = watch(watcher, pages, "demo")
+
+    assert watcher.flush("interrupted") == 1
+    assert result(timeout=1) == ["interrupted"]
+    assert "demo" not in pages.checks  # completed without another check
+    assert watcher.active == 0
+
+
+def test_flush_waits_for_checks_in_flight(pages):
+    pages.builds["demo"] = lambda check: ("c1", "building")
+    pages.gate = threading.Event()
+    watcher = app.DeploymentWatcher(timeout=60, initial_interval=0.01, max_interval=30)
+    result = watch(watcher, pages, "demo")
+    while "demo" not in pages.checks:  # the first check is now blocked on the server
+        time.sleep(0.01)
+
+    threading.Timer(0.3, pages.gate.set).start()
+    started = time.time()
+    assert watcher.flush("interrupted") == 1
+    assert time.time() - started >= 0.25  # returned only after the check came back
+    assert result(timeout=1) == ["interrupted"]
+    assert len(pages.checks["demo"]) == 1  # the pending check was not rescheduled
+    assert watcher.active == 0
+
+
+def test_flush_keeps_the_real_status_of_a_check_in_flight(pages):
+    pages.builds["demo"] = lambda check: ("c1", "built")
+    pages.gate = threading.Event()
+    watcher = app.DeploymentWatcher(timeout=60, initial_interval=0.01, max_interval=30)
+    result = watch(watcher, pages, "demo")
+    while "demo" not in pages.checks:
+        time.sleep(0.01)
+
+    threading.Timer(0.1, pages.gate.set).start()
+    assert watcher.flush("interrupted") == 0
+    assert result(timeout=1) == ["ready"]
+    assert watcher.active == 0
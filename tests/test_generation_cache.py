@@ -0,0 +1,135 @@
+"""GenerationCache eviction and how build_steps uses it"""
+import time
+import uuid
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DATA_DIR", str(tmp_path))
+    return app.GenerationCache("cache.db", ttl=60, max_entries=3, max_bytes=10 ** 6)
+
+
+def entry(n):
+    return {"html": f"<html>{n}</html>", "readme": f"# {n}"}
+
+
+def test_get_put(cache):
+    assert cache.get("a") is None
+    cache.put("a", entry(1))
+    assert cache.get("a") == entry(1)
+    assert cache.snapshot() == {"hits": 1, "misses": 1, "writes": 1, "evictions": 0}
+
+
+def test_expired_entries_are_misses_and_evicted_on_write(cache):
+    cache.ttl = 0.2
+    cache.put("old", entry(1))
+    time.sleep(0.3)
+    assert cache.get("old") is None
+
+    cache.put("new", entry(2))
+    assert cache.snapshot()['evictions'] == 1
+    assert cache.get("new") == entry(2)
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    for key in ("a", "b", "c"):
+        cache.put(key, entry(key))
+        time.sleep(0.01)
+    assert cache.get("a")  # "b" is now the least recently used
+    time.sleep(0.01)
+
+    cache.put("d", entry("d"))
+    assert cache.get("b") is None
+    assert all(cache.get(key) for key in ("a", "c", "d"))
+
+
+def test_byte_limit(cache):
+    cache.max_bytes = 2 * len(app.zlib.compress(app.json.dumps(entry("x" * 500)).encode()))
+    for key in ("a", "b", "c"):
+        cache.put(key, entry(key * 500))
+        time.sleep(0.01)
+    assert cache.get("a") is None
+    assert cache.get("b") and cache.get("c")
+
+
+def test_key_depends_on_round_and_base():
+    key = app.generation_cache_key("brief", [], ["#a"], "task")
+    assert app.generation_cache_key("brief", [], ["#a"], "task", round_num=2) != key
+    round2 = app.generation_cache_key("brief", [], ["#a"], "task", round_num=2, base_sha="b1")
+    assert app.generation_cache_key("brief", [], ["#a"], "task", round_num=2, base_sha="b2") != round2
+
+
+@pytest.fixture
+def pipeline(github, monkeypatch, tmp_path):
+    """Round 1 builds through build_steps with a fake LLM answering as `model`"""
+    monkeypatch.setattr(app, "SPECULATIVE_REPOS", False)
+    monkeypatch.setattr(app, "PAGE_VALIDATION", True)
+    monkeypatch.setattr(app, "GENERATION_CACHE_ENABLED", True)
+    monkeypatch.setattr(app, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "generation_cache", app.GenerationCache("cache.db", 60, 100, 10 ** 6))
+
+    class Pipeline:
+        def __init__(self):
+            self.model = "gemini:test-model"
+            self.generations = 0
+            self.validations = 0
+
+        def generate(self, brief, attachments, checks, task):
+            self.generations += 1
+            app.llm_answers.get().add(self.model)
+            return {"html": "<!DOCTYPE html><html><body><p id='total'>1</p></body></html>", "readme": "# R"}
+
+        def check(self, html_code, brief, checks, attachments):
+            self.validations += 1
+            return html_code.replace("1</p>", "1 (validated)</p>")
+
+        def run(self, data):
+            job_id = uuid.uuid4().hex
+            app.build_ledger.open(job_id, data)
+            result = app.run_steps(app.build_steps(job_id, data))
+            app.build_ledger.close({"id": job_id, "status": "succeeded", "result": result})
+            return result
+
+    pipeline = Pipeline()
+    monkeypatch.setattr(app, "generate_code_with_llm", pipeline.generate)
+    monkeypatch.setattr(app, "check_generated_page", pipeline.check)
+    monkeypatch.setattr(app.llm_router, "preferred_model", lambda mode: pipeline.model)
+    return pipeline
+
+
+def request():
+    return {"task": f"cache-{uuid.uuid4().hex[:8]}", "round": 1, "brief": "Show total",
+            "checks": ["#total exists"], "attachments": []}
+
+
+def pushed_html(github, result):
+    repo = github.repos[result["repo_url"].rsplit("/", 1)[1]]
+    blob = github.trees[repo["commits"][result["commit_sha"]]]["index.html"]
+    return app.base64.b64decode(github.blobs[blob]).decode()
+
+
+def test_hit_serves_the_validated_page_without_llm_calls(github, pipeline):
+    data = request()
+    pipeline.run(data)
+    result = pipeline.run(dict(data, nonce="another"))
+
+    assert pipeline.generations == 1
+    assert pipeline.validations == 1  # no second check (or fix call) for a cached page
+    assert "1 (validated)" in pushed_html(github, result)
+
+
+def test_answer_is_reused_only_for_the_model_that_gave_it(github, pipeline):
+    data = request()
+    pipeline.model = "openrouter:fallback"  # e.g. Gemini's circuit was open
+    pipeline.run(data)
+
+    pipeline.model = "gemini:test-model"  # Gemini is back
+    pipeline.run(dict(data))
+    assert pipeline.generations == 2
+
+    pipeline.run(dict(data))
+    assert pipeline.generations == 2
@@ -0,0 +1,92 @@
+"""HtmlExtractor / extract_html against recorded-style Gemini SSE streams (tests/fixtures/*.sse)"""
+import os
+
+import app
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def sse_chunks(name):
+    """Text chunks of a Gemini SSE fixture, as llm_router.stream yields them"""
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return [part for line in f.read().splitlines() for part in app.sse_text_parts(line)]
+
+
+def stream(chunks, start_limit=None):
+    """Feeds chunks like generate_html_with_llm does. Returns (extractor, chunks consumed)."""
+    extractor = app.HtmlExtractor(start_limit)
+    consumed = 0
+    for chunk in chunks:
+        extractor.feed(chunk)
+        consumed += 1
+        if extractor.done or extractor.rejected:
+            break
+    return extractor, consumed
+
+
+def test_markers_split_across_chunks():
+    chunks = sse_chunks("gemini_split_markers.sse")
+    extractor, consumed = stream(chunks)
+
+    assert extractor.done
+    assert consumed == len(chunks) - 1  # the trailing prose is never read
+    html_code = extractor.result()
+    assert html_code.startswith("<!DOCTYPE html>")
+    assert html_code.endswith("</html>")
+    assert 'id="count"' in html_code
+
+
+def test_end_marker_inside_script_style_comment_or_attribute_does_not_stop_stream():
+    chunks = sse_chunks("gemini_script_end_marker.sse")
+    extractor, consumed = stream(chunks)
+
+    assert extractor.done
+    assert consumed == len(chunks) - 1
+    html_code = extractor.result()
+    assert html_code.endswith("</script>\n</body>\n</html>")
+    assert "const tail = `</html>`;" in html_code
+
+
+def test_result_does_not_depend_on_chunk_boundaries():
+    text = "".join(sse_chunks("gemini_script_end_marker.sse"))
+    expected = stream([text])[0].result()
+
+    for size in (1, 2, 3, 7, 64):
+        extractor, _ = stream([text[i:i + size] for i in range(0, len(text), size)])
+        assert extractor.done
+        assert extractor.result() == expected
+
+
+def test_prose_is_rejected_before_the_stream_ends():
+    chunks = sse_chunks("gemini_prose.sse")
+    extractor, consumed = stream(chunks, start_limit=200)
+
+    assert extractor.rejected
+    assert consumed < len(chunks)
+    assert extractor.result() is None
+
+
+def test_fenced_output():
+    chunks = sse_chunks("gemini_fenced.sse")
+    extractor, consumed = stream(chunks)
+
+    assert extractor.done
+    assert consumed == 2
+    assert extractor.result() == '<!DOCTYPE html>\n<html>\n<body>\n<h1 id="title">Sales</h1>\n</body>\n</html>'
+
+
+def test_extract_html_cuts_at_last_end_marker():
+    text = "".join(sse_chunks("gemini_script_end_marker.sse"))
+
+    html_code = app.extract_html(text)
+    assert html_code.startswith("<!DOCTYPE html>")
+    assert html_code.endswith("</script>\n</body>\n</html>")
+    assert "The script shows" not in html_code
+
+
+def test_extract_html_fenced_and_prose():
+    text = "".join(sse_chunks("gemini_fenced.sse"))
+    assert app.extract_html(text) == stream(sse_chunks("gemini_fenced.sse"))[0].result()
+
+    assert app.extract_html("".join(sse_chunks("gemini_prose.sse"))).startswith("<!DOCTYPE html>")
+    assert app.extract_html("No page here.") is None
@@ -0,0 +1,148 @@
+"""RateLimiter token bucket and http_request retries against a scripted local server"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None, text=""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text
+
+
+@pytest.fixture
+def upstream():
+    """Local server answering each request with the next (status, headers, body) of `replies`, then 200"""
+
+    class Upstream:
+        replies = []
+        hits = 0
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            Upstream.hits += 1
+            status, headers, body = Upstream.replies.pop(0) if Upstream.replies else (200, {}, "ok")
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    Upstream.url = f"http://127.0.0.1:{server.server_address[1]}/thing"
+    yield Upstream
+    server.shutdown()
+    server.server_close()
+
+
+# --- RateLimiter ---
+
+def test_burst_then_rate():
+    limiter = app.RateLimiter(rate=10, burst=3)
+    assert [limiter.try_acquire() for _ in range(3)] == [0, 0, 0]
+    wait = limiter.try_acquire()
+    assert 0 < wait <= 0.1
+    time.sleep(wait + 0.01)
+    assert limiter.try_acquire() == 0
+
+
+def test_retry_after_blocks_the_bucket():
+    limiter = app.RateLimiter(rate=100, burst=10)
+    limiter.update(FakeResponse(429, {"Retry-After": "5"}))
+    assert 4 < limiter.blocked_for() <= 5
+    assert 4 < limiter.try_acquire() <= 5
+
+
+def test_low_quota_slows_the_bucket():
+    limiter = app.RateLimiter(rate=10, burst=10, low_water=200)
+    reset = int(time.time()) + 100
+    limiter.update(FakeResponse(headers={"X-RateLimit-Remaining": "50", "X-RateLimit-Reset": str(reset)}))
+    assert limiter.remaining == 50
+    assert limiter.rate == pytest.approx(0.5, rel=0.05)  # 50 calls spread over ~100s
+    assert limiter.blocked_for() == 0
+
+    limiter.update(FakeResponse(headers={"X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": str(reset)}))
+    assert limiter.rate == 10
+
+
+def test_exhausted_quota_blocks_until_reset():
+    limiter = app.RateLimiter(rate=10, burst=10)
+    reset = int(time.time()) + 30
+    limiter.update(FakeResponse(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)}))
+    assert 28 < limiter.blocked_for() <= 30
+    assert 28 < limiter.reset_in() <= 30
+
+
+def test_acquire_waits_for_a_token():
+    limiter = app.RateLimiter(rate=20, burst=1)
+    limiter.acquire()
+    started = time.monotonic()
+    limiter.acquire()
+    assert 0.03 <= time.monotonic() - started < 0.5
+
+
+# --- retries ---
+
+def test_is_retryable():
+    assert app.is_retryable(FakeResponse(429))
+    assert app.is_retryable(FakeResponse(503))
+    assert app.is_retryable(FakeResponse(403, {"X-RateLimit-Remaining": "0"}))
+    assert app.is_retryable(FakeResponse(403, text='{"message": "You have exceeded a secondary rate limit"}'))
+    assert not app.is_retryable(FakeResponse(403, text='{"message": "Resource not accessible"}'))
+    assert not app.is_retryable(FakeResponse(404))
+    assert not app.is_retryable(FakeResponse(422))
+
+
+def test_retry_wait(monkeypatch):
+    assert app.retry_wait(FakeResponse(429, {"Retry-After": "7"}), 0) == 7
+    assert 4 <= app.retry_wait(FakeResponse(503), 2) < 5  # 2**attempt plus up to 1s of jitter
+    monkeypatch.setattr(app, "HTTP_MAX_RETRY_WAIT", 3)
+    assert app.retry_wait(FakeResponse(429, {"Retry-After": "120"}), 0) == 3
+
+
+def test_retries_until_success(upstream):
+    upstream.replies = [(503, {"Retry-After": "0"}, ""), (429, {"Retry-After": "0"}, "")]
+    response = app.http_request("GET", upstream.url, max_retries=3)
+    assert response.status_code == 200
+    assert upstream.hits == 3
+
+
+def test_gives_up_after_max_retries(upstream):
+    upstream.replies = [(502, {"Retry-After": "0"}, "")] * 3
+    response = app.http_request("GET", upstream.url, max_retries=2)
+    assert response.status_code == 502  # the last response is returned, not raised
+    assert upstream.hits == 3
+
+
+def test_client_errors_are_not_retried(upstream):
+    upstream.replies = [(404, {}, '{"message": "Not Found"}')]
+    assert app.http_request("GET", upstream.url).status_code == 404
+    assert upstream.hits == 1
+
+
+def test_retry_is_recorded_in_endpoint_stats(upstream):
+    upstream.replies = [(503, {"Retry-After": "0"}, "")]
+    app.http_request("GET", upstream.url)
+    stats = app.http_stats.snapshot()[app.endpoint_key("GET", upstream.url)]
+    assert stats["requests"] == 1
+    assert stats["retries"] == 1
+    assert stats["errors"] == 0
+
+
+def test_async_retries(upstream):
+    pytest.importorskip("httpx")
+    upstream.replies = [(503, {"Retry-After": "0"}, "")]
+    response = app.async_runtime.submit(app.ahttp_request("GET", upstream.url)).result(10)
+    assert response.status_code == 200
+    assert upstream.hits == 2
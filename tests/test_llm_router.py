@@ -0,0 +1,207 @@
+"""CircuitBreaker and LLMRouter failover, hedging and timeouts with fake providers"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import app
+
+
+class FakeProvider:
+    """Streams `chunks`, sleeping `first_delay` before the first and `delay` before each later one"""
+    url = "http://fake.invalid/"
+
+    def __init__(self, name, chunks=("Hello", " world"), first_delay=0.0, delay=0.0, error=None):
+        self.name = name
+        self.model = f"{name}-model"
+        self.chunks = chunks
+        self.first_delay = first_delay
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.closed = threading.Event()
+
+    def configured(self):
+        return True
+
+    def stream(self, payload, timeout, max_retries=None):
+        self.calls += 1
+        try:
+            time.sleep(self.first_delay)
+            if self.error:
+                raise self.error
+            for i, chunk in enumerate(self.chunks):
+                if i:
+                    time.sleep(self.delay)
+                yield chunk
+        finally:
+            self.closed.set()
+
+    def complete(self, payload, timeout, max_retries=None):
+        return "".join(self.stream(payload, timeout, max_retries))
+
+    async def astream(self, payload, timeout, max_retries=None):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.first_delay)
+            if self.error:
+                raise self.error
+            for i, chunk in enumerate(self.chunks):
+                if i:
+                    await asyncio.sleep(self.delay)
+                yield chunk
+        finally:
+            self.closed.set()
+
+    async def acomplete(self, payload, timeout, max_retries=None):
+        return "".join([chunk async for chunk in self.astream(payload, timeout, max_retries)])
+
+
+def collect(router, timeout=5):
+    return "".join(router.stream({}, timeout))
+
+
+async def acollect(router, timeout=5):
+    return "".join([chunk async for chunk in router.astream({}, timeout)])
+
+
+# --- CircuitBreaker ---
+
+def test_breaker_opens_after_threshold():
+    breaker = app.CircuitBreaker(threshold=3, cooldown=60)
+    for _ in range(2):
+        breaker.record(False)
+    assert breaker.state == "closed"
+    breaker.record(True)  # a success resets the count
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert not breaker.available()
+    assert 1 <= breaker.cooldown_left() <= 60
+
+
+def test_breaker_half_open_trial():
+    breaker = app.CircuitBreaker(threshold=1, cooldown=0.1)
+    breaker.record(False)
+    time.sleep(0.15)
+    assert breaker.state == "half_open"
+    assert breaker.allow()  # the single trial request
+    assert not breaker.allow()
+    assert breaker.cooldown_left() >= 1
+
+    breaker.record(None)  # cancelled: the trial slot is free again, still half open
+    assert breaker.allow()
+    breaker.record(False)  # failed trial reopens
+    assert breaker.state == "open"
+
+    time.sleep(0.15)
+    assert breaker.allow()
+    breaker.record(True)  # successful trial closes
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+# --- LLMRouter ---
+
+def test_first_provider_answers():
+    first, second = FakeProvider("first"), FakeProvider("second", chunks=("other",))
+    router = app.LLMRouter([first, second])
+    assert collect(router) == "Hello world"
+    assert second.calls == 0
+    assert router.breakers["first"].failures == 0
+
+
+def test_failover_to_the_next_provider():
+    broken, backup = FakeProvider("broken", error=RuntimeError("503")), FakeProvider("backup")
+    router = app.LLMRouter([broken, backup])
+    assert collect(router) == "Hello world"
+    assert router.breakers["broken"].failures == 1
+    assert router.breakers["backup"].failures == 0
+
+
+def test_open_circuit_is_skipped():
+    broken, backup = FakeProvider("broken", error=RuntimeError("503")), FakeProvider("backup")
+    router = app.LLMRouter([broken, backup])
+    for _ in range(app.LLM_BREAKER_FAILURES):
+        router.breakers["broken"].record(False)
+    assert collect(router) == "Hello world"
+    assert broken.calls == 0
+    assert router.preferred_model("stream") == "backup:backup-model"
+
+
+def test_all_providers_failing():
+    router = app.LLMRouter([FakeProvider("a", error=RuntimeError("boom")), FakeProvider("b", error=RuntimeError("bust"))])
+    with pytest.raises(RuntimeError, match="All LLM providers failed.*bust"):
+        collect(router)
+
+
+def test_fastest_provider_first():
+    slow, fast = FakeProvider("slow"), FakeProvider("fast")
+    router = app.LLMRouter([slow, fast])
+    router.tracker("slow", "stream").observe(2.0)
+    router.tracker("fast", "stream").observe(0.5)
+    assert [provider.name for provider in router.candidates("stream")] == ["fast", "slow"]
+    assert collect(router) == "Hello world"
+    assert slow.calls == 0
+
+
+def test_hedging_is_off_by_default(monkeypatch):
+    assert app.LLM_HEDGING is False
+    monkeypatch.setattr(app, "LLM_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(app, "LLM_HEDGE_MIN_DELAY", 0.05)
+    slow, other = FakeProvider("slow", first_delay=0.3), FakeProvider("other")
+    router = app.LLMRouter([slow, other])
+    assert collect(router) == "Hello world"
+    assert other.calls == 0
+
+
+@pytest.mark.parametrize("mode", ["threads", "async"])
+def test_hedge_wins_and_the_slow_attempt_is_cancelled(monkeypatch, mode):
+    monkeypatch.setattr(app, "LLM_HEDGING", True)
+    monkeypatch.setattr(app, "LLM_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(app, "LLM_HEDGE_MIN_DELAY", 0.05)
+    slow, fast = FakeProvider("slow", chunks=("late",), first_delay=0.5), FakeProvider("fast")
+    router = app.LLMRouter([slow, fast])
+
+    text = collect(router) if mode == "threads" else asyncio.run(acollect(router))
+    assert text == "Hello world"
+    assert fast.calls == 1
+    assert slow.closed.wait(2)
+    # Cancelled, not failed: the slow provider's circuit is untouched
+    assert router.breakers["slow"].failures == 0
+
+
+@pytest.mark.parametrize("mode", ["threads", "async"])
+def test_timeout_mid_stream_counts_as_a_failure(mode):
+    stalled = FakeProvider("stalled", chunks=("<!DOCTYPE html>", "never"), delay=2)
+    router = app.LLMRouter([stalled])
+    router.breakers["stalled"].record(False)  # one earlier failure
+
+    with pytest.raises(RuntimeError, match="timed out"):
+        collect(router, timeout=0.3) if mode == "threads" else asyncio.run(acollect(router, timeout=0.3))
+    # The timed-out winner adds a failure instead of resetting the count with a success
+    assert router.breakers["stalled"].failures == 2
+
+
+def test_reader_stopping_early_is_a_success():
+    provider = FakeProvider("one", chunks=("a", "b", "c"))
+    router = app.LLMRouter([provider])
+    router.breakers["one"].record(False)
+    chunks = router.stream({}, 5)
+    assert next(chunks) == "a"
+    chunks.close()
+    assert router.breakers["one"].failures == 0
+
+
+def test_answers_are_recorded():
+    router = app.LLMRouter([FakeProvider("broken", error=RuntimeError("503")), FakeProvider("backup")])
+    answers = set()
+    token = app.llm_answers.set(answers)
+    try:
+        collect(router)
+    finally:
+        app.llm_answers.reset(token)
+    assert answers == {"backup:backup-model"}
@@ -0,0 +1,171 @@
+"""NotificationOutbox retries, dead-letter and replay, and the /admin/outbox endpoints"""
+import itertools
+import time
+
+import pytest
+
+import app
+
+databases = itertools.count()
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    """An outbox without dispatcher threads (the tests deliver by hand) and a scripted evaluator"""
+    monkeypatch.setattr(app, "OUTBOX_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(app, "OUTBOX_BACKOFF_BASE", 0)
+    outbox = app.NotificationOutbox(f"outbox-test-{next(databases)}.db", workers=0)
+    outbox.sent = []
+    outbox.failures = 0
+
+    def send_notification(url, payload):
+        if outbox.failures:
+            outbox.failures -= 1
+            raise RuntimeError("Evaluation URL returned 503")
+        outbox.sent.append((url, payload))
+        return True
+
+    monkeypatch.setattr(app, "send_notification", send_notification)
+    return outbox
+
+
+def deliver_due(outbox):
+    """Claims every due entry, then delivers each once. Returns how many there were."""
+    claimed = []
+    while True:
+        entry, slot = outbox._claim()
+        if not entry:
+            break
+        claimed.append((entry, slot))
+    for entry, slot in claimed:
+        try:
+            outbox._deliver(entry)
+        finally:
+            slot.release()
+    return len(claimed)
+
+
+def status(outbox, entry_id):
+    return next(entry for entry in outbox.list(limit=500) if entry["id"] == entry_id)
+
+
+def test_delivered(outbox):
+    entry_id = outbox.enqueue("http://evaluator.invalid/notify", {"round": 1})
+    assert deliver_due(outbox) == 1
+    assert outbox.sent == [("http://evaluator.invalid/notify", {"round": 1})]
+    entry = status(outbox, entry_id)
+    assert entry["status"] == "delivered"
+    assert entry["attempts"] == 1
+
+
+def test_failure_is_rescheduled_then_delivered(outbox):
+    outbox.failures = 1
+    entry_id = outbox.enqueue("http://evaluator.invalid/notify", {"round": 1})
+    assert deliver_due(outbox) == 1
+    entry = status(outbox, entry_id)
+    assert entry["status"] == "pending"
+    assert entry["last_error"] == "Evaluation URL returned 503"
+
+    assert deliver_due(outbox) == 1
+    assert status(outbox, entry_id)["status"] == "delivered"
+    assert status(outbox, entry_id)["attempts"] == 2
+
+
+def test_backoff_delays_the_retry(outbox, monkeypatch):
+    monkeypatch.setattr(app, "OUTBOX_BACKOFF_BASE", 60)
+    outbox.failures = 1
+    entry_id = outbox.enqueue("http://evaluator.invalid/notify", {})
+    deliver_due(outbox)
+    assert deliver_due(outbox) == 0  # not due yet
+    assert status(outbox, entry_id)["next_attempt_at"] >= time.time() + 30  # 60s with jitter of 0.5x-1.5x
+
+
+def test_dead_letter_and_replay(outbox):
+    outbox.failures = 3
+    entry_id = outbox.enqueue("http://evaluator.invalid/notify", {"round": 2})
+    for _ in range(3):
+        deliver_due(outbox)
+    entry = status(outbox, entry_id)
+    assert entry["status"] == "dead"
+    assert entry["attempts"] == 3
+    assert [entry["id"] for entry in outbox.list("dead")] == [entry_id]
+    assert deliver_due(outbox) == 0  # dead entries are never picked up
+
+    assert outbox.replay(entry_id)
+    assert status(outbox, entry_id)["attempts"] == 0
+    assert deliver_due(outbox) == 1
+    assert status(outbox, entry_id)["status"] == "delivered"
+    assert outbox.sent == [("http://evaluator.invalid/notify", {"round": 2})]
+
+
+def test_replay_skips_entries_being_delivered(outbox):
+    entry_id = outbox.enqueue("http://evaluator.invalid/notify", {})
+    entry, slot = outbox._claim()
+    assert entry["id"] == entry_id
+    assert not outbox.replay(entry_id)
+    slot.release()
+    assert not outbox.replay(9999)
+
+
+def test_host_concurrency(outbox, monkeypatch):
+    monkeypatch.setattr(app, "OUTBOX_HOST_CONCURRENCY", 1)
+    first = outbox.enqueue("http://one.invalid/notify", {})
+    outbox.enqueue("http://one.invalid/notify", {})
+    third = outbox.enqueue("http://two.invalid/notify", {})
+
+    entry, slot = outbox._claim()
+    assert entry["id"] == first
+    other, other_slot = outbox._claim()
+    assert other["id"] == third  # the second entry for one.invalid waits for the first
+    assert outbox._claim() == (None, None)
+    slot.release()
+    other_slot.release()
+
+
+def test_dispatcher_threads_deliver(outbox, monkeypatch):
+    outbox.workers = 1
+    outbox.failures = 1
+    entry_id = outbox.enqueue("http://evaluator.invalid/notify", {"round": 1})
+    deadline = time.time() + 5
+    while status(outbox, entry_id)["status"] != "delivered":
+        assert time.time() < deadline, "not delivered"
+        time.sleep(0.05)
+    assert status(outbox, entry_id)["attempts"] == 2
+
+
+# --- /admin/outbox ---
+
+@pytest.fixture
+def client(outbox, monkeypatch):
+    monkeypatch.setattr(app, "MY_SECRET", "s3cret")
+    monkeypatch.setattr(app, "notification_outbox", outbox)
+    return app.app.test_client()
+
+
+def test_admin_list_and_replay(client, outbox):
+    outbox.failures = 3
+    entry_id = outbox.enqueue("http://evaluator.invalid/notify", {})
+    for _ in range(3):
+        deliver_due(outbox)
+
+    assert client.get("/admin/outbox").status_code == 401
+    response = client.get("/admin/outbox?status=dead", headers={"X-Secret": "s3cret"})
+    assert response.status_code == 200
+    assert [entry["id"] for entry in response.get_json()["entries"]] == [entry_id]
+
+    assert client.post(f"/admin/outbox/{entry_id}/replay", headers={"X-Secret": "s3cret"}).status_code == 202
+    assert client.post("/admin/outbox/9999/replay", headers={"X-Secret": "s3cret"}).status_code == 404
+
+
+@pytest.mark.parametrize("query", ["limit=ten", "offset=x", "limit=1.5", "limit=0", "offset=-1"])
+def test_admin_list_rejects_bad_pagination(client, query):
+    response = client.get(f"/admin/outbox?{query}", headers={"X-Secret": "s3cret"})
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_admin_list_pagination(client, outbox):
+    ids = [outbox.enqueue("http://evaluator.invalid/notify", {"n": n}) for n in range(3)]
+    response = client.get("/admin/outbox?limit=2&offset=1", headers={"X-Secret": "s3cret"})
+    assert [entry["id"] for entry in response.get_json()["entries"]] == ids[::-1][1:3]
+    assert client.get("/admin/outbox?limit=9999", headers={"X-Secret": "s3cret"}).get_json()["limit"] == 500
@@ -0,0 +1,125 @@
+"""check_references / page_problems: what the checks refer to and whether the page has it"""
+import pytest
+
+import app
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css">
+</head>
+<body>
+<h1 id="title" class="display-4 heading">Sales</h1>
+<table id="sales-table" data-region="north"><tbody></tbody></table>
+<div id="bad">flag</div>
+<button id="item-1" class="btn item-btn">One</button>
+<script>
+const total = document.createElement('p');
+total.id = 'total-sales';
+total.className = 'summary big';
+document.body.appendChild(total);
+</script>
+</body>
+</html>"""
+
+
+def refs(*checks):
+    return app.check_references(list(checks))
+
+
+def test_ids():
+    assert refs("document.getElementById('title')") == {("id", "title")}
+    assert refs("document.querySelector('#sales-table tbody')") == {("id", "sales-table"), ("tag", "tbody")}
+    assert refs("Page shows #total-sales with the sum") == {("id", "total-sales")}
+
+
+def test_classes_and_tags():
+    assert refs("document.querySelectorAll('.item-btn').length > 0") == {("class", "item-btn")}
+    assert refs("document.querySelector('h1.heading:first-child')") == {("tag", "h1"), ("class", "heading")}
+    # Names that are not HTML elements are not tags
+    assert refs("document.querySelector('widget')") == set()
+
+
+def test_attribute_selectors():
+    assert refs("document.querySelector('table[data-region=\"north\"]')") == {
+        ("tag", "table"), ("attribute", "data-region")
+    }
+    assert refs("document.querySelector('[aria-label]')") == {("attribute", "aria-label")}
+
+
+def test_templated_ids_and_classes():
+    assert refs("document.getElementById(`item-${i}`)") == {("id_prefix", "item-")}
+    assert refs("document.querySelector(`#item-${seed} .label-${n}`)") == {
+        ("id_prefix", "item-"), ("class_prefix", "label-")
+    }
+    assert refs("Each row has #row-{index}") == {("id_prefix", "row-")}
+    # Nothing fixed to check
+    assert refs("document.getElementById(`${prefix}-1`)") == set()
+
+
+def test_locator_engines():
+    assert refs("page.locator('text=Total')") == set()
+    assert refs("page.locator('role=button[name=\"OK\"]')") == set()
+    assert refs("page.locator('\"Submit\"')") == set()
+    assert refs("page.locator('id=title')") == {("id", "title")}
+    assert refs("page.locator('css=#title >> text=Sales')") == {("id", "title")}
+
+
+def test_hex_colours_only_in_css_values():
+    assert refs("The heading has color: #fff") == set()
+    assert refs("background-color is #abcdef") == set()
+    assert refs("getComputedStyle(el).color === '#ff0000'") == set()
+    # Hex-looking ids outside a CSS value are ids
+    assert refs("Element #bad shows a flag") == {("id", "bad")}
+    assert refs("Buttons #add and #face exist") == {("id", "add"), ("id", "face")}
+
+
+def test_page_problems_passes_when_everything_is_present():
+    checks = [
+        "document.getElementById('title')",
+        "document.querySelector('#sales-table tbody')",
+        "#bad is visible",
+        "document.getElementById(`item-${i}`)",
+        "document.querySelector('#total-sales.summary')",
+        "table[data-region]",
+        "Page uses Bootstrap",
+    ]
+    assert app.page_problems(PAGE, checks, []) == []
+
+
+def test_page_problems_reports_missing_references():
+    checks = [
+        "document.getElementById('chart')",
+        "document.querySelector('.missing-class')",
+        "document.getElementById(`row-${i}`)",
+        "document.querySelector('canvas')",
+        "#face is shown",
+    ]
+    assert app.page_problems(PAGE, checks, []) == [
+        'no element with class "missing-class"',
+        'no element with id="chart"',
+        'no element with id="face"',
+        'no element with an id starting with "row-"',
+        "no <canvas> element",
+    ]
+
+
+def test_required_libraries():
+    problems = app.page_problems(PAGE, ["Chart.js renders the totals", "Uses Bootstrap"], [])
+    assert problems == ["Chart.js is not loaded from a CDN <script>/<link>"]
+
+    csv = [{"name": "data.csv", "mime": "text/csv"}]
+    assert app.page_problems(PAGE, [], csv) == ["PapaParse is not loaded from a CDN <script>/<link>"]
+
+
+@pytest.mark.parametrize("use_lxml", [True, False])
+def test_index_page_parsers(monkeypatch, use_lxml):
+    if use_lxml and app.lxml is None:
+        pytest.skip("lxml is not installed")
+    if not use_lxml:
+        monkeypatch.setattr(app, "lxml", None)
+    index = app.index_page(PAGE)
+    assert {"title", "sales-table", "bad", "item-1"} <= index.ids
+    assert {"display-4", "heading", "btn", "item-btn"} <= index.classes
+    assert "data-region" in index.attributes
+    assert "total.id = 'total-sales';" in index.script_text
@@ -0,0 +1,126 @@
+"""Prompt templates, truncation helpers and fit_prompt's budget"""
+import functools
+
+import app
+import prompts
+from prompts import estimate_tokens
+
+
+def words(n):
+    return " ".join(f"word{i}" for i in range(n))
+
+
+def test_estimate_tokens_rounds_up():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a") == 1
+    assert estimate_tokens("a" * prompts.PROMPT_CHARS_PER_TOKEN * 3) == 3
+
+
+def test_template_render():
+    template = prompts.PromptTemplate("Task: {brief}\nChecks:\n{checks}\nDone.")
+    assert template.render(brief="b", checks="- c") == "Task: b\nChecks:\n- c\nDone."
+    assert template.static_tokens == estimate_tokens("Task: \nChecks:\n\nDone.")
+
+
+def test_templates_take_the_fields_app_passes():
+    fields = {field for field in prompts.HTML_PROMPT.fields if field}
+    assert fields == {"brief", "attachments_header", "attachments", "csv_instructions", "checks"}
+    assert {field for field in prompts.REVISION_PROMPT.fields if field} == {
+        "current_html", "brief", "attachments_header", "attachments", "checks"
+    }
+
+
+def test_truncate_text():
+    assert prompts.truncate_text("short", 10) == "short"
+
+    text = words(400)
+    cut = prompts.truncate_text(text, 50)
+    assert cut.endswith(" [...truncated]")
+    assert estimate_tokens(cut) <= 50
+    assert text.startswith(cut[:-len(" [...truncated]")] + " ")  # cut at a word boundary
+
+
+def test_truncate_items_keeps_whole_lines():
+    items = [f"- check number {i}" for i in range(100)]
+    text = prompts.truncate_items(items, 40, noun="checks")
+    lines = text.splitlines()
+    assert lines[:-1] == items[:len(lines) - 1]
+    assert lines[-1] == f"- ... {100 - (len(lines) - 1)} more checks omitted"
+    assert prompts.truncate_items(items[:2], 40) == "\n".join(items[:2])
+
+
+def test_truncate_attachments_shortens_summaries_first():
+    items = [f"- file{i}.csv (text/csv): load with fetch('./file{i}.csv')\n  {words(300)}" for i in range(3)]
+    text = prompts.truncate_attachments(items, 300)
+    assert "more attachments omitted" not in text
+    for i in range(3):
+        assert f"- file{i}.csv" in text
+    assert text.count("[...truncated]") == 3
+
+
+def test_truncate_attachments_drops_attachments_when_names_do_not_fit():
+    items = [f"- {'x' * 80}{i}.csv (text/csv): load\n  summary" for i in range(20)]
+    text = prompts.truncate_attachments(items, 100)
+    assert text.splitlines()[-1].endswith("more attachments omitted")
+
+
+def fit(sections, budget, fixed=None):
+    template = prompts.PromptTemplate("{a}|{b}|{c}")
+    return prompts.fit_prompt(template, fixed or {}, sections, budget)
+
+
+def test_fit_prompt_under_budget_is_unchanged():
+    text, tokens, shrunk = fit([("a", "one", prompts.truncate_text, 1),
+                                ("b", ["x", "y"], prompts.truncate_items, 1)], 100, {"c": "fixed"})
+    assert text == "one|x\ny|fixed"
+    assert shrunk == []
+    assert tokens == estimate_tokens("||") + estimate_tokens("one") + estimate_tokens("x\ny") + estimate_tokens("fixed")
+
+
+def test_fit_prompt_gives_up_earlier_sections_first():
+    brief, checks = words(200), [f"- check {i}" for i in range(5)]
+    text, tokens, shrunk = fit([("a", brief, prompts.truncate_text, 10),
+                                ("b", checks, prompts.truncate_items, 10)], 100, {"c": ""})
+    assert shrunk == ["a"]
+    assert tokens <= 100
+    assert text.endswith("|" + "\n".join(checks) + "|")
+
+
+def test_fit_prompt_respects_floors():
+    text, tokens, shrunk = fit([("a", words(200), prompts.truncate_text, 150),
+                                ("b", words(200), prompts.truncate_text, 150)], 100, {"c": ""})
+    assert shrunk == ["a", "b"]
+    a, b, _ = text.split("|")
+    assert 140 <= estimate_tokens(a) <= 150
+    assert 140 <= estimate_tokens(b) <= 150
+    assert tokens > 100  # the floors win over the budget
+
+
+def test_fit_prompt_skips_sections_already_at_their_floor():
+    text, tokens, shrunk = fit([("a", "tiny", prompts.truncate_text, 10),
+                                ("b", words(200), prompts.truncate_text, 10)], 50, {"c": ""})
+    assert shrunk == ["b"]
+    assert text.startswith("tiny|")
+
+
+def test_html_prompt_stays_within_budget():
+    checks = [f"document.querySelector('#item-{i}') exists and shows a number" for i in range(600)]
+    payload = app.build_html_payload(words(1000), [], checks)
+    prompt = payload["contents"][0]["parts"][0]["text"]
+
+    assert estimate_tokens(prompt) <= prompts.PROMPT_TOKEN_BUDGET
+    assert "[...truncated]" in prompt
+    assert "more checks omitted" in prompt
+    assert "llm_prompt_truncations_total{prompt=\"html\"}" in app.metrics.render()
+
+
+def test_revision_budget_excludes_the_current_page():
+    page = "<!DOCTYPE html><html><body>" + "<p>row</p>" * 10000 + "</body></html>"
+    prompt = app.render_prompt("revision", prompts.REVISION_PROMPT, {
+        "current_html": page, "attachments_header": "", "attachments": "",
+    }, [
+        ("brief", "Add a footer", prompts.truncate_text, 500),
+        ("checks", ["- footer exists"], functools.partial(prompts.truncate_items, noun="checks"), 500),
+    ], budget=prompts.PROMPT_TOKEN_BUDGET + estimate_tokens(page))
+    assert page in prompt
+    assert "Add a footer" in prompt
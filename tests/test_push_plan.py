@@ -0,0 +1,83 @@
+"""plan_push: which files a push uploads, given the local repo state"""
+import itertools
+
+import pytest
+
+import app
+
+stores = itertools.count()
+PAGE = "<!DOCTYPE html><html><body>v1</body></html>"
+
+
+@pytest.fixture
+def state(monkeypatch):
+    """A fresh RepoStateStore in place of app.repo_state"""
+    store = app.RepoStateStore(f"repo-state-test-{next(stores)}.db", 1024)
+    monkeypatch.setattr(app, "repo_state", store)
+    return store
+
+
+def pushed(state, files, commit_sha="c1", replace=True):
+    """Records `files` as the repo's content at `commit_sha`, as push_steps does after a push"""
+    raw_files, blob_shas, _ = app.plan_push("demo", files, False)
+    state.record_push("demo", raw_files, blob_shas, commit_sha, "t1", replace)
+
+
+def test_git_blob_sha_matches_git():
+    assert app.git_blob_sha(b"hello") == "b6fc4c620b67d95f953a5c1c1230aaab5db5a1b0"  # git hash-object
+    assert app.git_blob_sha(b"") == "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+
+
+def test_first_push_uploads_everything(state):
+    raw_files, blob_shas, head = app.plan_push("demo", {"index.html": PAGE, "logo.png": b"\x89PNG"}, True)
+    assert raw_files == {"index.html": PAGE.encode(), "logo.png": b"\x89PNG"}
+    assert blob_shas == {path: app.git_blob_sha(raw) for path, raw in raw_files.items()}
+    assert head is None
+
+
+def test_unchanged_files_are_skipped(state):
+    pushed(state, {"index.html": PAGE, "README.md": "# Demo"})
+
+    raw_files, blob_shas, head = app.plan_push("demo", {"index.html": "<html>v2</html>", "README.md": "# Demo"}, True)
+    assert raw_files == {"index.html": b"<html>v2</html>"}
+    assert set(blob_shas) == {"index.html", "README.md"}  # the tree still needs every path
+    assert head is None
+
+
+def test_nothing_changed_returns_the_head(state):
+    pushed(state, {"index.html": PAGE, "README.md": "# Demo"}, commit_sha="c7")
+
+    raw_files, _, head = app.plan_push("demo", {"index.html": PAGE}, True)
+    assert raw_files == {}
+    assert head == "c7"
+
+
+def test_replacing_the_tree_uploads_everything(state):
+    pushed(state, {"index.html": PAGE})
+
+    raw_files, _, head = app.plan_push("demo", {"index.html": PAGE}, False)
+    assert raw_files == {"index.html": PAGE.encode()}
+    assert head is None
+
+
+def test_other_repos_do_not_count(state):
+    pushed(state, {"index.html": PAGE})
+    raw_files, _, head = app.plan_push("other", {"index.html": PAGE}, True)
+    assert raw_files == {"index.html": PAGE.encode()}
+    assert head is None
+
+
+def test_second_push_of_the_same_files_makes_no_calls(github, state):
+    app.create_github_repo("plan-demo", {"html": PAGE, "readme": "# Demo"}, "brief", 1)
+    head = github.repos["plan-demo"]["head"]
+    github.requests.clear()
+
+    assert app.push_files("plan-demo", {"index.html": PAGE, "README.md": "# Demo"}, "Same again") == head
+    assert github.requests == []
+
+    github.requests.clear()
+    commit_sha = app.push_files("plan-demo", {"index.html": "<html>v2</html>"}, "Update page")
+    assert commit_sha != head
+    assert [path for method, path in github.requests if path.endswith("/git/blobs")] == [
+        "/repos/bench/plan-demo/git/blobs"  # one blob, for the changed page only
+    ]
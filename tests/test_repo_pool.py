@@ -0,0 +1,117 @@
+"""RepoPool refill, claim and adoption against benchmark.py's mock GitHub"""
+import itertools
+import time
+
+import pytest
+
+import app
+
+pools = itertools.count()
+
+
+@pytest.fixture
+def pool(github, monkeypatch):
+    """A two-repo pool in place of app.repo_pool (refill thread not started)"""
+    pool = app.RepoPool(f"repo-pool-test-{next(pools)}.db", 2, 0.01)
+    monkeypatch.setattr(app, "repo_pool", pool)
+    monkeypatch.setattr(app, "REPO_POOL_SIZE", 2)
+    monkeypatch.setattr(app, "GITHUB_TOKEN", "test-token")
+    return pool
+
+
+def placeholders(github):
+    return sorted(name for name in github.repos if name.startswith(app.REPO_POOL_PREFIX))
+
+
+def claim(repo_name):
+    return app.run_steps(app.claim_pool_repo_steps(repo_name, "A brief"))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_create_enables_pages(github, pool):
+    pool._create()
+    assert pool.counts() == {"ready": 1}
+    (name,) = placeholders(github)
+    assert ("POST", f"/repos/bench/{name}/pages") in github.requests
+
+
+def test_take_oldest_then_empty(github, pool):
+    pool._create()
+    pool._create()
+    first = min(placeholders(github), key=lambda name: github.requests.index(("POST", f"/repos/bench/{name}/pages")))
+    assert pool.take() == first
+    assert pool.take() not in (None, first)
+    assert pool.take() is None
+    assert pool.counts() == {"claimed": 2}
+
+
+def test_claim_renames_a_placeholder(github, pool):
+    pool._create()
+    (name,) = placeholders(github)
+
+    assert claim("my-app") == "https://github.com/bench/my-app"
+    assert "my-app" in github.repos
+    assert placeholders(github) == []
+    assert pool.counts() == {}
+    assert pool.pages_ready("my-app")
+    assert not pool.pages_ready("my-app")  # only once
+
+
+def test_claim_from_an_empty_pool(github, pool):
+    assert claim("my-app") is None
+    assert "my-app" not in github.repos
+
+
+def test_name_taken_returns_the_placeholder(github, pool):
+    app.create_github_repo("taken", {"html": "<!DOCTYPE html><html></html>", "readme": "# Taken"}, "brief", 1)
+    pool._create()
+
+    assert claim("taken") is None
+    assert pool.counts() == {"ready": 1}  # back in the pool for the next build
+    assert len(placeholders(github)) == 1
+
+
+def test_lost_placeholder_is_forgotten(github, pool):
+    pool._create()
+    (name,) = placeholders(github)
+    del github.repos[name]  # deleted on GitHub behind our back
+
+    assert claim("my-app") is None
+    assert pool.counts() == {}
+
+
+def test_refill_thread_keeps_the_pool_full(github, pool):
+    pool.start()
+    wait_for(lambda: pool.counts().get("ready") == 2)
+    assert claim("my-app")
+    wait_for(lambda: pool.counts().get("ready") == 2)  # take() wakes the refill thread at once
+    assert len(placeholders(github)) == 2
+
+
+def test_start_drops_stale_claims(github, pool, monkeypatch):
+    monkeypatch.setattr(pool, "_run", lambda: None)
+    pool._create()
+    pool.take()
+    with pool.lock:
+        db = pool._db()
+        with db:
+            db.execute("UPDATE repo_pool SET updated_at = ?", (time.time() - 3600,))
+    pool.start()
+    assert pool.counts() == {}
+
+
+def test_unused_build_repo_is_adopted_not_deleted(github, pool):
+    repo_url, _ = app.provision_github_repo("job", "spare-app", "brief")
+    github.requests.clear()
+
+    app.release_provisioned_repo("spare-app", repo_url)
+    assert "spare-app" not in github.repos
+    assert not [path for method, path in github.requests if method == "DELETE"]
+    assert pool.counts() == {"ready": 1}
+    assert claim("next-app") == "https://github.com/bench/next-app"
@@ -0,0 +1,88 @@
+"""Round 1 repo creation, reuse and speculative provisioning against benchmark.py's mock GitHub"""
+import pytest
+
+import app
+
+GENERATED = {"html": "<!DOCTYPE html><html><body>new</body></html>", "readme": "# New"}
+
+
+def calls(github, method):
+    return [path for verb, path in github.requests if verb == method]
+
+
+def test_create_repo(github):
+    repo_url, commit_sha = app.create_github_repo("Demo App", dict(GENERATED), "brief", 1)
+
+    assert repo_url == "https://github.com/bench/demo-app"
+    repo = github.repos["demo-app"]
+    assert repo["head"] == commit_sha
+    assert set(github.trees[repo["commits"][commit_sha]]) == {"index.html", "README.md", "LICENSE"}
+
+
+def test_existing_repo_is_reused_not_deleted(github):
+    app.create_github_repo("demo", dict(GENERATED, html="<!DOCTYPE html><html>old</html>"), "brief", 1)
+    github.requests.clear()
+
+    repo_url, commit_sha = app.create_github_repo("demo", dict(GENERATED), "brief", 1)
+
+    assert repo_url == "https://github.com/bench/demo"
+    assert calls(github, "DELETE") == []
+    assert "/repos/bench/demo" in calls(github, "GET")
+    # The new commit replaces the old tree
+    repo = github.repos["demo"]
+    assert repo["head"] == commit_sha
+    tree = github.trees[repo["commits"][commit_sha]]
+    assert github.blobs[tree["index.html"]] == app.base64.b64encode(GENERATED["html"].encode()).decode()
+
+
+def build(task, generated, monkeypatch):
+    """Runs build_steps for a Round 1 build whose LLM returns `generated`"""
+    monkeypatch.setattr(app, "SPECULATIVE_REPOS", True)
+    monkeypatch.setattr(app, "PAGE_VALIDATION", False)
+    monkeypatch.setattr(app, "generate_code_with_llm", lambda *args: dict(generated) if generated else None)
+    data = {"task": task, "round": 1, "brief": "brief", "checks": [], "attachments": []}
+    return app.run_steps(app.build_steps(f"job-{task}", data))
+
+
+def test_speculative_provisioning_leaves_an_existing_repo_alone(github):
+    app.create_github_repo("spec-existing", dict(GENERATED), "brief", 1)
+    head = github.repos["spec-existing"]["head"]
+    github.requests.clear()
+
+    assert app.provision_github_repo("job", "spec-existing", "brief") == (None, None)
+    assert calls(github, "DELETE") == []
+    assert calls(github, "PATCH") == []
+    assert github.repos["spec-existing"]["head"] == head
+
+
+def test_speculative_build_reuses_an_existing_repo(github, monkeypatch):
+    app.create_github_repo("spec-rebuild", dict(GENERATED, html="<!DOCTYPE html><html>old</html>"), "brief", 1)
+    github.requests.clear()
+
+    result = build("spec-rebuild", GENERATED, monkeypatch)
+
+    assert result["repo_url"] == "https://github.com/bench/spec-rebuild"
+    assert github.repos["spec-rebuild"]["head"] == result["commit_sha"]
+    assert calls(github, "DELETE") == []
+
+
+def test_failed_generation_releases_the_provisioned_repo(github, monkeypatch):
+    with pytest.raises(RuntimeError, match="Failed to generate code"):
+        build("spec-failed", None, monkeypatch)
+
+    # Provisioning created it during generation; release deleted it again
+    assert ("POST", "/user/repos") in github.requests
+    assert calls(github, "DELETE") == ["/repos/bench/spec-failed"]
+    assert "spec-failed" not in github.repos
+
+
+def test_failed_generation_keeps_an_existing_repo(github, monkeypatch):
+    app.create_github_repo("spec-kept", dict(GENERATED), "brief", 1)
+    head = github.repos["spec-kept"]["head"]
+    github.requests.clear()
+
+    with pytest.raises(RuntimeError, match="Failed to generate code"):
+        build("spec-kept", None, monkeypatch)
+
+    assert calls(github, "DELETE") == []
+    assert github.repos["spec-kept"]["head"] == head
@@ -0,0 +1,115 @@
+"""SEARCH/REPLACE patches for Round 2 revisions"""
+import uuid
+
+import pytest
+
+import app
+
+PAGE = """<!DOCTYPE html>
+<html>
+<body>
+<h1 id="title">Sales</h1>
+<ul><li>a</li><li>a</li></ul>
+<pre>
+before
+=======
+after
+</pre>
+<script>
+// =======
+const total = 1;
+</script>
+</body>
+</html>"""
+
+
+def block(search, replace):
+    return f"<<<<<<< SEARCH\n{search}\n=======\n{replace}\n>>>>>>> REPLACE"
+
+
+def test_parse_blocks():
+    text = "Here are the edits:\n" + block("a", "b") + "\n\n" + block("c\nd", "e") + "\nDone."
+    assert app.parse_search_replace_blocks(text) == [("a", "b"), ("c\nd", "e")]
+    assert app.parse_search_replace_blocks(text.replace("\n", "\r\n")) == [("a", "b"), ("c\nd", "e")]
+    assert app.parse_search_replace_blocks("no blocks here") == []
+
+
+def test_single_match():
+    blocks = app.parse_search_replace_blocks(block('<h1 id="title">Sales</h1>', '<h1 id="title">Sales 2024</h1>'))
+    revised = app.apply_search_replace_blocks(PAGE, blocks)
+    assert '<h1 id="title">Sales 2024</h1>' in revised
+    assert revised.replace("Sales 2024", "Sales") == PAGE
+
+
+def test_no_match():
+    blocks = app.parse_search_replace_blocks(block("<h2>Missing</h2>", "<h2>New</h2>"))
+    with pytest.raises(ValueError, match="found 0 times"):
+        app.apply_search_replace_blocks(PAGE, blocks)
+
+
+def test_multiple_matches():
+    blocks = app.parse_search_replace_blocks(block("<li>a</li>", "<li>b</li>"))
+    with pytest.raises(ValueError, match="found 2 times"):
+        app.apply_search_replace_blocks(PAGE, blocks)
+
+
+def test_no_blocks():
+    with pytest.raises(ValueError, match="No SEARCH/REPLACE blocks"):
+        app.apply_search_replace_blocks(PAGE, [])
+
+
+def test_empty_replace_deletes():
+    blocks = app.parse_search_replace_blocks(block("<ul><li>a</li><li>a</li></ul>", ""))
+    assert blocks == [("<ul><li>a</li><li>a</li></ul>", "")]
+    revised = app.apply_search_replace_blocks(PAGE, blocks)
+    assert "<ul>" not in revised
+    assert revised.endswith("</html>")
+
+
+def test_result_must_stay_a_document():
+    blocks = app.parse_search_replace_blocks(block("</body>\n</html>", "</body>"))
+    with pytest.raises(ValueError, match="not complete HTML"):
+        app.apply_search_replace_blocks(PAGE, blocks)
+
+
+def test_divider_inside_a_line_is_page_text():
+    blocks = app.parse_search_replace_blocks(block("// =======\nconst total = 1;", "// =======\nconst total = 2;"))
+    assert blocks == [("// =======\nconst total = 1;", "// =======\nconst total = 2;")]
+    assert "const total = 2;" in app.apply_search_replace_blocks(PAGE, blocks)
+
+
+def test_divider_line_inside_the_page():
+    text = block("before\n=======\nafter", "before\n-------\nafter")
+    # Without the page the first divider line wins; with it, the longest SEARCH that is on the page
+    assert app.parse_search_replace_blocks(text)[0] == ("before", "after\n=======\nbefore\n-------\nafter")
+    blocks = app.parse_search_replace_blocks(text, PAGE)
+    assert blocks == [("before\n=======\nafter", "before\n-------\nafter")]
+    assert "before\n-------\nafter" in app.apply_search_replace_blocks(PAGE, blocks)
+
+
+def test_round2_patch_keeps_the_readme(github, monkeypatch):
+    monkeypatch.setattr(app, "SPECULATIVE_REPOS", False)
+    monkeypatch.setattr(app, "PAGE_VALIDATION", False)
+    monkeypatch.setattr(app, "GENERATION_CACHE_ENABLED", False)
+    task = f"patch-{uuid.uuid4().hex[:8]}"
+    app.create_github_repo(task, {"html": PAGE, "readme": "# Sales app\n"}, "brief", 1)
+    monkeypatch.setattr(app, "generate_revision_with_llm", lambda html_code, brief, checks, attachments:
+                        html_code.replace("Sales</h1>", "Sales by region</h1>"))
+    monkeypatch.setattr(app, "generate_code_with_llm", lambda *args: pytest.fail("regenerated instead of patched"))
+
+    data = {"task": task, "round": 2, "brief": "Group by region", "checks": [], "attachments": []}
+    result = app.run_steps(app.build_steps(uuid.uuid4().hex, data))
+
+    repo = github.repos[task]
+    tree = github.trees[repo["commits"][result["commit_sha"]]]
+    read = lambda path: app.base64.b64decode(github.blobs[tree[path]]).decode()
+    assert "Sales by region</h1>" in read("index.html")
+    readme = read("README.md")
+    assert readme.startswith("# Sales app\n")
+    assert "## Round 2 Enhancement" in readme and "Group by region" in readme
+
+
+def test_divider_line_inside_the_replacement():
+    text = block('<h1 id="title">Sales</h1>', "<pre>\n=======\n</pre>")
+    blocks = app.parse_search_replace_blocks(text, PAGE)
+    assert blocks == [('<h1 id="title">Sales</h1>', "<pre>\n=======\n</pre>")]
@@ -0,0 +1,89 @@
+"""Retries of a build that failed after generation reuse its files only for the same prompt"""
+import uuid
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def pipeline(github, monkeypatch):
+    """Runs Round 1 builds through build_steps; `fail_push` makes the next repo push fail"""
+    monkeypatch.setattr(app, "SPECULATIVE_REPOS", False)
+    monkeypatch.setattr(app, "PAGE_VALIDATION", False)
+    monkeypatch.setattr(app, "GENERATION_CACHE_ENABLED", True)
+
+    class Pipeline:
+        def __init__(self):
+            self.generations = []
+            self.fail_push = False
+
+        def generate(self, brief, attachments, checks, task):
+            self.generations.append(brief)
+            html = f"<!DOCTYPE html><html><body>{brief} #{len(self.generations)}</body></html>"
+            return {"html": html, "readme": "# Readme"}
+
+        def run(self, data):
+            job_id = uuid.uuid4().hex
+            app.build_ledger.open(job_id, data)
+            try:
+                result = app.run_steps(app.build_steps(job_id, data))
+            except RuntimeError as e:
+                app.build_ledger.close({"id": job_id, "status": "failed", "error": str(e)})
+                return None
+            app.build_ledger.close({"id": job_id, "status": "succeeded", "result": result})
+            return result
+
+    pipeline = Pipeline()
+    create_github_repo = app.create_github_repo
+
+    def flaky_create_github_repo(*args, **kwargs):
+        if pipeline.fail_push:
+            pipeline.fail_push = False
+            return None, None
+        return create_github_repo(*args, **kwargs)
+
+    monkeypatch.setattr(app, "generate_code_with_llm", pipeline.generate)
+    monkeypatch.setattr(app, "create_github_repo", flaky_create_github_repo)
+    return pipeline
+
+
+def request(**overrides):
+    data = {"task": f"reuse-{uuid.uuid4().hex[:8]}", "round": 1, "brief": "Show sales",
+            "checks": ["#total exists"], "attachments": []}
+    data.update(overrides)
+    return data
+
+
+def pushed_html(github, result):
+    repo = github.repos[result["repo_url"].rsplit("/", 1)[1]]
+    blob = github.trees[repo["commits"][result["commit_sha"]]]["index.html"]
+    return app.base64.b64decode(github.blobs[blob]).decode()
+
+
+def test_retry_reuses_the_generated_files(github, pipeline):
+    data = request()
+    pipeline.fail_push = True
+    assert pipeline.run(data) is None
+
+    result = pipeline.run(dict(data))
+    assert pipeline.generations == ["Show sales"]  # generated once
+    assert pushed_html(github, result).endswith("Show sales #1</body></html>")
+
+
+@pytest.mark.parametrize("change", [{"brief": "Show sales by region"}, {"checks": ["#region exists"]}])
+def test_changed_prompt_is_generated_again(github, pipeline, change):
+    data = request()
+    pipeline.fail_push = True
+    assert pipeline.run(data) is None
+
+    result = pipeline.run(dict(data, **change))
+    assert len(pipeline.generations) == 2
+    assert pushed_html(github, result).endswith("#2</body></html>")
+
+
+def test_succeeded_round_is_not_reused(github, pipeline):
+    data = request()
+    assert pipeline.run(data) is not None
+    assert pipeline.run(dict(data)) is not None
+    assert len(pipeline.generations) == 2